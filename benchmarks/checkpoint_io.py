@@ -0,0 +1,204 @@
+"""Benchmark of the checkpoint saving and of the model loading for inference.
+
+Saving: synchronous torch.save of the full and of the weights-only
+checkpoint against BackgroundCheckpointIO, whose training thread only
+copies the tensors, and the safetensors export. Loading: every file is
+loaded by load_module in a new interpreter, like an inference process
+starts, and the first forward pass is timed too.
+"""
+import argparse
+import os
+import subprocess  # noqa: S404
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import torch
+from pytorch_lightning.plugins import TorchCheckpointIO
+
+from src.checkpointing import BackgroundCheckpointIO, export_safetensors
+from src.config import Config
+from src.lightning_module import PosterModule
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOAD_SCRIPT = """
+import sys, time
+import torch
+start = time.perf_counter()
+from src.predict import load_module
+import_time = time.perf_counter()
+module = load_module(sys.argv[1])
+load_time = time.perf_counter()
+with torch.inference_mode():
+    module(torch.rand(1, 3, int(sys.argv[2]), int(sys.argv[3])))
+forward_time = time.perf_counter()
+print(import_time - start, load_time - import_time, forward_time - load_time)
+"""
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', type=str, help='config file')
+    parser.add_argument('--model_name', type=str, default=None)
+    parser.add_argument('--n_repeats', type=int, default=3)
+    return parser.parse_args()
+
+
+def get_checkpoint(config: Config) -> dict:
+    """Checkpoint of the module after an optimizer step, like Lightning.
+
+    Args:
+        config (Config): config
+
+    Returns:
+        dict: checkpoint with the optimizer state and the hyperparameters
+    """
+    module = PosterModule(config)
+    optimizer = torch.optim.AdamW(module.parameters())
+    images = torch.rand(
+        2, 3, config.data_config.height, config.data_config.width,
+    )
+    module(images).sum().backward()
+    optimizer.step()
+    return {
+        'state_dict': module.state_dict(),
+        'optimizer_states': [optimizer.state_dict()],
+        'hyper_parameters': {'config': config},
+    }
+
+
+def measure_save(
+    checkpoint: dict,
+    dirpath: str,
+) -> List[Tuple[str, float, float, str]]:
+    """Save the checkpoint with every writer.
+
+    Args:
+        checkpoint (dict): checkpoint
+        dirpath (str): folder of the files
+
+    Returns:
+        List[Tuple[str, float, float, str]]: name, ms on the training thread,
+        total ms and path of every file
+    """
+    records = []
+    weights_only = {
+        key: checkpoint_value
+        for key, checkpoint_value in checkpoint.items()
+        if key != 'optimizer_states'
+    }
+    for name, saved in (('full', checkpoint), ('weights only', weights_only)):
+        path = os.path.join(
+            dirpath, '{name}.ckpt'.format(name=name.replace(' ', '_')),
+        )
+        start_time = time.perf_counter()
+        TorchCheckpointIO().save_checkpoint(saved, path)
+        total_ms = (time.perf_counter() - start_time) * 1000
+        records.append(
+            ('{name}, sync'.format(name=name), total_ms, total_ms, path),
+        )
+
+    checkpoint_io = BackgroundCheckpointIO()
+    path = os.path.join(dirpath, 'async.ckpt')
+    start_time = time.perf_counter()
+    checkpoint_io.save_checkpoint(checkpoint, path)
+    stall_ms = (time.perf_counter() - start_time) * 1000
+    checkpoint_io.teardown()
+    total_ms = (time.perf_counter() - start_time) * 1000
+    records.append(('full, background', stall_ms, total_ms, path))
+
+    start_time = time.perf_counter()
+    path = export_safetensors(os.path.join(dirpath, 'full.ckpt'))
+    total_ms = (time.perf_counter() - start_time) * 1000
+    records.append(('safetensors export', total_ms, total_ms, path))
+    return records
+
+
+def measure_load(path: str, config: Config) -> Dict[str, float]:
+    """Load the file with load_module in a new interpreter.
+
+    Args:
+        path (str): checkpoint or .safetensors file
+        config (Config): config
+
+    Returns:
+        Dict[str, float]: import, load and first forward time in ms
+    """
+    completed = subprocess.run(  # noqa: S603
+        [
+            sys.executable,
+            '-c',
+            LOAD_SCRIPT,
+            path,
+            str(config.data_config.height),
+            str(config.data_config.width),
+        ],
+        capture_output=True,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=PROJECT_PATH),
+        check=True,
+    )
+    import_time, load_time, forward_time = map(float, completed.stdout.split())
+    return {
+        'import': import_time * 1000,
+        'load': load_time * 1000,
+        'forward': forward_time * 1000,
+    }
+
+
+def main():  # noqa: WPS210
+    """Run the benchmark."""
+    args = arg_parse()
+    config = Config.from_yaml(args.config)
+    config.model_kwargs['pretrained'] = False
+    if args.model_name is not None:
+        config.model_kwargs['model_name'] = args.model_name
+    checkpoint = get_checkpoint(config)
+    with tempfile.TemporaryDirectory() as dirpath:
+        save_records = []
+        for _ in range(args.n_repeats):
+            save_records.append(measure_save(checkpoint, dirpath))
+        print('| save | MB | training thread, ms | total, ms |')
+        print('| --- | --- | --- | --- |')
+        for name, _, _, path in save_records[0]:
+            runs = [
+                record
+                for records in save_records
+                for record in records
+                if record[0] == name
+            ]
+            print('| {name} | {mb:.1f} | {stall:.0f} | {total:.0f} |'.format(
+                name=name,
+                mb=os.path.getsize(path) / 2 ** 20,
+                stall=min(run[1] for run in runs),
+                total=min(run[2] for run in runs),
+            ))
+
+        print()
+        print('| load_module | import, ms | load, ms | first forward, ms |')
+        print('| --- | --- | --- | --- |')
+        for name, path in (
+            ('full checkpoint', os.path.join(dirpath, 'full.ckpt')),
+            (
+                'weights-only checkpoint',
+                os.path.join(dirpath, 'weights_only.ckpt'),
+            ),
+            ('safetensors', os.path.join(dirpath, 'full.safetensors')),
+        ):
+            runs = [measure_load(path, config) for _ in range(args.n_repeats)]
+            print('| {name} | {imp:.0f} | {load:.0f} | {forward:.0f} |'.format(
+                name=name,
+                imp=min(run['import'] for run in runs),
+                load=min(run['load'] for run in runs),
+                forward=min(run['forward'] for run in runs),
+            ))
+
+
+if __name__ == '__main__':
+    main()
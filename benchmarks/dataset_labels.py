@@ -0,0 +1,94 @@
+"""Micro-benchmark of the per-sample label overhead of PosterDataset.
+
+Compares the old per-row ``df.iloc`` lookup with the label matrix of
+``PosterDataset`` (per sample and per batch with ``__getitems__``) and the
+size of the dataset pickled into every DataLoader worker.
+"""
+import argparse
+import pickle  # noqa: S403
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from src.dataset import PosterDataset
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_rows', type=int, default=40000)
+    parser.add_argument('--n_classes', type=int, default=17)
+    parser.add_argument('--batch_size', type=int, default=32)
+    return parser.parse_args()
+
+
+def make_df(n_rows: int, n_classes: int) -> pd.DataFrame:
+    """Make a synthetic dataframe in the format of df_train.csv.
+
+    Args:
+        n_rows (int): number of images
+        n_classes (int): number of classes
+
+    Returns:
+        pd.DataFrame: dataframe with image_name and one-hot labels
+    """
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        rng.integers(0, 2, size=(n_rows, n_classes)),
+        columns=['class_{idx}'.format(idx=idx) for idx in range(n_classes)],
+    )
+    df.insert(
+        0,
+        'image_name',
+        ['train_{idx}'.format(idx=idx) for idx in range(n_rows)],
+    )
+    return df
+
+
+def main():  # noqa: WPS210
+    """Run the benchmark and print the per-sample time."""
+    args = arg_parse()
+    df = make_df(args.n_rows, args.n_classes)
+    dataset = PosterDataset(df, image_folder='')
+    rng = np.random.default_rng(1)
+    indices = rng.integers(0, args.n_rows, size=args.batch_size * 100)
+    batches = indices.reshape(-1, args.batch_size)
+
+    def legacy():  # noqa: WPS430
+        for idx in indices:
+            row = df.iloc[idx]
+            np.array(row.values[1:], dtype='float32')
+
+    def per_sample():  # noqa: WPS430
+        for idx in indices:
+            dataset.labels[idx]  # noqa: WPS428
+
+    def per_batch():  # noqa: WPS430
+        for batch in batches:
+            dataset.labels[batch]  # noqa: WPS428
+
+    for name, func in (
+        ('df.iloc', legacy),
+        ('labels[idx]', per_sample),
+        ('labels[batch]', per_batch),
+    ):
+        seconds = min(timeit.repeat(func, number=1, repeat=5))
+        print('{name:>14}: {us:8.3f} us/sample'.format(
+            name=name, us=seconds / len(indices) * 1e6,
+        ))
+
+    print('{name:>14}: {mb:8.2f} MB'.format(
+        name='pickled df', mb=len(pickle.dumps(df)) / 2 ** 20,
+    ))
+    print('{name:>14}: {mb:8.2f} MB'.format(
+        name='pickled ds', mb=len(pickle.dumps(dataset)) / 2 ** 20,
+    ))
+
+
+if __name__ == '__main__':
+    main()
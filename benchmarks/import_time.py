@@ -0,0 +1,135 @@
+"""Import time of the entry points based on ``python -X importtime``.
+
+Every module is imported in a fresh interpreter. The report shows the total
+time and the heaviest top-level packages; the script exits with an error if
+a module pulls in a dependency that must stay lazy or exceeds --max_ms.
+"""
+import argparse
+import os
+import subprocess  # noqa: S404
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+# dependencies that the entry point must not import at startup.
+LAZY_DEPENDENCIES = {
+    'src.sweep': (
+        'torch', 'pytorch_lightning', 'clearml', 'timm', 'albumentations',
+    ),
+    'src.train': (
+        'clearml', 'timm', 'albumentations', 'sklearn', 'skmultilearn',
+    ),
+    'src.lightning_module': ('clearml', 'timm', 'albumentations'),
+    'src.datamodule': ('clearml', 'timm', 'albumentations', 'skmultilearn'),
+    'src.predict': ('clearml', 'timm', 'albumentations'),
+    'src.thresholds': ('torch', 'pytorch_lightning'),
+    'src.onnx_predictor': ('torch', 'pytorch_lightning'),
+}
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--modules', type=str, nargs='+', default=list(LAZY_DEPENDENCIES),
+    )
+    parser.add_argument(
+        '--top', type=int, default=5, help='heaviest packages to show',
+    )
+    parser.add_argument(
+        '--max_ms', type=float, default=None, help='budget of a module',
+    )
+    return parser.parse_args()
+
+
+def measure_import(module: str) -> List[Tuple[int, int, str]]:
+    """Import a module in a new interpreter with -X importtime.
+
+    Args:
+        module (str): module name
+
+    Returns:
+        List[Tuple[int, int, str]]: self and cumulative time in us and the
+        indented name of every imported module
+    """
+    env = dict(os.environ, PYTHONPATH=PROJECT_PATH)
+    completed = subprocess.run(  # noqa: S603
+        [
+            sys.executable,
+            '-X',
+            'importtime',
+            '-c',
+            'import {module}'.format(module=module),
+        ],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    records = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        columns = line[len('import time:'):].split('|')
+        self_time, cumulative_time, name = columns
+        records.append((int(self_time), int(cumulative_time), name.rstrip()))
+    return records
+
+
+def get_packages(records: List[Tuple[int, int, str]]) -> Dict[str, float]:
+    """Sum the self time of the imported modules by top-level package.
+
+    Args:
+        records (List[Tuple[int, int, str]]): records of measure_import
+
+    Returns:
+        Dict[str, float]: time in ms of every package
+    """
+    packages: Dict[str, float] = defaultdict(float)
+    for self_time, _, name in records:
+        packages[name.strip().split('.')[0]] += self_time / 1000
+    return packages
+
+
+def main():
+    """Run the benchmark."""
+    args = arg_parse()
+    errors = []
+    print('| module | ms | heaviest packages, ms |')
+    print('| --- | --- | --- |')
+    for module in args.modules:
+        records = measure_import(module)
+        total_ms = records[-1][1] / 1000
+        packages = get_packages(records)
+        heaviest = sorted(
+            packages.items(), key=lambda item: -item[1],
+        )[:args.top]
+        print('| {module} | {total:.0f} | {packages} |'.format(
+            module=module,
+            total=total_ms,
+            packages=', '.join(
+                '{name} {ms:.0f}'.format(name=name, ms=ms)
+                for name, ms in heaviest
+            ),
+        ))
+        for dependency in LAZY_DEPENDENCIES.get(module, ()):
+            if dependency in packages:
+                errors.append('{module} imports {dependency}'.format(
+                    module=module, dependency=dependency,
+                ))
+        if args.max_ms is not None and total_ms > args.max_ms:
+            errors.append('{module} takes {total:.0f} ms'.format(
+                module=module, total=total_ms,
+            ))
+    for error in errors:
+        print(error, file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""Throughput benchmark and profiler of the input pipeline.
+
+Measures samples/sec of image decoding, decoding with the train transforms
+(with the time of every transform), DataLoader iteration over a sweep of
+its settings and, optionally, the train step of the model, and writes a
+JSON and a Markdown report.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from src.augmentations import get_transforms
+from src.config import Config
+from src.dataset import PosterDataset
+from src.datamodule import read_df
+from src.image_cache import read_image
+from src.lightning_module import PosterModule
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', type=str, help='config file')
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='input_pipeline',
+        help='report path without extension',
+    )
+    parser.add_argument('--split', type=str, default='train')
+    parser.add_argument('--n_images', type=int, default=512)
+    parser.add_argument(
+        '--n_workers', type=int, nargs='+', default=[0, 2, 4, 8],
+    )
+    parser.add_argument('--batch_size', type=int, nargs='+', default=[32, 64])
+    parser.add_argument('--pin_memory', type=int, nargs='+', default=[0, 1])
+    parser.add_argument(
+        '--prefetch_factor', type=int, nargs='+', default=[2, 4],
+    )
+    parser.add_argument(
+        '--model', action='store_true', help='measure the train step',
+    )
+    return parser.parse_args()
+
+
+def bench_decode(dataset: PosterDataset, n_images: int) -> Dict[str, float]:
+    """Decode images without transforms.
+
+    Args:
+        dataset (PosterDataset): dataset
+        n_images (int): number of images
+
+    Returns:
+        Dict[str, float]: samples/sec
+    """
+    start_time = time.perf_counter()
+    for idx in range(n_images):
+        read_image(dataset.image_folder, dataset.image_names[idx])
+    return {'samples_per_sec': n_images / (time.perf_counter() - start_time)}
+
+
+def bench_transforms(
+    dataset: PosterDataset,
+    n_images: int,
+) -> Dict[str, float]:
+    """Decode images and apply the transforms one by one.
+
+    Args:
+        dataset (PosterDataset): dataset with albumentations Compose
+        n_images (int): number of images
+
+    Returns:
+        Dict[str, float]: samples/sec and ms per image of decoding and of
+        every transform
+    """
+    times: Dict[str, float] = defaultdict(float)
+    for idx in range(n_images):
+        start_time = time.perf_counter()
+        data = {
+            'image': read_image(
+                dataset.image_folder, dataset.image_names[idx],
+            ),
+            'labels': dataset.labels[idx],
+        }
+        times['decode'] += time.perf_counter() - start_time
+        for transform in dataset.transforms.transforms:
+            start_time = time.perf_counter()
+            data = transform(**data)
+            times[type(transform).__name__] += time.perf_counter() - start_time
+    report = {
+        'samples_per_sec': n_images / sum(times.values()),
+    }
+    for name, elapsed_time in times.items():
+        report['{name}_ms'.format(name=name)] = elapsed_time / n_images * 1000
+    return report
+
+
+def bench_dataloader(
+    dataset: Subset,
+    batch_size: int,
+    n_workers: int,
+    pin_memory: bool,
+    prefetch_factor: int,
+) -> Dict[str, float]:
+    """Iterate over one epoch of the DataLoader.
+
+    Args:
+        dataset (Subset): dataset
+        batch_size (int): batch size
+        n_workers (int): number of workers
+        pin_memory (bool): pin memory
+        prefetch_factor (int): batches prefetched by every worker
+
+    Returns:
+        Dict[str, float]: time to the first batch and samples/sec after it
+    """
+    dataloader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=n_workers,
+        shuffle=True,
+        pin_memory=pin_memory,
+        prefetch_factor=prefetch_factor if n_workers > 0 else None,
+    )
+    start_time = time.perf_counter()
+    batches = iter(dataloader)
+    next(batches)
+    first_batch_time = time.perf_counter() - start_time
+    n_samples = 0
+    start_time = time.perf_counter()
+    for images, _ in batches:
+        n_samples += len(images)
+    elapsed_time = time.perf_counter() - start_time
+    return {
+        'first_batch_sec': first_batch_time,
+        'samples_per_sec': n_samples / elapsed_time if n_samples else 0,
+    }
+
+
+def bench_model(  # noqa: WPS210
+    config: Config,
+    batch_size: int,
+    n_steps: int = 10,
+) -> Dict[str, float]:
+    """Train steps of the model on random batches.
+
+    Args:
+        config (Config): config
+        batch_size (int): batch size
+        n_steps (int): number of measured steps. Defaults to 10.
+
+    Returns:
+        Dict[str, float]: samples/sec
+    """
+    use_cuda = config.accelerator == 'gpu' and torch.cuda.is_available()
+    device = 'cuda' if use_cuda else 'cpu'
+    config.model_kwargs['pretrained'] = False
+    module = PosterModule(config).to(device).train()
+    optimizer = torch.optim.SGD(module.parameters(), lr=1e-3)
+    data_config = config.data_config
+    images = torch.randn(
+        batch_size, 3, data_config.height, data_config.width, device=device,
+    )
+    labels = torch.randint(
+        0, 2, (batch_size, config.num_classes), device=device,
+    ).float()
+    elapsed_time = 0
+    for step in range(n_steps + 1):
+        start_time = time.perf_counter()
+        loss = torch.nn.functional.binary_cross_entropy_with_logits(
+            module(images), labels,
+        )
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        # the first step is a warm-up.
+        if step:
+            elapsed_time += time.perf_counter() - start_time
+    return {'samples_per_sec': n_steps * batch_size / elapsed_time}
+
+
+def format_report(report: dict) -> str:
+    """Format the report as Markdown tables.
+
+    Args:
+        report (dict): report
+
+    Returns:
+        str: markdown
+    """
+    lines = ['## Dataset', '', '| stage | samples/sec |', '| --- | --- |']
+    for stage in ('decode', 'transforms', 'model'):
+        if stage in report:
+            lines.append('| {stage} | {value:.1f} |'.format(
+                stage=stage, value=report[stage]['samples_per_sec'],
+            ))
+    lines.extend([
+        '', '## Transforms', '', '| step | ms/image |', '| --- | --- |',
+    ])
+    for name, value in report['transforms'].items():
+        if name.endswith('_ms'):
+            lines.append('| {name} | {value:.3f} |'.format(
+                name=name[:-3], value=value,
+            ))
+    columns = ['n_workers', 'batch_size', 'pin_memory', 'prefetch_factor']
+    lines.extend([
+        '',
+        '## DataLoader',
+        '',
+        '| {columns} | first batch, sec | samples/sec |'.format(
+            columns=' | '.join(columns),
+        ),
+        '|{separators}'.format(separators=' --- |' * (len(columns) + 2)),
+    ])
+    rows = sorted(
+        report['dataloader'], key=lambda row: -row['samples_per_sec'],
+    )
+    for row in rows:
+        lines.append('| {values} | {first:.2f} | {value:.1f} |'.format(
+            values=' | '.join(str(row[column]) for column in columns),
+            first=row['first_batch_sec'],
+            value=row['samples_per_sec'],
+        ))
+    return '\n'.join(lines)
+
+
+def get_sweep(args) -> List[dict]:
+    """Combinations of the DataLoader settings.
+
+    prefetch_factor only matters with workers, so it is not swept for 0.
+
+    Args:
+        args (_type_): parsed arguments
+
+    Returns:
+        List[dict]: settings
+    """
+    sweep = []
+    settings = itertools.product(
+        args.n_workers, args.batch_size, args.pin_memory, args.prefetch_factor,
+    )
+    for n_workers, batch_size, pin_memory, prefetch_factor in settings:
+        if n_workers == 0 and prefetch_factor != args.prefetch_factor[0]:
+            continue
+        sweep.append({
+            'n_workers': n_workers,
+            'batch_size': batch_size,
+            'pin_memory': bool(pin_memory),
+            'prefetch_factor': prefetch_factor if n_workers else None,
+        })
+    return sweep
+
+
+def main():
+    """Run the benchmark."""
+    args = arg_parse()
+    config = Config.from_yaml(args.config)
+    data_config = config.data_config
+    dataset = PosterDataset(
+        read_df(data_config.data_path, args.split),
+        image_folder=os.path.join(data_config.data_path, 'train-jpg'),
+        transforms=get_transforms(
+            width=data_config.width, height=data_config.height,
+        ),
+    )
+    n_images = min(args.n_images, len(dataset))
+    report = {
+        'decode': bench_decode(dataset, n_images),
+        'transforms': bench_transforms(dataset, n_images),
+        'dataloader': [],
+    }
+    subset = Subset(dataset, range(n_images))
+    for settings in get_sweep(args):
+        result = bench_dataloader(subset, **settings)
+        report['dataloader'].append({**settings, **result})
+        print(settings, '{value:.1f} samples/sec'.format(
+            value=result['samples_per_sec'],
+        ))
+    if args.model:
+        report['model'] = bench_model(config, max(args.batch_size))
+
+    with open('{output}.json'.format(output=args.output), 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+    markdown = format_report(report)
+    with open('{output}.md'.format(output=args.output), 'w') as md_file:
+        md_file.write(markdown)
+    print(markdown)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Benchmark of the train step with the fused losses and deferred logging.
+
+Compares PosterModule with the previous loss loop, which logged every loss
+with ``.item()`` on every step, on random images with BCE and focal loss.
+"""
+import argparse
+import tempfile
+import time
+
+import pytorch_lightning as pl
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from src.config import Config, LossConfig
+from src.lightning_module import PosterModule
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config', type=str, help='config file')
+    parser.add_argument('--model_name', type=str, default=None)
+    parser.add_argument('--n_steps', type=int, default=50)
+    parser.add_argument('--n_repeats', type=int, default=3)
+    parser.add_argument(
+        '--head_only',
+        action='store_true',
+        help='replace the network by a linear head to isolate the loss',
+    )
+    return parser.parse_args()
+
+
+class LegacyLossModule(PosterModule):
+    """PosterModule with the previous loss loop."""
+
+    def _calculate_loss(self, pr_logits, gt_labels, prefix):
+        total_loss = 0
+        for cur_loss, name, weight in zip(
+            self._losses.losses,
+            self._losses.names,
+            self._losses.weights.tolist(),
+        ):
+            loss = cur_loss(pr_logits, gt_labels)
+            total_loss += weight * loss
+            self.log(
+                '{prefix}{name}_loss'.format(prefix=prefix, name=name),
+                loss.item(),
+            )
+        self.log('{prefix}total_loss'.format(prefix=prefix), total_loss.item())
+        return total_loss
+
+
+class StepTimer(pl.Callback):
+    """Measure the time of the train steps after a warm-up."""
+
+    def __init__(self, n_warmup: int = 5):
+        """Initialize an instance of the class.
+
+        Args:
+            n_warmup (int): steps that are not measured. Defaults to 5.
+        """
+        self.n_warmup = n_warmup
+        self.times = []
+        self._start_time = 0
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+        """Start the timer.
+
+        Args:
+            trainer (_type_): trainer
+            pl_module (_type_): module
+            batch (_type_): batch
+            batch_idx (_type_): idx batch
+        """
+        self._start_time = time.perf_counter()
+
+    def on_train_batch_end(
+        self, trainer, pl_module, outputs, batch, batch_idx,
+    ):
+        """Stop the timer.
+
+        Args:
+            trainer (_type_): trainer
+            pl_module (_type_): module
+            outputs (_type_): outputs
+            batch (_type_): batch
+            batch_idx (_type_): idx batch
+        """
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        if batch_idx >= self.n_warmup:
+            self.times.append(time.perf_counter() - self._start_time)
+
+
+def get_step_time(
+    module_class,
+    config: Config,
+    dataloader: DataLoader,
+    head_only: bool = False,
+) -> float:
+    """Fit one epoch and return the median step time.
+
+    Args:
+        module_class (_type_): module class
+        config (Config): config
+        dataloader (DataLoader): dataloader
+        head_only (bool): replace the network by a linear head.
+
+    Returns:
+        float: median step time in ms
+    """
+    module = module_class(config)
+    if head_only:
+        module._model = torch.nn.Sequential(  # noqa: WPS437
+            torch.nn.AdaptiveAvgPool2d(1),
+            torch.nn.Flatten(),
+            torch.nn.Linear(3, config.num_classes),
+        )
+    timer = StepTimer()
+    trainer = pl.Trainer(
+        accelerator=config.accelerator if torch.cuda.is_available() else 'cpu',
+        devices=1,
+        max_epochs=1,
+        log_every_n_steps=config.log_every_n_steps,
+        callbacks=[timer],
+        logger=pl.loggers.CSVLogger(tempfile.mkdtemp()),
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+    trainer.fit(module, train_dataloaders=dataloader)
+    return torch.tensor(timer.times).median().item() * 1000
+
+
+def main():
+    """Run the benchmark."""
+    args = arg_parse()
+    config = Config.from_yaml(args.config)
+    config.model_kwargs['pretrained'] = False
+    if args.model_name is not None:
+        config.model_kwargs['model_name'] = args.model_name
+    config.losses = [
+        LossConfig(
+            name='bce',
+            weight=1,
+            loss_fn='torch.nn.BCEWithLogitsLoss',
+            loss_kwargs={},
+        ),
+        LossConfig(
+            name='focal',
+            weight=1,
+            loss_fn='src.losses.FocalLoss',
+            loss_kwargs={},
+        ),
+    ]
+    data_config = config.data_config
+    n_images = data_config.batch_size * args.n_steps
+    dataset = TensorDataset(
+        torch.randn(n_images, 3, data_config.height, data_config.width),
+        torch.randint(0, 2, (n_images, config.num_classes)).float(),
+    )
+    dataloader = DataLoader(dataset, batch_size=data_config.batch_size)
+    for _ in range(args.n_repeats):
+        modules = (('legacy', LegacyLossModule), ('fused', PosterModule))
+        for name, module_class in modules:
+            step_time = get_step_time(
+                module_class, config, dataloader, head_only=args.head_only,
+            )
+            print('{name}: {value:.2f} ms/step'.format(
+                name=name, value=step_time,
+            ))
+
+
+if __name__ == '__main__':
+    main()
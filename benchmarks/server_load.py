@@ -0,0 +1,88 @@
+"""Load test of the inference server.
+
+Sends the same image from many concurrent clients and reports throughput,
+latency percentiles and the mean micro-batch size.
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+import aiohttp
+import numpy as np
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image', type=str, help='jpg image to send')
+    parser.add_argument(
+        '--url', type=str, default='http://127.0.0.1:8080/predict',
+    )
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--n_requests', type=int, default=1000)
+    return parser.parse_args()
+
+
+async def _client(
+    session: aiohttp.ClientSession,
+    url: str,
+    image_bytes: bytes,
+    n_requests: int,
+    latencies: List[float],
+    batch_sizes: List[int],
+):
+    for _ in range(n_requests):
+        start_time = time.perf_counter()
+        async with session.post(url, data=image_bytes) as response:
+            await response.read()
+            response.raise_for_status()
+            batch_sizes.append(int(response.headers['X-Batch-Size']))
+        latencies.append(time.perf_counter() - start_time)
+
+
+async def run(args) -> None:
+    """Run the load test and print the report.
+
+    Args:
+        args (_type_): parsed arguments
+    """
+    with open(args.image, 'rb') as image_file:
+        image_bytes = image_file.read()
+    latencies: List[float] = []
+    batch_sizes: List[int] = []
+    n_per_client = max(args.n_requests // args.concurrency, 1)
+
+    async with aiohttp.ClientSession() as session:
+        start_time = time.perf_counter()
+        await asyncio.gather(*[
+            _client(
+                session,
+                args.url,
+                image_bytes,
+                n_per_client,
+                latencies,
+                batch_sizes,
+            )
+            for _ in range(args.concurrency)
+        ])
+        elapsed_time = time.perf_counter() - start_time
+
+    latencies_ms = np.array(latencies) * 1000
+    print('requests: {n}, {rps:.1f} req/sec'.format(
+        n=len(latencies), rps=len(latencies) / elapsed_time,
+    ))
+    print('latency ms: p50 {p50:.1f}, p95 {p95:.1f}, p99 {p99:.1f}'.format(
+        p50=np.percentile(latencies_ms, 50),
+        p95=np.percentile(latencies_ms, 95),
+        p99=np.percentile(latencies_ms, 99),
+    ))
+    print('mean batch size: {size:.1f}'.format(size=np.mean(batch_sizes)))
+
+
+if __name__ == '__main__':
+    asyncio.run(run(arg_parse()))
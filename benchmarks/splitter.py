@@ -0,0 +1,183 @@
+"""Benchmark and label distribution report of the dataset splitters.
+
+Compares the native iterative stratification of src.dataset_splitter with
+the previous two-pass skmultilearn splitter on the same labels.
+"""
+import argparse
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+from skmultilearn.model_selection.iterative_stratification import \
+    IterativeStratification  # noqa: N400
+
+from src.annotations import encode_tags
+from src.dataset_splitter import get_split_folds
+
+# frequencies of the tags in the Planet dataset.
+PLANET_FREQUENCIES = (
+    0.93, 0.7, 0.3, 0.2, 0.18, 0.18, 0.12, 0.09, 0.07,
+    0.05, 0.02, 0.01, 0.008, 0.008, 0.005, 0.0025, 0.0025,
+)
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--annotation', type=str, default=None, help='train_classes.csv',
+    )
+    parser.add_argument(
+        '--n_rows', type=int, nargs='+', default=[5000, 20000, 40000],
+    )
+    parser.add_argument('--train_fraction', type=float, default=0.8)
+    return parser.parse_args()
+
+
+def legacy_split(labels: np.ndarray, train_fraction: float) -> np.ndarray:
+    """Previous splitter: IterativeStratification twice on object arrays.
+
+    Args:
+        labels (np.ndarray): one-hot labels [n_samples, n_labels]
+        train_fraction (float): training dataset size
+
+    Returns:
+        np.ndarray: fold of every sample
+    """
+    names = np.arange(len(labels)).reshape(-1, 1).astype(object)
+    stratifier = IterativeStratification(
+        n_splits=2,
+        sample_distribution_per_fold=[1 - train_fraction, train_fraction],
+    )
+    train_indexes, else_indexes = next(stratifier.split(X=names, y=labels))
+    stratifier = IterativeStratification(
+        n_splits=2, sample_distribution_per_fold=[0.5, 0.5],
+    )
+    test_indexes, valid_indexes = next(
+        stratifier.split(X=names[else_indexes], y=labels[else_indexes]),
+    )
+    folds = np.zeros(len(labels), dtype=np.int64)
+    folds[else_indexes[valid_indexes]] = 1
+    folds[else_indexes[test_indexes]] = 2
+    return folds
+
+
+def native_split(labels: np.ndarray, train_fraction: float) -> np.ndarray:
+    """Native one-pass iterative stratification.
+
+    Args:
+        labels (np.ndarray): one-hot labels [n_samples, n_labels]
+        train_fraction (float): training dataset size
+
+    Returns:
+        np.ndarray: fold of every sample
+    """
+    return get_split_folds(labels, train_fraction=train_fraction)
+
+
+def quality(
+    labels: np.ndarray,
+    folds: np.ndarray,
+    fractions: List[float],
+) -> Dict[str, float]:
+    """Label distribution quality of a split.
+
+    Args:
+        labels (np.ndarray): one-hot labels [n_samples, n_labels]
+        folds (np.ndarray): fold of every sample
+        fractions (List[float]): desired size of every fold
+
+    Returns:
+        Dict[str, float]: mean and max absolute deviation of the label
+        proportions from the whole dataset (in percentage points), max
+        deviation of the fold sizes and folds missing a label
+    """
+    overall = labels.mean(axis=0)
+    deviations = []
+    size_deviations = []
+    n_missing = 0
+    for fold, fraction in enumerate(fractions):
+        fold_labels = labels[folds == fold]
+        deviations.append(np.abs(fold_labels.mean(axis=0) - overall))
+        size_deviations.append(abs(len(fold_labels) / len(labels) - fraction))
+        is_missing = fold_labels.sum(axis=0) == 0
+        is_possible = labels.sum(axis=0) >= len(fractions)
+        n_missing += int((is_missing & is_possible).sum())
+    deviations = np.stack(deviations) * 100
+    return {
+        'mean_dev_pp': deviations.mean(),
+        'max_dev_pp': deviations.max(),
+        'size_dev_pp': max(size_deviations) * 100,
+        'missing': n_missing,
+    }
+
+
+def make_labels(n_rows: int) -> np.ndarray:
+    """Make synthetic labels with the tag frequencies of Planet.
+
+    Args:
+        n_rows (int): number of samples
+
+    Returns:
+        np.ndarray: one-hot labels
+    """
+    rng = np.random.default_rng(0)
+    samples = rng.random((n_rows, len(PLANET_FREQUENCIES)))
+    return (samples < PLANET_FREQUENCIES).astype(np.uint8)
+
+
+def run(
+    labels: np.ndarray,
+    train_fraction: float,
+    splitters: Dict[str, Callable],
+):
+    """Time every splitter and print the quality report.
+
+    Args:
+        labels (np.ndarray): one-hot labels
+        train_fraction (float): training dataset size
+        splitters (Dict[str, Callable]): splitters to compare
+    """
+    else_fraction = (1 - train_fraction) / 2
+    fractions = [train_fraction, else_fraction, else_fraction]
+    for name, splitter in splitters.items():
+        start_time = time.perf_counter()
+        folds = splitter(labels, train_fraction)
+        elapsed_time = time.perf_counter() - start_time
+        report = quality(labels, folds, fractions)
+        print((
+            '| {n} | {name} | {sec:.3f} | {mean:.3f} | {max:.3f} '
+            + '| {size:.3f} | {missing} |'
+        ).format(
+            n=len(labels),
+            name=name,
+            sec=elapsed_time,
+            mean=report['mean_dev_pp'],
+            max=report['max_dev_pp'],
+            size=report['size_dev_pp'],
+            missing=report['missing'],
+        ))
+
+
+def main():
+    """Run the benchmark."""
+    args = arg_parse()
+    splitters = {'skmultilearn': legacy_split, 'native': native_split}
+    print(
+        '| rows | splitter | sec | mean dev, pp | max dev, pp '
+        + '| size dev, pp | missing |',
+    )
+    print('| --- | --- | --- | --- | --- | --- | --- |')
+    if args.annotation is not None:
+        run(encode_tags(args.annotation)[1], args.train_fraction, splitters)
+        return
+    for n_rows in args.n_rows:
+        run(make_labels(n_rows), args.train_fraction, splitters)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Streaming encoding and compact storage of the annotations."""
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 1_000_000
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def encode_tags(
+    path: str,
+    chunk_size: int = CHUNK_SIZE,
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Read train_classes.csv in chunks and one-hot encode tags in one pass.
+
+    Exact duplicates of (image_name, tags) are dropped by their hash, the
+    classes are sorted like in MultiLabelBinarizer.
+
+    Args:
+        path (str): path to train_classes.csv
+        chunk_size (int): rows read at once. Defaults to CHUNK_SIZE.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, List[str]]: image names, uint8 labels
+        [n_images, n_classes] and class names
+    """
+    vocabulary = {}
+    names, hashes, combinations, codes = [], [], [], []
+    chunks = pd.read_csv(
+        path, chunksize=chunk_size, dtype=str, keep_default_na=False,
+    )
+    for chunk in chunks:
+        # there are few distinct tag strings, each of them is split once.
+        chunk_codes, chunk_combinations = pd.factorize(chunk['tags'])
+        names.append(chunk['image_name'].to_numpy(dtype=str))
+        hashes.append(
+            pd.util.hash_array(names[-1])
+            + pd.util.hash_array(chunk_combinations.to_numpy())[chunk_codes]
+            * np.uint64(HASH_MULTIPLIER),
+        )
+        codes.append(chunk_codes + len(combinations))
+        for tags in chunk_combinations:
+            tag_indexes = [
+                vocabulary.setdefault(tag, len(vocabulary))
+                for tag in tags.split(' ') if tag
+            ]
+            combinations.append(tag_indexes)
+
+    classes = sorted(vocabulary)
+    # columns are written directly in the sorted order of the classes.
+    order = np.empty(len(classes), dtype=np.int64)
+    order[[vocabulary[name] for name in classes]] = np.arange(len(classes))
+    combination_labels = np.zeros(
+        (len(combinations), len(classes)), dtype=np.uint8,
+    )
+    for row, tag_indexes in enumerate(combinations):
+        combination_labels[row, order[tag_indexes]] = 1
+
+    _, first_indexes = np.unique(np.concatenate(hashes), return_index=True)
+    keep = np.sort(first_indexes)
+    labels = combination_labels[np.concatenate(codes)[keep]]
+    return np.concatenate(names)[keep], labels, classes
+
+
+def to_dataframe(
+    image_names: np.ndarray,
+    labels: np.ndarray,
+    classes: List[str],
+) -> pd.DataFrame:
+    """Build the dataframe with image_name and one-hot columns.
+
+    Args:
+        image_names (np.ndarray): image names
+        labels (np.ndarray): uint8 labels [n_images, n_classes]
+        classes (List[str]): class names
+
+    Returns:
+        pd.DataFrame: dataframe with uint8 label columns
+    """
+    df = pd.DataFrame(labels, columns=classes)
+    df.insert(0, 'image_name', image_names)
+    return df
+
+
+def save_split(path: str, df: pd.DataFrame):
+    """Save a split with bit-packed labels.
+
+    Args:
+        path (str): path to .npz file
+        df (pd.DataFrame): dataframe with image_name and one-hot columns
+    """
+    classes = list(df.columns[1:])
+    labels = df[classes].to_numpy(dtype=np.uint8)
+    np.savez(
+        path,
+        image_name=df['image_name'].to_numpy(dtype=str),
+        labels=np.packbits(labels, axis=1),
+        classes=np.array(classes),
+    )
+
+
+def load_split(path: str) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Load a split saved by save_split.
+
+    Args:
+        path (str): path to .npz file
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, List[str]]: image names, uint8 labels
+        and class names
+    """
+    with np.load(path) as split:
+        classes = split['classes'].tolist()
+        labels = np.unpackbits(split['labels'], axis=1, count=len(classes))
+        return split['image_name'], labels, classes
+
+
+def load_classes(path: str) -> List[str]:
+    """Load only the class names of a split.
+
+    Args:
+        path (str): path to .npz file
+
+    Returns:
+        List[str]: class names
+    """
+    with np.load(path) as split:
+        return split['classes'].tolist()
@@ -1,10 +1,29 @@
 """This script is needed to make augmentations of images."""
-from typing import Union
+import math
+from typing import TYPE_CHECKING, Union
 
-import albumentations as albu
-from albumentations.pytorch import ToTensorV2
+import torch
+import torch.nn.functional as func
+from torch import nn
 
-TRANSFORM_TYPE = Union[albu.BasicTransform, albu.BaseCompose]
+if TYPE_CHECKING:
+    import albumentations as albu  # noqa: WPS433
+
+# albumentations is imported by the functions that build the transforms,
+# the torch backend and the module do not need it.
+TRANSFORM_TYPE = Union['albu.BasicTransform', 'albu.BaseCompose']
+
+ALBUMENTATIONS_BACKEND = 'albumentations'
+TORCH_BACKEND = 'torch'
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+MAX_PIXEL_VALUE = 255.0
+GAUSSIAN_KERNELS = (
+    (0, 0, 0.25, 0.5, 0.25, 0, 0),
+    (0, 0.0625, 0.25, 0.375, 0.25, 0.0625, 0),
+    (0.03125, 0.109375, 0.21875, 0.28125, 0.21875, 0.109375, 0.03125),
+)
 
 
 def get_transforms(
@@ -26,6 +45,9 @@ def get_transforms(
     Returns:
         TRANSFORM_TYPE: _description_
     """
+    import albumentations as albu  # noqa: WPS433
+    from albumentations.pytorch import ToTensorV2  # noqa: WPS433
+
     transforms = []
     if preprocessing:
         transforms.append(albu.Resize(height=height, width=width))
@@ -46,3 +68,201 @@ def get_transforms(
         transforms.extend([albu.Normalize(), ToTensorV2()])
 
     return albu.Compose(transforms)
+
+
+def get_worker_transforms(
+    width: int,
+    height: int,
+    preprocessing: bool = True,
+) -> TRANSFORM_TYPE:
+    """Return the transforms for the workers of the torch backend.
+
+    Workers only resize and convert to uint8 CHW tensors, augmentations
+    and normalization are done by BatchAugmentations on the whole batch.
+
+    Args:
+        width (int): width image
+        height (int): height image
+        preprocessing (bool): preprocessing - resize image.
+
+    Returns:
+        TRANSFORM_TYPE: _description_
+    """
+    import albumentations as albu  # noqa: WPS433
+    from albumentations.pytorch import ToTensorV2  # noqa: WPS433
+
+    transforms = get_transforms(
+        width=width,
+        height=height,
+        preprocessing=preprocessing,
+        augmentations=False,
+        postprocessing=False,
+    )
+    return albu.Compose([transforms, ToTensorV2()])
+
+
+class BatchAugmentations(nn.Module):
+    """Augmentations of uint8 batches with torch ops.
+
+    The same family of transforms as get_transforms, every transform is
+    applied to each image of the batch independently with probability p.
+
+    Args:
+        nn (_type_): torch module
+    """
+    def __init__(self, p: float = 0.5):  # noqa: WPS111
+        """Initialize an instance of the class.
+
+        Args:
+            p (float): probability of each transform. Defaults to 0.5.
+        """
+        super().__init__()
+        self.p = p  # noqa: WPS111
+        self.register_buffer(
+            'mean',
+            torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1),
+            persistent=False,
+        )
+        self.register_buffer(
+            'std',
+            torch.tensor(IMAGENET_STD).view(1, 3, 1, 1),
+            persistent=False,
+        )
+
+    def forward(
+        self,
+        images: torch.Tensor,
+        augment: bool = True,
+    ) -> torch.Tensor:
+        """Augment and normalize the batch.
+
+        Args:
+            images (torch.Tensor): uint8 batch [B, 3, H, W]
+            augment (bool): apply augmentations, otherwise only normalize.
+
+        Returns:
+            torch.Tensor: normalized float batch
+        """
+        images = images.float() / MAX_PIXEL_VALUE
+        if augment:
+            images = self._random_apply(images, _horizontal_flip)
+            images = self._random_apply(images, _vertical_flip)
+            images = self._random_apply(images, _hue_saturation_value)
+            images = self._random_apply(images, _brightness_contrast)
+            images = self._random_apply(images, _shift_scale_rotate)
+            images = self._random_apply(images, _gaussian_blur)
+        return (images - self.mean) / self.std
+
+    def _random_apply(self, images: torch.Tensor, transform) -> torch.Tensor:
+        # the transform is computed only for the selected images.
+        mask = torch.rand(images.shape[0], device=images.device) < self.p
+        indexes = mask.nonzero().squeeze(1)
+        if not len(indexes):
+            return images
+        augmented = transform(images.index_select(0, indexes))
+        return images.index_copy(0, indexes, augmented)
+
+
+def _uniform(images: torch.Tensor, limit: float) -> torch.Tensor:
+    batch_size = images.shape[0]
+    values = torch.rand(batch_size, device=images.device) * 2 - 1
+    return (values * limit).view(batch_size, 1, 1)
+
+
+def _horizontal_flip(images: torch.Tensor) -> torch.Tensor:
+    return images.flip(3)
+
+
+def _vertical_flip(images: torch.Tensor) -> torch.Tensor:
+    return images.flip(2)
+
+
+def _hue_saturation_value(images: torch.Tensor) -> torch.Tensor:
+    hue, saturation, value = _rgb_to_hsv(images).unbind(1)
+    # limits of albu.HueSaturationValue for uint8 images.
+    hue = (hue + _uniform(images, 20 / 180)) % 1  # noqa: WPS432
+    saturation += _uniform(images, 30 / MAX_PIXEL_VALUE)  # noqa: WPS432
+    value += _uniform(images, 20 / MAX_PIXEL_VALUE)  # noqa: WPS432
+    return _hsv_to_rgb(hue, saturation.clamp(0, 1), value.clamp(0, 1))
+
+
+def _brightness_contrast(images: torch.Tensor) -> torch.Tensor:
+    alpha = 1 + _uniform(images, 0.2).unsqueeze(1)  # noqa: WPS432
+    beta = _uniform(images, 0.2).unsqueeze(1)  # noqa: WPS432
+    return (images * alpha + beta).clamp(0, 1)
+
+
+def _shift_scale_rotate(images: torch.Tensor) -> torch.Tensor:
+    # defaults of albu.ShiftScaleRotate.
+    angle = _uniform(images, math.radians(45)).view(-1)  # noqa: WPS432
+    scale = 1 + _uniform(images, 0.1).view(-1)  # noqa: WPS432
+    shift_x = _uniform(images, 0.0625).view(-1) * 2  # noqa: WPS432
+    shift_y = _uniform(images, 0.0625).view(-1) * 2  # noqa: WPS432
+    cos = torch.cos(angle) / scale
+    sin = torch.sin(angle) / scale
+    theta = torch.stack(
+        [
+            torch.stack([cos, -sin, shift_x], dim=1),
+            torch.stack([sin, cos, shift_y], dim=1),
+        ],
+        dim=1,
+    )
+    grid = func.affine_grid(theta, list(images.shape), align_corners=False)
+    return func.grid_sample(
+        images, grid, padding_mode='reflection', align_corners=False,
+    )
+
+
+def _gaussian_blur(images: torch.Tensor) -> torch.Tensor:
+    # defaults of albu.GaussianBlur: kernel size 3, 5 or 7 with the fixed
+    # kernels cv2.getGaussianKernel uses for these sizes.
+    batch_size, channels, height, width = images.shape
+    kernels = torch.tensor(
+        GAUSSIAN_KERNELS, device=images.device, dtype=images.dtype,
+    )
+    sizes = torch.randint(0, len(GAUSSIAN_KERNELS), (batch_size,))
+    kernel = kernels[sizes.to(images.device)]
+    kernel = kernel.repeat_interleave(channels, dim=0)
+    max_size = kernel.shape[1]
+
+    # the gaussian kernel is separable: a row and a column pass.
+    groups = batch_size * channels
+    blurred = func.pad(
+        images.reshape(1, groups, height, width),
+        [max_size // 2] * 4,
+        mode='reflect',
+    )
+    blurred = func.conv2d(blurred, kernel[:, None, None, :], groups=groups)
+    blurred = func.conv2d(blurred, kernel[:, None, :, None], groups=groups)
+    return blurred.view(batch_size, channels, height, width)
+
+
+def _rgb_to_hsv(images: torch.Tensor) -> torch.Tensor:
+    red, green, blue = images.unbind(1)
+    max_value, max_idx = images.max(dim=1)
+    delta = max_value - images.min(dim=1).values
+    safe_delta = delta.clamp(min=1e-8)
+
+    hue = torch.where(
+        max_idx == 0,
+        ((green - blue) / safe_delta) % 6,
+        torch.where(
+            max_idx == 1,
+            (blue - red) / safe_delta + 2,
+            (red - green) / safe_delta + 4,
+        ),
+    )
+    hue = torch.where(delta > 0, hue / 6, torch.zeros_like(hue))
+    saturation = delta / max_value.clamp(min=1e-8)
+    return torch.stack([hue, saturation, max_value], dim=1)
+
+
+def _hsv_to_rgb(
+    hue: torch.Tensor,
+    saturation: torch.Tensor,
+    value: torch.Tensor,
+) -> torch.Tensor:
+    offsets = torch.tensor([5, 3, 1], device=hue.device, dtype=hue.dtype)
+    k_value = (offsets.view(1, 3, 1, 1) + hue.unsqueeze(1) * 6) % 6
+    weights = torch.clamp(torch.min(k_value, 4 - k_value), 0, 1)
+    return value.unsqueeze(1) * (1 - saturation.unsqueeze(1) * weights)
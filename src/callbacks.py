@@ -0,0 +1,482 @@
+"""Callbacks of the pipeline."""
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytorch_lightning as pl
+import torch
+from torch.utils.data import Dataset
+
+from src.sweep_store import MedianPruner, SweepStore
+
+
+class SharedCacheMonitor(pl.Callback):
+    """Log the hit rate of the shared image caches every epoch.
+
+    Persistent workers start prefetching the next epoch before the hooks
+    run, so a few of its reads are counted in the current epoch.
+    """
+
+    def on_train_start(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Empty the caches filled by the sanity check and the loader probes.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        datamodule = trainer.datamodule
+        if datamodule is None:
+            return
+        for dataset in (datamodule.train_dataset, datamodule.valid_dataset):
+            shared_cache = getattr(dataset, 'shared_cache', None)
+            if shared_cache is not None:
+                shared_cache.clear()
+
+    def on_train_epoch_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Log the train and valid caches after validation of the epoch.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        datamodule = trainer.datamodule
+        if datamodule is not None:
+            self._log(pl_module, {
+                'train': datamodule.train_dataset,
+                'val': datamodule.valid_dataset,
+            })
+
+    def on_test_epoch_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Log the test cache.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        datamodule = trainer.datamodule
+        if datamodule is not None:
+            self._log(pl_module, {'test': datamodule.test_dataset})
+
+    def _log(
+        self,
+        pl_module: pl.LightningModule,
+        datasets: Dict[str, Optional[Dataset]],
+    ):
+        for prefix, dataset in datasets.items():
+            shared_cache = getattr(dataset, 'shared_cache', None)
+            if shared_cache is None:
+                continue
+            hit_rate = shared_cache.hit_rate()
+            pl_module.log(
+                '{prefix}_cache_hit_rate'.format(prefix=prefix),
+                hit_rate,
+                sync_dist=True,
+            )
+            logging.info('{prefix} image cache hit rate: {value:.3f}'.format(
+                prefix=prefix, value=hit_rate,
+            ))
+            shared_cache.reset_stats()
+
+
+class ThroughputMonitor(pl.Callback):
+    """Log train and validation images/sec every epoch.
+
+    Train time is measured from the epoch start to its last batch, so
+    data loading is included and validation is not.
+    """
+
+    def __init__(self):
+        """Initialize an instance of the class."""
+        self._start_times: Dict[str, float] = {}
+        self._end_times: Dict[str, float] = {}
+        self._n_images: Dict[str, int] = {}
+
+    def on_train_epoch_start(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Start the timer.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        self._start(pl_module, 'train')
+
+    def on_train_batch_end(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+        outputs,
+        batch,
+        batch_idx: int,
+    ):
+        """Count the images of the batch.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+            outputs (_type_): outputs
+            batch (_type_): images and labels
+            batch_idx (int): idx batch
+        """
+        self._count('train', batch)
+
+    def on_train_epoch_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Log train images/sec.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        self._log(pl_module, 'train')
+
+    def on_validation_epoch_start(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+    ):
+        """Start the timer.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        self._start(pl_module, 'val')
+
+    def on_validation_batch_end(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+        outputs,
+        batch,
+        batch_idx: int,
+        dataloader_idx: int = 0,
+    ):
+        """Count the images of the batch.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+            outputs (_type_): outputs
+            batch (_type_): images and labels
+            batch_idx (int): idx batch
+            dataloader_idx (int): idx dataloader
+        """
+        self._count('val', batch)
+
+    def on_validation_epoch_end(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+    ):
+        """Log validation images/sec.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        if not trainer.sanity_checking:
+            self._log(pl_module, 'val')
+
+    def _start(self, pl_module: pl.LightningModule, prefix: str):
+        _synchronize(pl_module)
+        self._start_times[prefix] = time.perf_counter()
+        self._end_times[prefix] = self._start_times[prefix]
+        self._n_images[prefix] = 0
+
+    def _count(self, prefix: str, batch):
+        # no sync per batch, the queued work of the last step is not counted.
+        self._end_times[prefix] = time.perf_counter()
+        self._n_images[prefix] += len(batch[0])
+
+    def _log(self, pl_module: pl.LightningModule, prefix: str):
+        elapsed_time = self._end_times[prefix] - self._start_times[prefix]
+        if elapsed_time <= 0:
+            return
+        name = '{prefix}_images_per_sec'.format(prefix=prefix)
+        images_per_sec = self._n_images[prefix] / elapsed_time
+        # with several processes the logged value is their total.
+        pl_module.log(name, images_per_sec, sync_dist=True, reduce_fx='sum')
+        logging.info('{name}: {value:.1f}'.format(
+            name=name, value=images_per_sec,
+        ))
+
+
+class PRCurveWriter(pl.Callback):
+    """Save the PR curves of the last validation and test.
+
+    The curves are taken from PosterModule.pr_curves and written to
+    <dirpath>/val_pr_curves.npz and <dirpath>/test_pr_curves.npz with
+    the arrays ap, precision, recall and thresholds.
+    """
+
+    def __init__(self, dirpath: str):
+        """Initialize an instance of the class.
+
+        Args:
+            dirpath (str): directory of the files
+        """
+        self.dirpath = dirpath
+
+    def on_validation_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Save the validation curves.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        if not trainer.sanity_checking:
+            self._save(trainer, pl_module, 'val')
+
+    def on_test_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Save the test curves.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        self._save(trainer, pl_module, 'test')
+
+    def _save(
+        self,
+        trainer: pl.Trainer,
+        pl_module: pl.LightningModule,
+        stage: str,
+    ):
+        curves = getattr(pl_module, 'pr_curves', {}).get(stage)
+        if curves is None or not trainer.is_global_zero:
+            return
+        os.makedirs(self.dirpath, exist_ok=True)
+        path = os.path.join(
+            self.dirpath, '{stage}_pr_curves.npz'.format(stage=stage),
+        )
+        np.savez(path, **curves)
+
+
+class ResolutionPhaseMonitor(pl.Callback):
+    """Report the wall-clock time of the train resolution phases.
+
+    Every epoch the train width and the time since the fit start are
+    logged, the time includes validation. At the end of fit the epochs,
+    seconds and best monitored metric of every phase and the time to
+    reach the target metric are written to <dirpath>/resolution_phases.json.
+    """
+
+    def __init__(
+        self,
+        dirpath: str,
+        monitor: str,
+        mode: str = 'max',
+        target: Optional[float] = None,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            dirpath (str): directory of the report
+            monitor (str): monitored metric, e.g. val_f1
+            mode (str): max or min. Defaults to 'max'.
+            target (Optional[float]): target value of the metric
+        """
+        self.dirpath = dirpath
+        self.monitor = monitor
+        self.mode = mode
+        self.target = target
+        self.phases: List[dict] = []
+        self.time_to_target: Optional[dict] = None
+        self._start_time = 0
+        self._epoch_start_time = 0
+
+    def on_fit_start(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Start the timer.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        self.phases = []
+        self.time_to_target = None
+        self._start_time = time.perf_counter()
+
+    def on_train_epoch_start(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Start a phase if the resolution has changed.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        resolution = {'width': None, 'height': None, 'batch_size': None}
+        get_train_resolution = getattr(
+            trainer.datamodule, 'get_train_resolution', None,
+        )
+        if get_train_resolution is not None:
+            resolution = get_train_resolution(trainer.current_epoch).dict(
+                exclude={'epoch'},
+            )
+        if not self.phases or any(
+            self.phases[-1][key] != resolution_value
+            for key, resolution_value in resolution.items()
+        ):
+            self.phases.append({
+                'first_epoch': trainer.current_epoch,
+                'epochs': 0,
+                'seconds': 0,
+                'best': None,
+                **resolution,
+            })
+        self._epoch_start_time = time.perf_counter()
+
+    def on_train_epoch_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Update the phase after validation of the epoch.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        now = time.perf_counter()
+        phase = self.phases[-1]
+        phase['epochs'] += 1
+        phase['seconds'] += now - self._epoch_start_time
+        pl_module.log('elapsed_time', now - self._start_time, sync_dist=True)
+        if phase['width'] is not None:
+            pl_module.log('train_width', float(phase['width']))
+        metric_value = trainer.callback_metrics.get(self.monitor)
+        if metric_value is None:
+            return
+        metric_value = float(metric_value)
+        best_value = phase['best']
+        if best_value is None or self._is_better(metric_value, best_value):
+            phase['best'] = metric_value
+        is_reached = self.target is not None and not self._is_better(
+            self.target, metric_value,
+        )
+        if is_reached and self.time_to_target is None:
+            self.time_to_target = {
+                'epoch': trainer.current_epoch,
+                'seconds': now - self._start_time,
+            }
+            logging.info('{monitor} reached {target} in {sec:.0f} s.'.format(
+                monitor=self.monitor,
+                target=self.target,
+                sec=self.time_to_target['seconds'],
+            ))
+
+    def on_fit_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Write the report.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        for phase in self.phases:
+            logging.info(
+                'Resolution {width}x{height}: '.format(**phase)
+                + '{epochs} epochs, {seconds:.0f} s, '.format(**phase)
+                + 'best {monitor} {best}'.format(
+                    monitor=self.monitor, best=phase['best'],
+                ),
+            )
+        if not trainer.is_global_zero:
+            return
+        os.makedirs(self.dirpath, exist_ok=True)
+        report_path = os.path.join(self.dirpath, 'resolution_phases.json')
+        with open(report_path, 'w') as report_file:
+            json.dump({
+                'monitor': self.monitor,
+                'target': self.target,
+                'time_to_target': self.time_to_target,
+                'phases': self.phases,
+            }, report_file, indent=2)
+
+    def _is_better(self, metric_value: float, reference: float) -> bool:
+        if self.mode == 'max':
+            return metric_value > reference
+        return metric_value < reference
+
+
+class TrialPruning(pl.Callback):
+    """Report the monitored metric of a sweep trial and stop it if hopeless.
+
+    The metric is reported after every validation; the pruner compares it
+    with the other trials of the store and stops the training like
+    EarlyStopping does.
+    """
+
+    def __init__(
+        self,
+        store: SweepStore,
+        trial_id: str,
+        monitor: str,
+        pruner: Optional[MedianPruner] = None,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            store (SweepStore): store of the sweep
+            trial_id (str): trial id
+            monitor (str): reported metric
+            pruner (Optional[MedianPruner]): pruner, None to only report
+        """
+        self.store = store
+        self.trial_id = trial_id
+        self.monitor = monitor
+        self.pruner = pruner
+        self.is_pruned = False
+
+    def on_validation_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule,
+    ):
+        """Report the metric and prune the trial.
+
+        Args:
+            trainer (pl.Trainer): trainer
+            pl_module (pl.LightningModule): module
+        """
+        metric_value = trainer.callback_metrics.get(self.monitor)
+        if trainer.sanity_checking or metric_value is None:
+            return
+        epoch = trainer.current_epoch
+        should_prune = False
+        if trainer.is_global_zero:
+            self.store.report(self.trial_id, epoch, float(metric_value))
+            should_prune = (
+                self.pruner is not None
+                and self.pruner.should_prune(self.trial_id, epoch)
+            )
+        if trainer.strategy.broadcast(should_prune):
+            logging.info(
+                'Trial {trial} is pruned after epoch {epoch}: '.format(
+                    trial=self.trial_id, epoch=epoch,
+                ) + '{monitor} {value:.4f}'.format(
+                    monitor=self.monitor, value=float(metric_value),
+                ),
+            )
+            self.is_pruned = True
+            trainer.should_stop = True
+
+
+def _synchronize(pl_module: pl.LightningModule):
+    if pl_module.device.type == 'cuda':
+        torch.cuda.synchronize(pl_module.device)
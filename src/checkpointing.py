@@ -0,0 +1,324 @@
+"""Background checkpoint writing and weights-only safetensors files."""
+import argparse
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from lightning_utilities.core.apply_func import apply_to_collection
+from pytorch_lightning.plugins import CheckpointIO, TorchCheckpointIO
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+from torch import nn
+
+from src.config import Config
+
+SAFETENSORS_SUFFIX = '.safetensors'
+CONFIG_KEY = 'config'
+# prefix of the timm model weights in the PosterModule state dict.
+MODEL_PREFIX = '_model.'
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='model checkpoint')
+    parser.add_argument(
+        '--output', type=str, default=None, help='.safetensors file',
+    )
+    return parser.parse_args()
+
+
+def _snapshot(tensor: torch.Tensor) -> torch.Tensor:
+    return tensor.detach().to('cpu', copy=True)
+
+
+class BackgroundCheckpointIO(CheckpointIO):
+    """Write the checkpoints with torch.save in a background thread.
+
+    The training thread only copies the tensors of the checkpoint to cpu,
+    so the training can change the weights while the copy is written. One
+    checkpoint is written at a time: the next save waits for the previous
+    write, which bounds the memory of the copies.
+    """
+
+    def __init__(self, checkpoint_io: Optional[CheckpointIO] = None):
+        """Initialize an instance of the class.
+
+        Args:
+            checkpoint_io (Optional[CheckpointIO]): writer of the checkpoint
+                files. Defaults to TorchCheckpointIO.
+        """
+        self.checkpoint_io = checkpoint_io or TorchCheckpointIO()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Optional[Future] = None
+
+    def save_checkpoint(
+        self,
+        checkpoint: Dict[str, Any],
+        path: str,
+        storage_options: Optional[Any] = None,
+    ):
+        """Copy the tensors and write the checkpoint in the background.
+
+        Args:
+            checkpoint (Dict[str, Any]): checkpoint
+            path (str): path to the file
+            storage_options (Optional[Any]): options of the checkpoint_io
+        """
+        self._wait()
+        start_time = time.perf_counter()
+        snapshot = apply_to_collection(checkpoint, torch.Tensor, _snapshot)
+        logging.info(
+            'Checkpoint {path}: {ms:.0f} ms on the training thread'.format(
+                path=path, ms=(time.perf_counter() - start_time) * 1000,
+            ),
+        )
+        self._pending = self._get_executor().submit(
+            self._write, snapshot, path, storage_options,
+        )
+
+    def load_checkpoint(
+        self,
+        path: str,
+        map_location: Optional[Any] = None,
+    ) -> Dict[str, Any]:
+        """Wait for the writes and load a checkpoint.
+
+        Args:
+            path (str): path to the file
+            map_location (Optional[Any]): device mapping of torch.load
+
+        Returns:
+            Dict[str, Any]: checkpoint
+        """
+        self._wait()
+        return self.checkpoint_io.load_checkpoint(
+            path, map_location=map_location,
+        )
+
+    def remove_checkpoint(self, path: str):
+        """Remove a checkpoint after its write.
+
+        Args:
+            path (str): path to the file
+        """
+        self._wait()
+        self.checkpoint_io.remove_checkpoint(path)
+
+    def teardown(self):
+        """Wait for the writes, Lightning calls it after every fit and test."""
+        self._wait()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='checkpoint',
+            )
+        return self._executor
+
+    def _wait(self):
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            # raises the error of the write in the training thread.
+            pending.result()
+
+    def _write(
+        self,
+        checkpoint: Dict[str, Any],
+        path: str,
+        storage_options: Optional[Any],
+    ):
+        start_time = time.perf_counter()
+        self.checkpoint_io.save_checkpoint(
+            checkpoint, path, storage_options=storage_options,
+        )
+        logging.info(
+            'Checkpoint {path}: {ms:.0f} ms to write in the background'.format(
+                path=path, ms=(time.perf_counter() - start_time) * 1000,
+            ),
+        )
+
+
+def get_safetensors_path(checkpoint_path: str) -> str:
+    """Path of the weights saved next to the checkpoint.
+
+    Args:
+        checkpoint_path (str): model checkpoint
+
+    Returns:
+        str: path to .safetensors file
+    """
+    return os.path.splitext(checkpoint_path)[0] + SAFETENSORS_SUFFIX
+
+
+def save_safetensors(
+    state_dict: Dict[str, torch.Tensor],
+    config: Config,
+    path: str,
+):
+    """Save the network weights with the config as json metadata.
+
+    Args:
+        state_dict (Dict[str, torch.Tensor]): weights of the timm model
+        config (Config): config of the model
+        path (str): path to .safetensors file
+    """
+    tmp_path = '{path}.tmp'.format(path=path)
+    save_file(
+        {
+            name: tensor.detach().cpu().contiguous()
+            for name, tensor in state_dict.items()
+        },
+        tmp_path,
+        metadata={CONFIG_KEY: config.json()},
+    )
+    os.replace(tmp_path, path)
+
+
+def load_safetensors(path: str) -> Tuple[Dict[str, torch.Tensor], Config]:
+    """Memory-map the weights, no pickle is loaded.
+
+    Args:
+        path (str): path to .safetensors file
+
+    Returns:
+        Tuple[Dict[str, torch.Tensor], Config]: weights of the timm model and
+        the config
+    """
+    with safe_open(path, framework='pt') as weights_file:
+        metadata = weights_file.metadata()
+    return load_file(path), Config.parse_raw(metadata[CONFIG_KEY])
+
+
+def assign_state_dict(model: nn.Module, state_dict: Dict[str, torch.Tensor]):
+    """Use the tensors as the weights of the model without copying them.
+
+    Args:
+        model (nn.Module): model
+        state_dict (Dict[str, torch.Tensor]): weights
+
+    Raises:
+        KeyError: a weight is not in the model
+    """
+    for name, tensor in state_dict.items():
+        module_name, _, tensor_name = name.rpartition('.')
+        submodule = model.get_submodule(module_name)
+        current = getattr(submodule, tensor_name, None)
+        if isinstance(current, nn.Parameter):
+            setattr(
+                submodule,
+                tensor_name,
+                nn.Parameter(tensor, requires_grad=False),
+            )
+        elif isinstance(current, torch.Tensor):
+            setattr(submodule, tensor_name, tensor)
+        else:
+            raise KeyError('{name} is not in the model'.format(name=name))
+
+
+def create_model_from_safetensors(path: str) -> Tuple[nn.Module, Config]:
+    """Create the timm model on the memory-mapped weights.
+
+    The model is created on the meta device, so its weights are not
+    initialized; only the pages that are read come from the disk.
+
+    Args:
+        path (str): path to .safetensors file
+
+    Returns:
+        Tuple[nn.Module, Config]: model in eval mode without gradients and
+        the config
+    """
+    from timm import create_model  # noqa: WPS433 timm is slow to import
+
+    state_dict, config = load_safetensors(path)
+    # the weights come from the file, pretrained ones are not needed.
+    config.model_kwargs['pretrained'] = False
+    with torch.device('meta'):
+        model = create_model(
+            num_classes=config.num_classes, **config.model_kwargs,
+        )
+    assign_state_dict(model, state_dict)
+    tensors = itertools.chain(model.parameters(), model.buffers())
+    if any(tensor.is_meta for tensor in tensors):
+        # non-persistent buffers are not in the file, the model has to
+        # initialize them.
+        model = create_model(
+            num_classes=config.num_classes, **config.model_kwargs,
+        )
+        model.load_state_dict(state_dict)
+        model.requires_grad_(False)
+    return model.eval(), config
+
+
+def read_model_weights(checkpoint_path: str) -> Dict[str, torch.Tensor]:
+    """Weights of the timm model from a checkpoint or a .safetensors file.
+
+    Args:
+        checkpoint_path (str): PosterModule checkpoint or .safetensors file
+
+    Returns:
+        Dict[str, torch.Tensor]: weights without the module prefix
+    """
+    if checkpoint_path.endswith(SAFETENSORS_SUFFIX):
+        return load_safetensors(checkpoint_path)[0]
+    state_dict = torch.load(checkpoint_path, map_location='cpu')['state_dict']
+    return {
+        name[len(MODEL_PREFIX):]: tensor
+        for name, tensor in state_dict.items()
+        if name.startswith(MODEL_PREFIX)
+    }
+
+
+def export_safetensors(
+    checkpoint_path: str,
+    output_path: Optional[str] = None,
+) -> str:
+    """Save the network weights and the config of a PosterModule checkpoint.
+
+    Args:
+        checkpoint_path (str): model checkpoint
+        output_path (Optional[str]): .safetensors file. Defaults to the
+            checkpoint path with the .safetensors extension.
+
+    Returns:
+        str: path to .safetensors file
+    """
+    output_path = output_path or get_safetensors_path(checkpoint_path)
+    start_time = time.perf_counter()
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    save_safetensors(
+        {
+            name[len(MODEL_PREFIX):]: tensor
+            for name, tensor in checkpoint['state_dict'].items()
+            if name.startswith(MODEL_PREFIX)
+        },
+        checkpoint['hyper_parameters']['config'],
+        output_path,
+    )
+    logging.info(
+        'Weights of {ckpt} saved to {path}: {ms:.0f} ms, {mb:.1f} MB'.format(
+            ckpt=checkpoint_path,
+            path=output_path,
+            ms=(time.perf_counter() - start_time) * 1000,
+            mb=os.path.getsize(output_path) / 2 ** 20,
+        ),
+    )
+    return output_path
+
+
+if __name__ == '__main__':
+    args = arg_parse()
+    logging.basicConfig(level=logging.INFO)
+    export_safetensors(args.checkpoint, args.output)
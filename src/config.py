@@ -1,5 +1,5 @@
 """This configuration is for the Pipeline."""
-from typing import List
+from typing import Any, Dict, List, Optional, Union
 
 from omegaconf import OmegaConf
 from pydantic import BaseModel
@@ -17,6 +17,19 @@ class LossConfig(BaseModel):
     loss_kwargs: dict
 
 
+class ResolutionPhase(BaseModel):
+    """Train resolution from an epoch on.
+
+    Args:
+        BaseModel (_type_): _description_
+    """
+    epoch: int
+    width: int
+    height: int
+    # by default the batch has as many pixels as at the full resolution.
+    batch_size: Optional[int] = None
+
+
 class DataConfig(BaseModel):
     """Config for data.
 
@@ -25,10 +38,43 @@ class DataConfig(BaseModel):
     """
     data_path: str
     batch_size: int
-    n_workers: int
+    n_workers: Union[int, str]
     train_size: float
     width: int
     height: int
+    cache_images: bool = False
+    shared_cache_mb: float = 0
+    split_seed: int = 42
+    incremental_split: bool = False
+    augmentation_backend: str = 'albumentations'
+    prefetch_factor: Optional[int] = None
+    persistent_workers: bool = True
+    resolution_schedule: Optional[List[ResolutionPhase]] = None
+    # False when the splits and caches are prepared by another process,
+    # e.g. once by the sweep for all its trials.
+    prepare_data: bool = True
+
+
+class DistillationConfig(BaseModel):
+    """Config for knowledge distillation.
+
+    Args:
+        BaseModel (_type_): _description_
+    """
+    teacher_checkpoint: str
+    # .npy file with the teacher logits of the train split, they are
+    # computed once instead of running the teacher every step.
+    logits_path: Optional[str] = None
+
+
+class HeadOnlyConfig(BaseModel):
+    """Config for training the classifier on stored backbone features.
+
+    Args:
+        BaseModel (_type_): _description_
+    """
+    # PosterModule checkpoint with the backbone, else the model_kwargs weights.
+    backbone_checkpoint: Optional[str] = None
 
 
 class Config(BaseModel):
@@ -50,12 +96,35 @@ class Config(BaseModel):
     device: int
     monitor_metric: str
     monitor_mode: str
+    # the time to reach it is reported by ResolutionPhaseMonitor.
+    monitor_target: Optional[float] = None
     model_kwargs: dict
     optimizer: str
     optimizer_kwargs: dict
     scheduler: str
     scheduler_kwargs: dict
     losses: List[LossConfig]
+    tune_thresholds: bool = False
+    threshold_beta: float = 1.0
+    precision: str = '32-true'
+    channels_last: bool = False
+    compile_mode: Optional[str] = None
+    devices: Optional[Union[int, List[int], str]] = None
+    num_nodes: int = 1
+    strategy: str = 'auto'
+    process_group_backend: Optional[str] = None
+    tracking: str = 'clearml'
+    tracking_flush_interval: float = 5
+    # checkpoints are written by a background thread.
+    async_checkpointing: bool = True
+    # without the optimizer and loop states, training cannot be resumed
+    # from them.
+    checkpoint_weights_only: bool = False
+    # weights and config of the best checkpoint in a .safetensors file
+    # next to it.
+    export_safetensors: bool = True
+    distillation: Optional[DistillationConfig] = None
+    head_only: Optional[HeadOnlyConfig] = None
 
     @classmethod
     def from_yaml(cls, path: str) -> 'Config':
@@ -69,3 +138,67 @@ class Config(BaseModel):
         """
         cfg = OmegaConf.to_container(OmegaConf.load(path), resolve=True)
         return cls(**cfg)
+
+
+class ParamSpace(BaseModel):
+    """Values of a swept Config field.
+
+    Args:
+        BaseModel (_type_): _description_
+    """
+    # the listed values, else a number between low and high.
+    values: Optional[List[Any]] = None
+    low: Optional[float] = None
+    high: Optional[float] = None
+    log: bool = False
+    is_int: bool = False
+
+
+class PruningConfig(BaseModel):
+    """Config for the median pruning of the sweep trials.
+
+    Args:
+        BaseModel (_type_): _description_
+    """
+    # trials that must reach an epoch before the others are compared to them.
+    n_startup_trials: int = 3
+    # epochs of every trial that are never pruned.
+    n_warmup_epochs: int = 1
+
+
+class SweepConfig(BaseModel):
+    """Config for the hyperparameter sweep.
+
+    Args:
+        BaseModel (_type_): _description_
+
+    Returns:
+        _type_: _description_
+    """
+    name: str
+    # dotted paths in the Config, losses are addressed by name
+    # (e.g. 'optimizer_kwargs.lr', 'losses.bce.weight').
+    search_space: Dict[str, ParamSpace]
+    # 'grid' needs values of every parameter, 'random' samples n_trials.
+    method: str = 'random'
+    n_trials: int = 10
+    seed: int = 42
+    n_workers: int = 1
+    # torch threads of a trial, by default the CPUs are split between workers.
+    threads_per_trial: Optional[int] = None
+    # .db for SQLite or .jsonl, relative paths are in the sweep folder.
+    store: str = 'trials.db'
+    pruning: Optional[PruningConfig] = PruningConfig()
+
+    @classmethod
+    def from_yaml(cls, path: str) -> 'SweepConfig':
+        """Parse data from yaml.
+
+        Args:
+            path (str): path to config
+
+        Returns:
+            SweepConfig: SweepConfig
+        """
+        cfg = OmegaConf.to_container(OmegaConf.load(path), resolve=True)
+        return cls(**cfg)
@@ -1,17 +1,34 @@
 """Datamodule for the pipeline."""
 import logging
 import os
-from typing import Optional
+from typing import List, Optional
 
+import numpy as np
 import pandas as pd
+import torch
 from pytorch_lightning import LightningDataModule
-from sklearn.preprocessing import MultiLabelBinarizer
-from torch.utils.data import DataLoader, Dataset
-
-from src.augmentations import get_transforms
-from src.config import DataConfig
-from src.dataset import PosterDataset
-from src.dataset_splitter import stratify_shuffle_split_subsets
+from pytorch_lightning.accelerators import CUDAAccelerator
+from torch import nn
+from torch.utils.data import DataLoader, Dataset, DistributedSampler, Subset
+
+from src.annotations import (encode_tags, load_classes, load_split,
+                             save_split, to_dataframe)
+from src.augmentations import (TORCH_BACKEND, get_transforms,
+                               get_worker_transforms)
+from src.config import DataConfig, DistillationConfig, ResolutionPhase
+from src.dataset import PosterCacheDataset, PosterDataset, get_image_names
+from src.dataset_splitter import SPLIT_SEED, get_split_folds
+from src.feature_store import (FeatureDataset, get_backbone_hash,
+                               get_feature_prefix, update_feature_store)
+from src.image_cache import build_image_cache, get_cache_prefix
+from src.loader_tuning import AUTO, get_n_cpus, tune_dataloader
+from src.samplers import UnpaddedDistributedSampler
+from src.shared_cache import create_shared_cache
+from src.split_cache import (get_file_hash, get_previous_folds,
+                             get_split_key, read_meta, remove_meta,
+                             write_meta)
+
+SPLITS = ('train', 'valid', 'test')
 
 
 class PosterDM(LightningDataModule):
@@ -21,24 +38,74 @@ class PosterDM(LightningDataModule):
         LightningDataModule (_type_): The LightningDataModule is a convenient
         way to manage data
     """
-    def __init__(self, config: DataConfig):
+    def __init__(
+        self,
+        config: DataConfig,
+        distillation: Optional[DistillationConfig] = None,
+    ):
         """Initialize an instance of the class.
 
         Args:
             config (DataConfig): config data
+            distillation (Optional[DistillationConfig]): if its logits_path
+                is set, the teacher logits of the train split are computed
+                in prepare_data and returned by the train dataset.
         """
         super().__init__()
+        self._config = config
+        self._teacher_checkpoint = None
+        self._teacher_logits_path = None
+        if distillation is not None and distillation.logits_path is not None:
+            self._teacher_checkpoint = distillation.teacher_checkpoint
+            self._teacher_logits_path = distillation.logits_path
         self._batch_size = config.batch_size
         self._n_workers = config.n_workers
+        self._prefetch_factor = config.prefetch_factor
+        self._persistent_workers = config.persistent_workers
         self._train_size = config.train_size
+        self._split_seed = config.split_seed
+        self._incremental_split = config.incremental_split
         self._data_path = config.data_path
-        self._train_transforms = get_transforms(
-            width=config.width, height=config.height,
-        )
-        self._valid_transforms = get_transforms(
-            width=config.width, height=config.height, augmentations=False,
-        )
+        self._width = config.width
+        self._height = config.height
+        self._cache_images = config.cache_images
+        # the shared cache is not needed over the memory-mapped one.
+        self._shared_cache_mb = config.shared_cache_mb
+        if config.cache_images:
+            self._shared_cache_mb = 0
+        # cached images are already resized, so resize is skipped.
+        preprocessing = not config.cache_images and self._shared_cache_mb <= 0
+        if config.augmentation_backend == TORCH_BACKEND:
+            # augmentations are applied to the batch by PosterModule.
+            self._train_transforms = get_worker_transforms(
+                width=config.width,
+                height=config.height,
+                preprocessing=preprocessing,
+            )
+            self._valid_transforms = self._train_transforms
+        else:
+            self._train_transforms = get_transforms(
+                width=config.width,
+                height=config.height,
+                preprocessing=preprocessing,
+            )
+            self._valid_transforms = get_transforms(
+                width=config.width,
+                height=config.height,
+                preprocessing=preprocessing,
+                augmentations=False,
+            )
         self._image_folder = os.path.join(config.data_path, 'train-jpg')
+        self._cache_dir = os.path.join(config.data_path, 'cache')
+        self._augmentation_backend = config.augmentation_backend
+        self._prepare_data = config.prepare_data
+        self._resolution_schedule = sorted(
+            config.resolution_schedule or [], key=lambda phase: phase.epoch,
+        )
+        # the train dataloader is rebuilt only when the resolution changes.
+        self._train_dataloader: Optional[DataLoader] = None
+        self._train_resolution: Optional[ResolutionPhase] = None
+        self._valid_dataloader: Optional[DataLoader] = None
 
         self.train_dataset: Optional[Dataset] = None
         self.valid_dataset: Optional[Dataset] = None
@@ -46,7 +113,30 @@ class PosterDM(LightningDataModule):
 
     def prepare_data(self):
         """For split and save datasets."""
-        split_and_save_datasets(self._data_path, self._train_size)
+        if not self._prepare_data:
+            return
+        split_and_save_datasets(
+            self._data_path,
+            self._train_size,
+            seed=self._split_seed,
+            incremental=self._incremental_split,
+        )
+        if self._cache_images:
+            # in the auto mode the cache is decoded with a thread per CPU.
+            n_threads = self._n_workers
+            if n_threads == AUTO:
+                n_threads = get_n_cpus()
+            for mode in SPLITS:
+                build_image_cache(
+                    read_df(self._data_path, mode),
+                    image_folder=self._image_folder,
+                    prefix=self._get_cache_prefix(mode),
+                    width=self._width,
+                    height=self._height,
+                    n_workers=n_threads,
+                )
+        if self._teacher_logits_path is not None:
+            self._precompute_teacher_logits()
 
     def setup(self, stage: Optional[str] = None):
         """Create a dataset class.
@@ -56,58 +146,67 @@ class PosterDM(LightningDataModule):
             Shows the training or test is in progress. Defaults to None.
         """
         if stage == 'fit':
-            df_train = read_df(self._data_path, 'train')
-            df_valid = read_df(self._data_path, 'valid')
-            self.train_dataset = PosterDataset(
-                df_train,
-                image_folder=self._image_folder,
-                transforms=self._train_transforms,
+            self._train_dataloader = None
+            self._valid_dataloader = None
+            self.train_dataset = self._create_dataset(
+                'train', self._train_transforms,
             )
-            self.valid_dataset = PosterDataset(
-                df_valid,
-                image_folder=self._image_folder,
-                transforms=self._valid_transforms,
+            self.valid_dataset = self._create_dataset(
+                'valid', self._valid_transforms,
             )
+            self._tune_dataloader(self.train_dataset)
 
         elif stage == 'test':
-            df_test = read_df(self._data_path, 'test')
-            self.test_dataset = PosterDataset(
-                df_test,
-                image_folder=self._image_folder,
-                transforms=self._valid_transforms,
+            self.test_dataset = self._create_dataset(
+                'test', self._valid_transforms,
             )
+            self._tune_dataloader(self.test_dataset)
 
     def train_dataloader(self) -> DataLoader:
-        """Train dataloader.
+        """Train dataloader at the resolution of the current epoch.
+
+        With a resolution schedule the trainer asks for the dataloader
+        every epoch, the same one is returned until the phase changes.
 
         Returns:
             DataLoader: The most important argument of Data Loader constructor
             is dataset, which indicates a dataset object to load data from.
         """
-        return DataLoader(
-            dataset=self.train_dataset,
-            batch_size=self._batch_size,
-            num_workers=self._n_workers,
-            shuffle=True,
-            pin_memory=True,
-            drop_last=False,
-        )
+        epoch = 0 if self.trainer is None else self.trainer.current_epoch
+        resolution = self.get_train_resolution(epoch)
+        is_changed = resolution != self._train_resolution
+        if self._train_dataloader is None or is_changed:
+            if self._resolution_schedule:
+                self.train_dataset.transforms = (
+                    self._get_resolution_transforms(resolution)
+                )
+                logging.info(
+                    'Train resolution {w}x{h}, batch size {bs}.'.format(
+                        w=resolution.width,
+                        h=resolution.height,
+                        bs=resolution.batch_size,
+                    ),
+                )
+            self._train_dataloader = self._create_dataloader(
+                self.train_dataset,
+                shuffle=True,
+                batch_size=resolution.batch_size,
+            )
+            self._train_resolution = resolution
+        return self._train_dataloader
 
     def val_dataloader(self) -> DataLoader:
-        """Val dataloader.
+        """Val dataloader, it is kept for the reloads of the schedule.
 
         Returns:
             DataLoader: The most important argument of Data Loader constructor
             is dataset, which indicates a dataset object to load data from.
         """
-        return DataLoader(
-            dataset=self.valid_dataset,
-            batch_size=self._batch_size,
-            num_workers=self._n_workers,
-            shuffle=False,
-            pin_memory=True,
-            drop_last=False,
-        )
+        if self._valid_dataloader is None:
+            self._valid_dataloader = self._create_dataloader(
+                self.valid_dataset, shuffle=False,
+            )
+        return self._valid_dataloader
 
     def test_dataloader(self) -> DataLoader:
         """Test dataloader.
@@ -116,77 +215,301 @@ class PosterDM(LightningDataModule):
             DataLoader: The most important argument of Data Loader constructor
             is dataset, which indicates a dataset object to load data from.
         """
-        return DataLoader(
-            dataset=self.test_dataset,
+        return self._create_dataloader(self.test_dataset, shuffle=False)
+
+    def _create_dataset(self, mode: str, transforms) -> Dataset:
+        teacher_logits_path = None
+        if mode == 'train':
+            teacher_logits_path = self._teacher_logits_path
+        if self._cache_images:
+            return PosterCacheDataset(
+                self._get_cache_prefix(mode),
+                transforms=transforms,
+                teacher_logits_path=teacher_logits_path,
+            )
+        df = read_df(self._data_path, mode)
+        return PosterDataset(
+            df,
+            image_folder=self._image_folder,
+            transforms=transforms,
+            shared_cache=create_shared_cache(
+                len(df),
+                size_mb=self._shared_cache_mb,
+                width=self._width,
+                height=self._height,
+            ),
+            teacher_logits_path=teacher_logits_path,
+        )
+
+    def _precompute_teacher_logits(self):
+        # distillation is imported here: it loads the teacher with src.predict.
+        from src.distillation import precompute_teacher_logits  # noqa: WPS433
+
+        train_df = read_df(self._data_path, 'train')
+        n_workers = self._n_workers
+        if n_workers == AUTO:
+            n_workers = get_n_cpus()
+        device = None
+        if self.trainer is not None:
+            device = self.trainer.strategy.root_device
+        precompute_teacher_logits(
+            self._teacher_checkpoint,
+            dataloader=get_split_dataloader(
+                self._config,
+                'train',
+                batch_size=self._batch_size,
+                n_workers=n_workers,
+            ),
+            image_names=get_image_names(train_df),
+            logits_path=self._teacher_logits_path,
+            num_classes=train_df.shape[1] - 1,
+            device=device,
+        )
+
+    def get_train_resolution(self, epoch: int) -> ResolutionPhase:
+        """Resolution and batch size of the train images at an epoch.
+
+        Args:
+            epoch (int): epoch
+
+        Returns:
+            ResolutionPhase: the last phase started by the epoch, the full
+            resolution without a schedule
+        """
+        resolution = ResolutionPhase(
+            epoch=0,
+            width=self._width,
+            height=self._height,
             batch_size=self._batch_size,
-            num_workers=self._n_workers,
-            shuffle=False,
-            pin_memory=True,
+        )
+        for phase in self._resolution_schedule:
+            if phase.epoch <= epoch or phase is self._resolution_schedule[0]:
+                resolution = phase.copy()
+        if resolution.batch_size is None:
+            area = resolution.width * resolution.height
+            scale = self._width * self._height / area
+            resolution.batch_size = max(int(self._batch_size * scale), 1)
+        return resolution
+
+    def _get_resolution_transforms(self, resolution: ResolutionPhase):
+        # cached images have the full resolution, so they are resized too.
+        if self._augmentation_backend == TORCH_BACKEND:
+            return get_worker_transforms(
+                width=resolution.width, height=resolution.height,
+            )
+        return get_transforms(width=resolution.width, height=resolution.height)
+
+    def _create_dataloader(
+        self,
+        dataset: Dataset,
+        shuffle: bool,
+        batch_size: Optional[int] = None,
+    ) -> DataLoader:
+        n_workers = self._n_workers
+        sampler = self._create_sampler(dataset, shuffle)
+        return DataLoader(
+            dataset=dataset,
+            batch_size=batch_size or self._batch_size,
+            num_workers=n_workers,
+            shuffle=shuffle if sampler is None else None,
+            sampler=sampler,
+            # pinned memory only speeds up copies to a CUDA device.
+            pin_memory=self._is_cuda(),
             drop_last=False,
+            prefetch_factor=self._prefetch_factor if n_workers > 0 else None,
+            persistent_workers=self._persistent_workers and n_workers > 0,
+        )
+
+    def _create_sampler(self, dataset: Dataset, shuffle: bool):
+        trainer = self.trainer
+        if trainer is None or trainer.world_size <= 1:
+            return None
+        # Lightning keeps these samplers and calls set_epoch on them.
+        if shuffle:
+            return DistributedSampler(
+                dataset,
+                num_replicas=trainer.world_size,
+                rank=trainer.global_rank,
+                shuffle=True,
+            )
+        # every image is evaluated once, torchmetrics syncs the states.
+        return UnpaddedDistributedSampler(
+            dataset, num_replicas=trainer.world_size, rank=trainer.global_rank,
         )
 
+    def _tune_dataloader(self, dataset: Dataset):
+        if self._n_workers != AUTO:
+            return
+        n_cpus = get_n_cpus()
+        if self.trainer is not None:
+            # processes of the node share its CPUs.
+            n_cpus = max(n_cpus // self.trainer.num_devices, 1)
+        # the probes decode the images: with the shared cache a probe would
+        # read the images cached by the previous ones and look faster.
+        shared_cache = getattr(dataset, 'shared_cache', None)
+        dataset.shared_cache = None
+        try:
+            n_workers, prefetch_factor = tune_dataloader(
+                dataset, self._batch_size, n_cpus=n_cpus,
+            )
+        finally:
+            dataset.shared_cache = shared_cache
+        self._n_workers = n_workers
+        if self._prefetch_factor is None:
+            self._prefetch_factor = prefetch_factor
+        logging.info('DataLoader: {n} workers, prefetch factor {pf}.'.format(
+            n=self._n_workers, pf=self._prefetch_factor,
+        ))
+
+    def _is_cuda(self) -> bool:
+        if self.trainer is not None:
+            return isinstance(self.trainer.accelerator, CUDAAccelerator)
+        return torch.cuda.is_available()
+
+    def _get_cache_prefix(self, mode: str) -> str:
+        return get_cache_prefix(
+            self._cache_dir, mode, width=self._width, height=self._height,
+        )
 
-def one_hot_encoding(df_train):
-    """With this function, you can make one hot encoding.
 
-    Args:
-        df_train (_type_): dataset
+class FeatureDM(PosterDM):
+    """Datamodule of the stored backbone features for head-only training.
 
-    Returns:
-        _type_: pd.Dataframe
+    prepare_data runs the backbone over the images of all splits that are
+    not in the feature store yet, the datasets then read only the store.
     """
-    df_train['list_tags'] = df_train.tags.str.split(' ')
-    encoder = MultiLabelBinarizer()
-    ohe_tags_train = encoder.fit_transform(df_train.list_tags.values)
-    df_train['ohe_tags'] = ohe_tags_train.tolist()
-    df_onehot = pd.DataFrame(
-        encoder.transform(df_train['list_tags']), columns=encoder.classes_,
-    )
-    df = df_train.join(df_onehot)
-    return df.drop(['list_tags', 'ohe_tags'], axis=1)
 
+    def __init__(self, config: DataConfig, model: nn.Module):
+        """Initialize an instance of the class.
 
-def save_datasets(train_df, valid_df, test_df, data_path):
-    """With this function, you can save the datasets.
+        Args:
+            config (DataConfig): config data
+            model (nn.Module): timm model with the frozen backbone
+        """
+        super().__init__(config)
+        # the features are extracted once at the full resolution.
+        self._resolution_schedule = []
+        self._model = model
+        self._feature_prefix = get_feature_prefix(
+            os.path.join(config.data_path, 'features'),
+            get_backbone_hash(model),
+            width=config.width,
+            height=config.height,
+        )
 
-    Args:
-        train_df (_type_): train dataset
-        valid_df (_type_): valid dataset
-        test_df (_type_): test dataset
-        data_path (_type_): path to data
-    """
-    train_df.to_csv(os.path.join(data_path, 'df_train.csv'), index=False)
-    valid_df.to_csv(os.path.join(data_path, 'df_valid.csv'), index=False)
-    test_df.to_csv(os.path.join(data_path, 'df_test.csv'), index=False)
+    def prepare_data(self):
+        """Split the datasets and fill the feature store."""
+        if not self._prepare_data:
+            return
+        split_and_save_datasets(
+            self._data_path,
+            self._train_size,
+            seed=self._split_seed,
+            incremental=self._incremental_split,
+        )
+        n_workers = self._n_workers
+        if n_workers == AUTO:
+            n_workers = get_n_cpus()
+        device = torch.device('cpu')
+        if self.trainer is not None:
+            device = self.trainer.strategy.root_device
+        update_feature_store(
+            self._feature_prefix,
+            pd.concat([read_df(self._data_path, mode) for mode in SPLITS]),
+            model=self._model.to(device),
+            image_folder=self._image_folder,
+            transforms=get_transforms(
+                width=self._width,
+                height=self._height,
+                augmentations=False,
+            ),
+            batch_size=self._batch_size,
+            n_workers=n_workers,
+            device=device,
+        )
 
+    def _create_dataset(self, mode: str, transforms) -> Dataset:
+        return FeatureDataset(
+            self._feature_prefix, read_df(self._data_path, mode),
+        )
 
-def split_and_save_datasets(data_path: str, train_fraction: float = 0.8):
+
+def split_and_save_datasets(  # noqa: WPS210
+    data_path: str,
+    train_fraction: float = 0.8,
+    seed: int = SPLIT_SEED,
+    incremental: bool = False,
+):
     """With this function, you can split the dataset into selections.
 
+    The splits are reused while train_classes.csv, train_fraction and seed
+    are the same. In the incremental mode images of the previous splits
+    keep their split and only new images are stratified.
+
     Args:
         data_path (str): path to data
         train_fraction (float): size for the training sample.
+        seed (int): seed of the split. Defaults to SPLIT_SEED.
+        incremental (bool): keep the previous assignments. Defaults to False.
     """
-    df = pd.read_csv(os.path.join(data_path, 'train_classes.csv'))
-    df = one_hot_encoding(df)
-    logging.info('Original dataset: {len_df}'.format(len_df=len(df)))
-    df = df.drop_duplicates()
-    logging.info('Final dataset: {len_df}'.format(len_df=len(df)))
-
-    train_df, valid_df, test_df = stratify_shuffle_split_subsets(
-        df, train_fraction=train_fraction,
+    annotation_path = os.path.join(data_path, 'train_classes.csv')
+    annotation_hash = get_file_hash(annotation_path)
+    meta = read_meta(data_path)
+    split_paths = [get_split_path(data_path, mode) for mode in SPLITS]
+    has_splits = meta is not None and all(map(os.path.exists, split_paths))
+    split_key = get_split_key(annotation_hash, train_fraction, seed)
+    if has_splits and meta['key'] == split_key:
+        logging.info('Datasets are up to date.')
+        return
+
+    image_names, labels, classes = encode_tags(annotation_path)
+    logging.info('Final dataset: {len_df}'.format(len_df=len(image_names)))
+    folds = np.full(len(image_names), -1)
+    is_same_params = has_splits and (
+        meta['train_fraction'] == train_fraction and meta['seed'] == seed
+    )
+    if incremental and is_same_params:
+        folds = get_previous_folds(
+            image_names,
+            [load_split(path)[0] for path in split_paths],
+        )
+        logging.info('New images: {n}'.format(n=(folds < 0).sum()))
+    is_new = folds < 0
+    folds[is_new] = get_split_folds(
+        labels[is_new], train_fraction=train_fraction, seed=seed,
     )
-    logging.info('Train dataset: {len_df}'.format(len_df=len(train_df)))
-    logging.info('Valid dataset: {len_df}'.format(len_df=len(valid_df)))
-    logging.info('Test dataset: {len_df}'.format(len_df=len(test_df)))
 
-    save_datasets(train_df, valid_df, test_df, data_path)
+    remove_meta(data_path)
+    df = to_dataframe(image_names, labels, classes)
+    for fold, mode in enumerate(SPLITS):
+        split_df = df[folds == fold].reset_index(drop=True)
+        logging.info('{mode} dataset: {len_df}'.format(
+            mode=mode.capitalize(), len_df=len(split_df),
+        ))
+        save_split(get_split_path(data_path, mode), split_df)
+    # meta is written last: it marks the splits as complete.
+    write_meta(data_path, annotation_hash, train_fraction, seed)
     logging.info('Datasets successfully saved!')
 
 
+def get_split_path(data_path: str, mode: str) -> str:
+    """Path of a saved split.
+
+    Args:
+        data_path (str): path to data
+        mode (str): train, test or valid
+
+    Returns:
+        str: path to df_{mode}.npz
+    """
+    return os.path.join(data_path, 'df_{mode}.npz'.format(mode=mode))
+
+
 def read_df(data_path: str, mode: str) -> pd.DataFrame:
     """With this function, you can read dataset.
 
+    Splits saved as csv by older versions are read too.
+
     Args:
         data_path (str): path to data
         mode (str): train, test or val
@@ -194,6 +517,57 @@ def read_df(data_path: str, mode: str) -> pd.DataFrame:
     Returns:
         pd.DataFrame: dataframe
     """
-    df_format = 'df_{mode}.csv'.format(mode=mode)
-    path_to_df = os.path.join(data_path, df_format)
-    return pd.read_csv(path_to_df)
+    path_to_df = get_split_path(data_path, mode)
+    if not os.path.exists(path_to_df):
+        df_format = 'df_{mode}.csv'.format(mode=mode)
+        return pd.read_csv(os.path.join(data_path, df_format))
+    return to_dataframe(*load_split(path_to_df))
+
+
+def get_split_dataloader(
+    config: DataConfig,
+    split: str,
+    batch_size: int,
+    n_workers: int,
+    n_images: Optional[int] = None,
+) -> DataLoader:
+    """Dataloader of a saved split with the validation transforms.
+
+    Args:
+        config (DataConfig): config data
+        split (str): train, valid or test
+        batch_size (int): batch size
+        n_workers (int): number of workers
+        n_images (Optional[int]): use only the first n_images. Defaults to all.
+
+    Returns:
+        DataLoader: dataloader
+    """
+    dataset = PosterDataset(
+        read_df(config.data_path, split),
+        image_folder=os.path.join(config.data_path, 'train-jpg'),
+        transforms=get_transforms(
+            width=config.width,
+            height=config.height,
+            augmentations=False,
+        ),
+    )
+    if n_images is not None:
+        dataset = Subset(dataset, range(min(n_images, len(dataset))))
+    return DataLoader(
+        dataset, batch_size=batch_size, num_workers=n_workers, shuffle=False,
+    )
+
+
+def read_class_names(path_to_df: str) -> List[str]:
+    """With this function, you can read class names of a saved split.
+
+    Args:
+        path_to_df (str): path to df_*.npz or df_*.csv
+
+    Returns:
+        List[str]: class names in the order of the model outputs
+    """
+    if path_to_df.endswith('.npz'):
+        return load_classes(path_to_df)
+    return list(pd.read_csv(path_to_df, nrows=0).columns[1:])
@@ -1,14 +1,38 @@
 """Dataset class for pipeline."""
-import os
-from typing import Optional, Union
+from typing import List, Optional, Tuple
 
-import albumentations as albu
-import cv2
 import numpy as np
 import pandas as pd
 from torch.utils.data import Dataset
 
-TRANSFORM_TYPE = Union[albu.BasicTransform, albu.BaseCompose]
+from src.augmentations import TRANSFORM_TYPE
+from src.image_cache import load_image_cache, read_image, resize_image
+from src.shared_cache import SharedImageCache
+
+
+def get_labels(df: pd.DataFrame) -> np.ndarray:
+    """Convert one-hot columns of the dataframe into a label matrix.
+
+    Args:
+        df (pd.DataFrame): dataframe with image_name and one-hot labels
+
+    Returns:
+        np.ndarray: contiguous float32 matrix [n_images, n_classes]
+    """
+    labels = df.drop(columns=['image_name']).to_numpy(dtype=np.float32)
+    return np.ascontiguousarray(labels)
+
+
+def get_image_names(df: pd.DataFrame) -> np.ndarray:
+    """Convert image names into a compact fixed-width string array.
+
+    Args:
+        df (pd.DataFrame): dataframe with image_name column
+
+    Returns:
+        np.ndarray: unicode array of image names
+    """
+    return df['image_name'].to_numpy(dtype=str)
 
 
 class PosterDataset(Dataset):
@@ -22,17 +46,30 @@ class PosterDataset(Dataset):
         df: pd.DataFrame,
         image_folder: str,
         transforms: Optional[TRANSFORM_TYPE] = None,
+        shared_cache: Optional[SharedImageCache] = None,
+        teacher_logits_path: Optional[str] = None,
     ):
         """Initialize an instance of the class.
 
+        The dataframe is not stored: labels and names are kept as NumPy
+        arrays, which are cheap to index and to send to the workers.
+
         Args:
             df (pd.DataFrame): data frmae
             image_folder (str): path to image folder
             transforms (Optional[TRANSFORM_TYPE], optional): augmentation
+            shared_cache (Optional[SharedImageCache], optional): cache of
+            resized images, the transforms must not resize then.
+            teacher_logits_path (Optional[str], optional): .npy file with the
+            teacher logits of the images, they are returned third.
         """
-        self.df = df
+        self.labels = get_labels(df)
+        self.image_names = get_image_names(df)
         self.image_folder = image_folder
         self.transforms = transforms
+        self.shared_cache = shared_cache
+        self.teacher_logits_path = teacher_logits_path
+        self._teacher_logits: Optional[np.ndarray] = None
 
     def __getitem__(self, idx: int):
         """For iterat a dataset.
@@ -43,16 +80,67 @@ class PosterDataset(Dataset):
         Returns:
             _type_: image and labels
         """
-        row = self.df.iloc[idx]
+        sample = self._transform(self._read_image(idx), self.labels[idx])
+        return self._add_teacher_logits(sample, idx)
+
+    def __getitems__(self, indices: List[int]) -> List[Tuple]:
+        """Get a whole batch, the labels are taken with one slice.
+
+        Args:
+            indices (List[int]): indexes of the batch
+
+        Returns:
+            List[Tuple]: images and labels
+        """
+        batch_labels = self.labels[indices]
+        return [
+            self._add_teacher_logits(
+                self._transform(self._read_image(idx), labels), idx,
+            )
+            for idx, labels in zip(indices, batch_labels)
+        ]
+
+    def __len__(self) -> int:
+        """Show dataset size.
+
+        Returns:
+            int: idx last img
+        """
+        return len(self.labels)
+
+    def __getstate__(self) -> dict:
+        """Drop the memmap before sending the dataset to a worker.
+
+        Returns:
+            dict: state of the dataset
+        """
+        state = self.__dict__.copy()
+        state['_teacher_logits'] = None
+        return state
 
-        image_path = os.path.join(
-            self.image_folder,
-            '{image_name}.jpg'.format(image_name=row.image_name),
-        )
-        labels = np.array(row.values[1:], dtype='float32')
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    def _add_teacher_logits(self, sample: Tuple, idx: int) -> Tuple:
+        if self.teacher_logits_path is None:
+            return sample
+        if self._teacher_logits is None:
+            self._teacher_logits = np.load(
+                self.teacher_logits_path, mmap_mode='r',
+            )
+        return (*sample, np.array(self._teacher_logits[idx]))
 
+    def _read_image(self, idx: int) -> np.ndarray:
+        if self.shared_cache is None:
+            return read_image(self.image_folder, self.image_names[idx])
+        image = self.shared_cache.get(idx)
+        if image is None:
+            image = resize_image(
+                read_image(self.image_folder, self.image_names[idx]),
+                width=self.shared_cache.width,
+                height=self.shared_cache.height,
+            )
+            self.shared_cache.put(idx, image)
+        return image
+
+    def _transform(self, image: np.ndarray, labels: np.ndarray) -> Tuple:
         data_im = {'image': image, 'labels': labels}
 
         if self.transforms:
@@ -60,10 +148,76 @@ class PosterDataset(Dataset):
 
         return data_im['image'], data_im['labels']
 
-    def __len__(self) -> int:
-        """Show dataset size.
+
+class PosterCacheDataset(PosterDataset):
+    """Dataset reading pre-decoded images from the memory-mapped cache.
+
+    Args:
+        PosterDataset (_type_): dataset class for pipeline
+    """
+    def __init__(  # noqa: WPS612
+        self,
+        cache_prefix: str,
+        transforms: Optional[TRANSFORM_TYPE] = None,
+        teacher_logits_path: Optional[str] = None,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            cache_prefix (str): path prefix of the cache files
+            transforms (Optional[TRANSFORM_TYPE], optional): augmentation
+            teacher_logits_path (Optional[str], optional): .npy file with the
+            teacher logits of the images
+        """
+        self.cache_prefix = cache_prefix
+        self.transforms = transforms
+        self.shared_cache = None
+        self.teacher_logits_path = teacher_logits_path
+        self._teacher_logits: Optional[np.ndarray] = None
+        _, self.labels, self.image_names = load_image_cache(cache_prefix)
+        # the memmap is opened lazily so that every worker maps the file
+        # itself instead of receiving a pickled copy of the images.
+        self._images: Optional[np.ndarray] = None
+
+    def __getitem__(self, idx: int):
+        """For iterat a dataset.
+
+        Args:
+            idx (int): index - the number of the cached image
 
         Returns:
-            int: idx last img
+            _type_: image and labels
+        """
+        sample = self._transform(self._get_images()[idx], self.labels[idx])
+        return self._add_teacher_logits(sample, idx)
+
+    def __getitems__(self, indices: List[int]) -> List[Tuple]:
+        """Get a whole batch with one read from the cache.
+
+        Args:
+            indices (List[int]): indexes of the batch
+
+        Returns:
+            List[Tuple]: images and labels
+        """
+        batch_images = self._get_images()[indices]
+        batch_labels = self.labels[indices]
+        return [
+            self._add_teacher_logits(self._transform(image, labels), idx)
+            for idx, image, labels in zip(indices, batch_images, batch_labels)
+        ]
+
+    def __getstate__(self) -> dict:
+        """Drop the memmaps before sending the dataset to a worker.
+
+        Returns:
+            dict: state of the dataset
         """
-        return len(self.df)
+        state = super().__getstate__()
+        state['_images'] = None
+        return state
+
+    def _get_images(self) -> np.ndarray:
+        if self._images is None:
+            self._images, _, _ = load_image_cache(self.cache_prefix)
+        return self._images
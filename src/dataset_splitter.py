@@ -1,72 +1,124 @@
 """The scripts in this file are needed to split the dataset into samples."""
-import logging
-from typing import List, Tuple, Union
+from typing import Iterator, Sequence, Tuple
 
 import numpy as np
-import pandas as pd
-from skmultilearn.model_selection.iterative_stratification import \
-    IterativeStratification  # noqa: N400
 
+SPLIT_SEED = 42
 
-def stratify_shuffle_split_subsets(  # noqa: WPS210, E501 https://github.com/wemake-services/wemake-python-styleguide/issues/958
-    annotation: pd.DataFrame,
+
+def get_split_folds(
+    labels: np.ndarray,
     train_fraction: float = 0.8,
-) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    """Split dataset into train/valid/test.
+    seed: int = SPLIT_SEED,
+) -> np.ndarray:
+    """Assign samples to train/valid/test.
 
     Args:
-        annotation (pd.DataFrame): dataframe with annotations
+        labels (np.ndarray): one-hot labels [n_samples, n_labels]
         train_fraction (float): training dataset size. Defaults to 0.8.
+        seed (int): seed of the split. Defaults to SPLIT_SEED.
 
     Returns:
-        Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]: tuple
+        np.ndarray: 0 for train, 1 for valid and 2 for test samples
     """
-    x_columns = ['image_name']
-    y_columns = list(annotation.select_dtypes('int').columns)
+    else_fraction = (1 - train_fraction) / 2
+    return iterative_stratification(
+        labels,
+        fractions=[train_fraction, else_fraction, else_fraction],
+        seed=seed,
+    )
 
-    all_x = annotation[x_columns].to_numpy()
-    all_y = annotation[y_columns].to_numpy()
 
-    train_indexes, else_indexes = _split(
-        all_x,
-        all_y,
-        distribution=[1 - train_fraction, train_fraction],
-    )
-    x_train, x_else = all_x[train_indexes], all_x[else_indexes]
-    y_train, y_else = all_y[train_indexes], all_y[else_indexes]
+def iterative_kfold(
+    labels: np.ndarray,
+    n_splits: int = 5,
+    seed: int = SPLIT_SEED,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Stratified k-fold for multilabel data.
 
-    test_indexes, valid_indexes = _split(
-        x_else,
-        y_else,
-        distribution=[0.5, 0.5],
-    )
-    x_test, x_valid = x_else[test_indexes], x_else[valid_indexes]
-    y_test, y_valid = y_else[test_indexes], y_else[valid_indexes]
+    Args:
+        labels (np.ndarray): one-hot labels [n_samples, n_labels]
+        n_splits (int): number of folds. Defaults to 5.
+        seed (int): seed of the split. Defaults to SPLIT_SEED.
 
-    train_subset = pd.DataFrame(
-        data=np.concatenate([x_train, y_train], axis=1),
-        columns=x_columns + y_columns,
-    )
-    valid_subset = pd.DataFrame(
-        data=np.concatenate([x_valid, y_valid], axis=1),
-        columns=x_columns + y_columns,
-    )
-    test_subset = pd.DataFrame(
-        data=np.concatenate([x_test, y_test], axis=1),
-        columns=x_columns + y_columns,
+    Yields:
+        Tuple[np.ndarray, np.ndarray]: train and test indexes of every fold
+    """
+    folds = iterative_stratification(
+        labels, fractions=[1 / n_splits] * n_splits, seed=seed,
     )
-    logging.info('Stratifying dataset is completed.')
+    for fold in range(n_splits):
+        yield np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
 
-    return train_subset, valid_subset, test_subset
 
+def iterative_stratification(  # noqa: WPS210
+    labels: np.ndarray,
+    fractions: Sequence[float],
+    seed: int = SPLIT_SEED,
+) -> np.ndarray:
+    """Assign samples to folds with iterative stratification.
 
-def _split(
-    xs: np.array,
-    ys: np.array,
-    distribution: Union[None, List[float]] = None,
-) -> Tuple[np.array, np.array]:
-    stratifier = IterativeStratification(
-        n_splits=2,
-        sample_distribution_per_fold=distribution,
-    )
-    return next(stratifier.split(X=xs, y=ys))
+    Same order as Sechidis et al.: the label with the fewest remaining
+    samples is distributed first, to the folds that still need it most.
+    All samples of the label are assigned at once by fold quotas instead
+    of one by one, so the split is done in n_labels vectorized steps.
+
+    Args:
+        labels (np.ndarray): one-hot labels [n_samples, n_labels]
+        fractions (Sequence[float]): size of every fold
+        seed (int): seed of the split. Defaults to SPLIT_SEED.
+
+    Returns:
+        np.ndarray: fold of every sample
+    """
+    rng = np.random.default_rng(seed)
+    labels = labels.astype(bool)
+    fractions = np.asarray(fractions, dtype=np.float64)
+    fractions = fractions / fractions.sum()
+    desired_samples = fractions * len(labels)
+    desired_labels = np.outer(labels.sum(axis=0), fractions)
+
+    folds = np.full(len(labels), -1, dtype=np.int64)
+    remaining = np.ones(len(labels), dtype=bool)
+    for _ in range(labels.shape[1]):
+        label_counts = labels[remaining].sum(axis=0)
+        if not label_counts.any():
+            break
+        label = np.where(label_counts > 0, label_counts, np.inf).argmin()
+        indexes = np.flatnonzero(remaining & labels[:, label])
+        rng.shuffle(indexes)
+        quotas = _get_quotas(
+            len(indexes), desired_labels[label], desired_samples,
+        )
+
+        assigned_folds = np.repeat(np.arange(len(fractions)), quotas)
+        folds[indexes] = assigned_folds
+        remaining[indexes] = False
+        desired_samples -= quotas
+        desired_labels -= labels[indexes].T.astype(np.float64) @ np.eye(
+            len(fractions),
+        )[assigned_folds]
+
+    indexes = np.flatnonzero(remaining)
+    rng.shuffle(indexes)
+    quotas = _get_quotas(len(indexes), desired_samples, desired_samples)
+    folds[indexes] = np.repeat(np.arange(len(fractions)), quotas)
+    return folds
+
+
+def _get_quotas(
+    n_samples: int,
+    desired: np.ndarray,
+    desired_samples: np.ndarray,
+) -> np.ndarray:
+    weights = np.clip(desired, 0, None)
+    if weights.sum() <= 0:
+        weights = np.clip(desired_samples, 0, None)
+    if weights.sum() <= 0:
+        weights = np.ones_like(desired)
+    ideal = n_samples * weights / weights.sum()
+    quotas = np.floor(ideal).astype(np.int64)
+    # the rest goes to the largest remainders, ties to the emptier fold.
+    order = np.lexsort((-desired_samples, -(ideal - quotas)))
+    quotas[order[:n_samples - quotas.sum()]] += 1
+    return quotas
@@ -0,0 +1,132 @@
+"""Teacher of the knowledge distillation and its precomputed logits."""
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import DataLoader
+
+from src.split_cache import get_file_hash
+
+META_SUFFIX = '.json'
+
+
+def load_teacher(checkpoint_path: str, num_classes: int) -> nn.Module:
+    """Load the frozen teacher network from a PosterModule checkpoint.
+
+    Args:
+        checkpoint_path (str): path to the teacher checkpoint
+        num_classes (int): number of classes of the student
+
+    Raises:
+        ValueError: the teacher predicts another number of classes
+
+    Returns:
+        nn.Module: network in eval mode without gradients
+    """
+    # predict imports the module.
+    from src.predict import load_module  # noqa: WPS433
+
+    module = load_module(checkpoint_path)
+    if module.hparams.config.num_classes != num_classes:
+        raise ValueError(
+            'Teacher predicts {teacher} classes, the student {student}'.format(
+                teacher=module.hparams.config.num_classes, student=num_classes,
+            ),
+        )
+    teacher = module.model.eval()
+    teacher.requires_grad_(False)
+    return teacher
+
+
+def get_logits_meta(checkpoint_path: str, image_names: np.ndarray) -> dict:
+    """Identify the teacher and the images of the precomputed logits.
+
+    Args:
+        checkpoint_path (str): path to the teacher checkpoint
+        image_names (np.ndarray): image names of the split
+
+    Returns:
+        dict: hashes of the checkpoint and of the image names
+    """
+    names_hash = hashlib.sha256('\n'.join(image_names).encode()).hexdigest()
+    return {
+        'teacher_hash': get_file_hash(checkpoint_path),
+        'names_hash': names_hash,
+        'n_images': len(image_names),
+    }
+
+
+def read_logits_meta(logits_path: str) -> Optional[dict]:
+    """Read the meta of the precomputed logits.
+
+    Args:
+        logits_path (str): path to the .npy file
+
+    Returns:
+        Optional[dict]: meta or None if the logits are not complete
+    """
+    meta_path = logits_path + META_SUFFIX
+    if not os.path.exists(meta_path) or not os.path.exists(logits_path):
+        return None
+    with open(meta_path) as meta_file:
+        return json.load(meta_file)
+
+
+def precompute_teacher_logits(  # noqa: WPS210
+    checkpoint_path: str,
+    dataloader: DataLoader,
+    image_names: np.ndarray,
+    logits_path: str,
+    num_classes: int,
+    device: Optional[torch.device] = None,
+):
+    """Write the teacher logits of the split to a memory-mapped .npy file.
+
+    Nothing is done if the file has the logits of the same teacher for
+    the same images. The meta is written last and marks the file complete.
+
+    Args:
+        checkpoint_path (str): path to the teacher checkpoint
+        dataloader (DataLoader): unshuffled images of the split without
+            augmentations
+        image_names (np.ndarray): image names in the order of the dataloader
+        logits_path (str): path to the .npy file
+        num_classes (int): number of classes
+        device (Optional[torch.device]): device of the teacher. Defaults
+            to cpu.
+    """
+    meta = get_logits_meta(checkpoint_path, image_names)
+    if read_logits_meta(logits_path) == meta:
+        logging.info('Teacher logits are up to date.')
+        return
+
+    meta_path = logits_path + META_SUFFIX
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    device = device or torch.device('cpu')
+    teacher = load_teacher(checkpoint_path, num_classes).to(device)
+    os.makedirs(os.path.dirname(os.path.abspath(logits_path)), exist_ok=True)
+    logits = np.lib.format.open_memmap(
+        logits_path,
+        mode='w+',
+        dtype=np.float32,
+        shape=(len(image_names), num_classes),
+    )
+    start = 0
+    with torch.inference_mode():
+        for images, _ in dataloader:
+            batch_logits = teacher(images.to(device)).float().cpu().numpy()
+            logits[start:start + len(batch_logits)] = batch_logits
+            start += len(batch_logits)
+    logits.flush()
+    del logits  # noqa: WPS420 closes the memmap
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file)
+    logging.info('Teacher logits of {n} images saved to {path}'.format(
+        n=start, path=logits_path,
+    ))
@@ -0,0 +1,282 @@
+"""The scripts in this file export the model to ONNX and TorchScript."""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import List
+
+import numpy as np
+import torch
+from torch import nn
+
+from src.augmentations import (
+    IMAGENET_MEAN,
+    IMAGENET_STD,
+    MAX_PIXEL_VALUE,
+    get_transforms,
+)
+from src.predict import get_class_names, load_module
+from src.thresholds import load_thresholds
+
+ONNX_FORMAT = 'onnx'
+TORCHSCRIPT_FORMAT = 'torchscript'
+ONNX_FILENAME = 'model.onnx'
+TORCHSCRIPT_FILENAME = 'model.pt'
+META_FILENAME = 'meta.json'
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='model checkpoint')
+    parser.add_argument('output_dir', type=str, help='folder for the export')
+    parser.add_argument(
+        '--formats',
+        nargs='+',
+        default=[ONNX_FORMAT, TORCHSCRIPT_FORMAT],
+        choices=[ONNX_FORMAT, TORCHSCRIPT_FORMAT],
+    )
+    parser.add_argument(
+        '--classes',
+        type=str,
+        default=None,
+        help='df_*.npz or df_*.csv to read class names from',
+    )
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    return parser.parse_args()
+
+
+class ExportModel(nn.Module):
+    """Model with the normalization and the sigmoid folded in.
+
+    Input is a uint8 RGB batch [B, H, W, 3] already resized to the size of
+    the config, output is the probabilities of the classes.
+
+    Args:
+        nn (_type_): torch module
+    """
+    def __init__(self, model: nn.Module):
+        """Initialize an instance of the class.
+
+        Args:
+            model (nn.Module): model returning logits
+        """
+        super().__init__()
+        self.model = model
+        mean = torch.tensor(IMAGENET_MEAN) * MAX_PIXEL_VALUE
+        std = torch.tensor(IMAGENET_STD) * MAX_PIXEL_VALUE
+        self.register_buffer('mean', mean.view(1, 3, 1, 1))
+        self.register_buffer('std', std.view(1, 3, 1, 1))
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        """forward.
+
+        Args:
+            images (torch.Tensor): uint8 batch [B, H, W, 3]
+
+        Returns:
+            torch.Tensor: probabilities
+        """
+        images = images.permute(0, 3, 1, 2).float()
+        return torch.sigmoid(self.model((images - self.mean) / self.std))
+
+
+def export_onnx(
+    model: ExportModel,
+    example: torch.Tensor,
+    path: str,
+    opset: int = 17,
+):
+    """Export the model to ONNX with a dynamic batch size.
+
+    Args:
+        model (ExportModel): model
+        example (torch.Tensor): example input
+        path (str): path to .onnx file
+        opset (int): ONNX opset. Defaults to 17.
+    """
+    torch.onnx.export(
+        model,
+        example,
+        path,
+        input_names=['images'],
+        output_names=['probs'],
+        dynamic_axes={'images': {0: 'batch'}, 'probs': {0: 'batch'}},
+        opset_version=opset,
+    )
+
+
+def export_torchscript(model: ExportModel, example: torch.Tensor, path: str):
+    """Export the model to a traced TorchScript graph.
+
+    Args:
+        model (ExportModel): model
+        example (torch.Tensor): example input
+        path (str): path to .pt file
+    """
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, example)
+    torch.jit.save(torch.jit.freeze(traced), path)
+
+
+def save_meta(
+    path: str,
+    class_names: List[str],
+    width: int,
+    height: int,
+    thresholds: List[float],
+):
+    """Save what the predictor needs besides the graph.
+
+    Args:
+        path (str): path to .json file
+        class_names (List[str]): class names
+        width (int): width image
+        height (int): height image
+        thresholds (List[float]): threshold of every class
+    """
+    meta = {
+        'class_names': class_names,
+        'width': width,
+        'height': height,
+        'thresholds': thresholds,
+    }
+    with open(path, 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+
+def get_reference_probs(module, images: np.ndarray) -> np.ndarray:
+    """Get probabilities of the checkpoint with the original preprocessing.
+
+    Args:
+        module (_type_): PosterModule
+        images (np.ndarray): uint8 batch [B, H, W, 3]
+
+    Returns:
+        np.ndarray: probabilities
+    """
+    data_config = module.hparams.config.data_config
+    transforms = get_transforms(
+        width=data_config.width,
+        height=data_config.height,
+        augmentations=False,
+    )
+    batch = torch.stack([transforms(image=image)['image'] for image in images])
+    with torch.inference_mode():
+        return torch.sigmoid(module(batch)).numpy()
+
+
+def check_parity(
+    reference: np.ndarray,
+    exported: np.ndarray,
+    name: str,
+    atol: float = 1e-4,
+):
+    """Check that the exported model gives the same probabilities.
+
+    Args:
+        reference (np.ndarray): probabilities of the checkpoint
+        exported (np.ndarray): probabilities of the exported model
+        name (str): name of the format
+        atol (float): max absolute difference. Defaults to 1e-4.
+
+    Raises:
+        ValueError: the difference is greater than atol
+    """
+    max_diff = float(np.abs(reference - exported).max())
+    logging.info('{name} parity: max abs diff {diff:.2e}'.format(
+        name=name, diff=max_diff,
+    ))
+    if max_diff > atol:
+        raise ValueError(
+            '{name} differs from the checkpoint: {diff:.2e} > {atol}.'.format(
+                name=name, diff=max_diff, atol=atol,
+            ),
+        )
+
+
+def export(  # noqa: WPS210
+    checkpoint_path: str,
+    output_dir: str,
+    formats: List[str],
+    classes_path: str = None,
+    opset: int = 17,
+    atol: float = 1e-4,
+):
+    """Export the checkpoint and check parity of the exported models.
+
+    Args:
+        checkpoint_path (str): model checkpoint
+        output_dir (str): folder for the export
+        formats (List[str]): onnx and/or torchscript
+        classes_path (str): df_*.npz or df_*.csv to read class names from
+        opset (int): ONNX opset. Defaults to 17.
+        atol (float): max absolute difference. Defaults to 1e-4.
+    """
+    module = load_module(checkpoint_path)
+    data_config = module.hparams.config.data_config
+    model = ExportModel(module.model).eval()
+    os.makedirs(output_dir, exist_ok=True)
+    save_meta(
+        os.path.join(output_dir, META_FILENAME),
+        class_names=get_class_names(module, classes_path),
+        width=data_config.width,
+        height=data_config.height,
+        # tuned on validation by train.py or thresholds.py, else the default.
+        thresholds=load_thresholds(
+            checkpoint_path, module.hparams.config.num_classes,
+        ).tolist(),
+    )
+
+    rng = np.random.default_rng(0)
+    images = rng.integers(
+        0,
+        256,
+        size=(4, data_config.height, data_config.width, 3),
+        dtype=np.uint8,
+    )
+    example = torch.from_numpy(images)
+    reference = get_reference_probs(module, images)
+
+    if ONNX_FORMAT in formats:
+        from src.onnx_predictor import OnnxPredictor  # noqa: WPS433
+
+        onnx_path = os.path.join(output_dir, ONNX_FILENAME)
+        export_onnx(model, example, onnx_path, opset=opset)
+        start_time = time.perf_counter()
+        predictor = OnnxPredictor(onnx_path)
+        logging.info('ONNX Runtime session is created in {sec:.2f} sec'.format(
+            sec=time.perf_counter() - start_time,
+        ))
+        check_parity(reference, predictor.predict_batch(images), 'ONNX', atol)
+
+    if TORCHSCRIPT_FORMAT in formats:
+        torchscript_path = os.path.join(output_dir, TORCHSCRIPT_FILENAME)
+        export_torchscript(model, example, torchscript_path)
+        traced = torch.jit.load(torchscript_path)
+        with torch.inference_mode():
+            exported = traced(example).numpy()
+        check_parity(reference, exported, 'TorchScript', atol)
+
+
+if __name__ == '__main__':
+    args = arg_parse()
+    logging.basicConfig(level=logging.INFO)
+    start_time = time.perf_counter()
+    export(
+        args.checkpoint,
+        args.output_dir,
+        formats=args.formats,
+        classes_path=args.classes,
+        opset=args.opset,
+        atol=args.atol,
+    )
+    logging.info('Export is done in {sec:.2f} sec'.format(
+        sec=time.perf_counter() - start_time,
+    ))
@@ -0,0 +1,279 @@
+"""Memory-mapped store of pooled backbone features keyed by image name."""
+import hashlib
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+from torch import nn
+from torch.utils.data import DataLoader, Dataset
+
+from src.augmentations import TRANSFORM_TYPE
+from src.dataset import PosterDataset, get_image_names, get_labels
+
+FEATURES_SUFFIX = 'features.npy'
+NAMES_SUFFIX = 'names.npy'
+
+
+def get_backbone_hash(model: nn.Module) -> str:
+    """Hash the backbone weights, the classifier is not a part of it.
+
+    Args:
+        model (nn.Module): timm model
+
+    Returns:
+        str: sha256 of the weights
+    """
+    classifier_ptrs = {
+        weight.data_ptr()
+        for weight in model.get_classifier().state_dict().values()
+    }
+    backbone_hash = hashlib.sha256()
+    for name, weight in model.state_dict().items():
+        if weight.data_ptr() in classifier_ptrs:
+            continue
+        backbone_hash.update(name.encode())
+        weight_bytes = weight.detach().cpu().reshape(-1).view(torch.uint8)
+        backbone_hash.update(weight_bytes.numpy())
+    return backbone_hash.hexdigest()
+
+
+def get_feature_prefix(
+    store_dir: str,
+    backbone_hash: str,
+    width: int,
+    height: int,
+) -> str:
+    """Return the common prefix of the store files of a backbone.
+
+    Args:
+        store_dir (str): folder with the stores
+        backbone_hash (str): hash of the backbone weights
+        width (int): width image
+        height (int): height image
+
+    Returns:
+        str: path prefix of the store files
+    """
+    return os.path.join(
+        store_dir,
+        '{backbone}_{width}x{height}_'.format(
+            backbone=backbone_hash[:16], width=width, height=height,
+        ),
+    )
+
+
+def get_pooled_features(
+    model: nn.Module,
+    images: torch.Tensor,
+) -> torch.Tensor:
+    """Features of the timm model right before the classifier.
+
+    Args:
+        model (nn.Module): timm model
+        images (torch.Tensor): normalized images
+
+    Returns:
+        torch.Tensor: features [batch_size, n_features]
+    """
+    return model.forward_head(model.forward_features(images), pre_logits=True)
+
+
+def load_feature_store(prefix: str) -> Optional[pd.Series]:
+    """Row of every stored image.
+
+    Args:
+        prefix (str): path prefix of the store files
+
+    Returns:
+        Optional[pd.Series]: rows indexed by image name or None if there is
+        no store
+    """
+    if not os.path.exists(prefix + NAMES_SUFFIX):
+        return None
+    names = np.load(prefix + NAMES_SUFFIX)
+    return pd.Series(np.arange(len(names)), index=names)
+
+
+def get_feature_rows(prefix: str, image_names: np.ndarray) -> np.ndarray:
+    """Rows of the images in the store.
+
+    Args:
+        prefix (str): path prefix of the store files
+        image_names (np.ndarray): image names
+
+    Raises:
+        KeyError: some images are not in the store
+
+    Returns:
+        np.ndarray: rows of the features
+    """
+    rows = load_feature_store(prefix)
+    if rows is None:
+        indexer = np.full(len(image_names), -1)
+    else:
+        indexer = rows.index.get_indexer(image_names)
+    n_missing = int((indexer < 0).sum())
+    if n_missing:
+        raise KeyError(
+            '{n} images are not in the feature store {prefix}'.format(
+                n=n_missing, prefix=prefix,
+            ),
+        )
+    return indexer
+
+
+def update_feature_store(  # noqa: WPS210, WPS211
+    prefix: str,
+    df: pd.DataFrame,
+    model: nn.Module,
+    image_folder: str,
+    transforms: TRANSFORM_TYPE,
+    batch_size: int,
+    n_workers: int = 0,
+    device: Optional[torch.device] = None,
+):
+    """Add the float16 features of the images missing from the store.
+
+    The stored rows are copied to a new file with the new rows after
+    them; the names file is replaced last and marks the store complete.
+
+    Args:
+        prefix (str): path prefix of the store files
+        df (pd.DataFrame): dataframe with image_name and one-hot labels
+        model (nn.Module): timm model
+        image_folder (str): path to image folder
+        transforms (TRANSFORM_TYPE): transforms without augmentations
+        batch_size (int): batch size
+        n_workers (int): number of workers. Defaults to 0.
+        device (Optional[torch.device]): device of the model. Defaults to cpu.
+    """
+    rows = load_feature_store(prefix)
+    stored_names = np.array([], dtype=str)
+    if rows is not None:
+        stored_names = rows.index.to_numpy(dtype=str)
+    new_df = df[~df['image_name'].isin(stored_names)]
+    new_df = new_df.drop_duplicates('image_name')
+    if new_df.empty:
+        logging.info('Feature store {prefix} is up to date.'.format(
+            prefix=prefix,
+        ))
+        return
+
+    device = device or torch.device('cpu')
+    dataloader = DataLoader(
+        PosterDataset(
+            new_df, image_folder=image_folder, transforms=transforms,
+        ),
+        batch_size=batch_size,
+        num_workers=n_workers,
+    )
+    is_training = model.training
+    model.eval()
+    batches = []
+    with torch.inference_mode():
+        for images, _ in dataloader:
+            features = get_pooled_features(model, images.to(device))
+            batches.append(features.to(torch.float16).cpu().numpy())
+    model.train(is_training)
+    new_features = np.concatenate(batches)
+
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    tmp_path = prefix + 'tmp_' + FEATURES_SUFFIX
+    features = np.lib.format.open_memmap(
+        tmp_path,
+        mode='w+',
+        dtype=np.float16,
+        shape=(len(stored_names) + len(new_features), new_features.shape[1]),
+    )
+    if len(stored_names):
+        features[:len(stored_names)] = np.load(
+            prefix + FEATURES_SUFFIX, mmap_mode='r',
+        )
+    features[len(stored_names):] = new_features
+    features.flush()
+    del features  # noqa: WPS420
+    if rows is not None:
+        os.remove(prefix + NAMES_SUFFIX)
+    os.replace(tmp_path, prefix + FEATURES_SUFFIX)
+    # names are written last: they mark the store as complete.
+    np.save(prefix + NAMES_SUFFIX, np.concatenate([
+        stored_names, new_df['image_name'].to_numpy(dtype=str),
+    ]))
+    logging.info(
+        'Feature store {prefix}: {n} new images, {total} in total.'.format(
+            prefix=prefix,
+            n=len(new_df),
+            total=len(stored_names) + len(new_df),
+        ),
+    )
+
+
+class FeatureDataset(Dataset):
+    """Stored features and labels of a split."""
+
+    def __init__(self, prefix: str, df: pd.DataFrame):
+        """Initialize an instance of the class.
+
+        Args:
+            prefix (str): path prefix of the store files
+            df (pd.DataFrame): dataframe with image_name and one-hot labels
+        """
+        self.prefix = prefix
+        self.labels = get_labels(df)
+        self.image_names = get_image_names(df)
+        self.rows = get_feature_rows(prefix, self.image_names)
+        # the memmap is opened lazily in every worker, like the image cache.
+        self._features: Optional[np.ndarray] = None
+
+    def __getitem__(self, idx: int):
+        """Get features and labels.
+
+        Args:
+            idx (int): index - the number of the dataframe line
+
+        Returns:
+            _type_: float32 features and labels
+        """
+        features = self._get_features()[self.rows[idx]]
+        return features.astype(np.float32), self.labels[idx]
+
+    def __getitems__(self, indices: List[int]) -> List[Tuple]:
+        """Get a whole batch with one read from the store.
+
+        Args:
+            indices (List[int]): indexes of the batch
+
+        Returns:
+            List[Tuple]: features and labels
+        """
+        batch_features = self._get_features()[self.rows[indices]]
+        batch_features = batch_features.astype(np.float32)
+        return list(zip(batch_features, self.labels[indices]))
+
+    def __len__(self) -> int:
+        """Show dataset size.
+
+        Returns:
+            int: number of images
+        """
+        return len(self.labels)
+
+    def __getstate__(self) -> dict:
+        """Drop the memmap before sending the dataset to a worker.
+
+        Returns:
+            dict: state of the dataset
+        """
+        state = self.__dict__.copy()
+        state['_features'] = None
+        return state
+
+    def _get_features(self) -> np.ndarray:
+        if self._features is None:
+            self._features = np.load(
+                self.prefix + FEATURES_SUFFIX, mmap_mode='r',
+            )
+        return self._features
@@ -0,0 +1,183 @@
+"""Pre-decoded memory-mapped image cache for the pipeline."""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+
+IMAGES_SUFFIX = 'images.npy'
+LABELS_SUFFIX = 'labels.npy'
+NAMES_SUFFIX = 'names.npy'
+
+
+def get_cache_prefix(
+    cache_dir: str,
+    mode: str,
+    width: int,
+    height: int,
+) -> str:
+    """Return the common prefix of the cache files for a split.
+
+    Args:
+        cache_dir (str): folder with cache files
+        mode (str): train, test or valid
+        width (int): width image
+        height (int): height image
+
+    Returns:
+        str: path prefix of the cache files
+    """
+    return os.path.join(
+        cache_dir,
+        '{mode}_{width}x{height}_'.format(
+            mode=mode, width=width, height=height,
+        ),
+    )
+
+
+def read_image(image_folder: str, image_name: str) -> np.ndarray:
+    """Read an image in RGB.
+
+    Args:
+        image_folder (str): path to image folder
+        image_name (str): image name without extension
+
+    Returns:
+        np.ndarray: RGB image
+    """
+    image_path = os.path.join(
+        image_folder,
+        '{image_name}.jpg'.format(image_name=image_name),
+    )
+    image = cv2.imread(image_path)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def resize_image(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Resize an image like albu.Resize.
+
+    Args:
+        image (np.ndarray): RGB image
+        width (int): width image
+        height (int): height image
+
+    Returns:
+        np.ndarray: resized image
+    """
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def is_cache_valid(
+    prefix: str,
+    image_names: np.ndarray,
+    labels: Optional[np.ndarray] = None,
+) -> bool:
+    """Check that the cache exists and was built for the same images.
+
+    Args:
+        prefix (str): path prefix of the cache files
+        image_names (np.ndarray): expected image names
+        labels (Optional[np.ndarray]): expected labels, None to check
+            only the images
+
+    Returns:
+        bool: True if the cache can be reused
+    """
+    paths = [
+        prefix + suffix
+        for suffix in (IMAGES_SUFFIX, LABELS_SUFFIX, NAMES_SUFFIX)
+    ]
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    cached_names = np.load(prefix + NAMES_SUFFIX)
+    if not np.array_equal(cached_names, image_names):
+        return False
+    if labels is None:
+        return True
+    return np.array_equal(np.load(prefix + LABELS_SUFFIX), labels)
+
+
+def build_image_cache(  # noqa: WPS210
+    df: pd.DataFrame,
+    image_folder: str,
+    prefix: str,
+    width: int,
+    height: int,
+    n_workers: int = 1,
+):
+    """Decode and resize all images of a split into a memory-mapped array.
+
+    Args:
+        df (pd.DataFrame): dataframe with image_name and one-hot labels
+        image_folder (str): path to image folder
+        prefix (str): path prefix of the cache files
+        width (int): width image
+        height (int): height image
+        n_workers (int): number of decoding threads. Defaults to 1.
+    """
+    image_names = df['image_name'].to_numpy(dtype=str)
+    labels = df.drop(columns=['image_name']).to_numpy(dtype=np.float32)
+    if is_cache_valid(prefix, image_names, labels):
+        logging.info('Image cache {prefix} is up to date.'.format(
+            prefix=prefix,
+        ))
+        return
+    if is_cache_valid(prefix, image_names):
+        # the images are the same, only the labels are written again.
+        _save_labels(prefix, image_names, labels)
+        logging.info('Image cache {prefix}: labels are updated.'.format(
+            prefix=prefix,
+        ))
+        return
+
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    if os.path.exists(prefix + NAMES_SUFFIX):
+        os.remove(prefix + NAMES_SUFFIX)
+    images = np.lib.format.open_memmap(
+        prefix + IMAGES_SUFFIX,
+        mode='w+',
+        dtype=np.uint8,
+        shape=(len(image_names), height, width, 3),
+    )
+
+    def _decode(idx: int):  # noqa: WPS430
+        image = read_image(image_folder, image_names[idx])
+        images[idx] = resize_image(image, width, height)
+
+    # cv2 releases the GIL, so threads are enough to decode in parallel.
+    with ThreadPoolExecutor(max_workers=max(n_workers, 1)) as executor:
+        list(executor.map(_decode, range(len(image_names))))
+    images.flush()
+    del images  # noqa: WPS420
+
+    _save_labels(prefix, image_names, labels)
+    logging.info('Image cache {prefix} is built: {n} images.'.format(
+        prefix=prefix, n=len(image_names),
+    ))
+
+
+def _save_labels(prefix: str, image_names: np.ndarray, labels: np.ndarray):
+    if os.path.exists(prefix + NAMES_SUFFIX):
+        os.remove(prefix + NAMES_SUFFIX)
+    np.save(prefix + LABELS_SUFFIX, labels)
+    # names are written last: they mark the cache as complete.
+    np.save(prefix + NAMES_SUFFIX, image_names)
+
+
+def load_image_cache(prefix: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Open the cache files of a split.
+
+    Args:
+        prefix (str): path prefix of the cache files
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: memory-mapped images,
+        labels and image names
+    """
+    images = np.load(prefix + IMAGES_SUFFIX, mmap_mode='r')
+    labels = np.load(prefix + LABELS_SUFFIX)
+    names = np.load(prefix + NAMES_SUFFIX)
+    return images, labels, names
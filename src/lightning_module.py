@@ -1,13 +1,21 @@
 """Lighting module."""
+import logging
+from typing import Callable, Dict, Optional
+
+import numpy as np
 import pytorch_lightning as pl
 import torch
-from timm import create_model
 
+from src.augmentations import TORCH_BACKEND, BatchAugmentations
+from src.checkpointing import read_model_weights
 from src.config import Config
-from src.losses import get_losses
-from src.metrics import get_metrics
+from src.losses import FusedLosses, get_losses
+from src.metrics import HistogramCurves, get_multilabel_metrics
+from src.thresholds import DEFAULT_THRESHOLD
 from src.utils import load_object
 
+TEACHER_PREFIX = '_teacher.'
+
 
 class PosterModule(pl.LightningModule):  # noqa: WPS214
     """Class module.
@@ -15,31 +23,78 @@ class PosterModule(pl.LightningModule):  # noqa: WPS214
     Args:
         pl (_type_): LightningModule
     """
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        model: Optional[torch.nn.Module] = None,
+    ):
         """Initialize an instance of the class..
 
         Args:
             config (Config): config
+            model (Optional[torch.nn.Module]): timm model with loaded weights,
+                by default it is created from model_kwargs
         """
         super().__init__()
+        # a config pickled by an older version misses the new fields, the
+        # validation fills their defaults, also in hparams.
+        config = Config.parse_raw(config.json())
         self._config = config
 
-        self._model = create_model(
-            num_classes=self._config.num_classes,
-            **self._config.model_kwargs,
-        )
-        self._losses = get_losses(self._config.losses)
-        metrics = get_metrics(
-            num_classes=self._config.num_classes,
-            num_labels=self._config.num_classes,
-            task='multilabel',
-            average='macro',
-            threshold=0.5,
+        if model is None:
+            # timm takes a while to import, it is only needed here.
+            from timm import create_model  # noqa: WPS433
+
+            model = create_model(
+                num_classes=self._config.num_classes,
+                **self._config.model_kwargs,
+            )
+        self._model = model
+        if self._config.channels_last:
+            self._model = self._model.to(memory_format=torch.channels_last)
+        # compiled in setup for fit only, the weights stay in self._model.
+        self._compiled_forward: Optional[Callable] = None
+        self._losses = FusedLosses(get_losses(self._config.losses))
+        # train losses are summed on the device between logging steps.
+        self.register_buffer(
+            '_train_loss_sums',
+            torch.zeros(len(self._config.losses) + 1),
+            persistent=False,
         )
+        self._n_train_losses = 0
+        metrics = get_multilabel_metrics(self._config.num_classes)
         self._valid_metrics = metrics.clone(prefix='val_')
         self._test_metrics = metrics.clone(prefix='test_')
+        # mAP, F2 and PR curves from constant-size histograms of the
+        # probabilities.
+        self._valid_curves = HistogramCurves(self._config.num_classes)
+        self._test_curves = HistogramCurves(self._config.num_classes)
+        # PR curves and AP of the last validation and test,
+        # e.g. pr_curves['val'].
+        self.pr_curves: Dict[str, Dict[str, np.ndarray]] = {}
+        # per-class thresholds of the test metrics, they are tuned on
+        # validation after training and are not stored in the checkpoint.
+        self.register_buffer(
+            'thresholds',
+            torch.full((self._config.num_classes,), DEFAULT_THRESHOLD),
+            persistent=False,
+        )
+        # frozen network of the distillation, loaded for fit in setup.
+        self._teacher: Optional[torch.nn.Module] = None
+        self._batch_augmentations = None
+        if self._config.data_config.augmentation_backend == TORCH_BACKEND:
+            self._batch_augmentations = BatchAugmentations()
+
+        self.save_hyperparameters(ignore=['model'])
 
-        self.save_hyperparameters()
+    @property
+    def model(self) -> torch.nn.Module:
+        """Classification network without the Lightning wrapper.
+
+        Returns:
+            torch.nn.Module: timm model
+        """
+        return self._model
 
     def forward(self, x_im: torch.Tensor) -> torch.Tensor:
         """forward.
@@ -50,8 +105,102 @@ class PosterModule(pl.LightningModule):  # noqa: WPS214
         Returns:
             torch.Tensor: pred
         """
+        if self._compiled_forward is not None:
+            return self._compiled_forward(x_im)
         return self._model(x_im)
 
+    def setup(self, stage: str) -> None:
+        """Load the teacher and compile the model before training.
+
+        Args:
+            stage (str): fit, validate, test or predict
+        """
+        if stage == 'fit':
+            self._setup_teacher()
+        compile_mode = self._config.compile_mode
+        is_compiled = self._compiled_forward is not None
+        if stage != 'fit' or compile_mode is None or is_compiled:
+            return
+        try:
+            compiled_forward = torch.compile(self._model, mode=compile_mode)
+        except RuntimeError as error:
+            # e.g. torch.compile is not supported on this Python version.
+            logging.warning('torch.compile is skipped: {error}'.format(
+                error=error,
+            ))
+            return
+        # not registered as a submodule, so the weights are not saved twice
+        # under _compiled_forward._orig_mod in the checkpoint.
+        object.__setattr__(  # noqa: WPS609
+            self, '_compiled_forward', compiled_forward,
+        )
+
+    def train(self, mode: bool = True) -> 'PosterModule':
+        """Set the train mode, the teacher always stays in eval mode.
+
+        Args:
+            mode (bool): train mode. Defaults to True.
+
+        Returns:
+            PosterModule: self
+        """
+        super().train(mode)
+        if self._teacher is not None:
+            self._teacher.eval()
+        return self
+
+    def on_save_checkpoint(self, checkpoint: dict) -> None:
+        """Leave the teacher weights out of the checkpoint.
+
+        Args:
+            checkpoint (dict): checkpoint
+        """
+        state_dict = checkpoint['state_dict']
+        teacher_keys = [
+            key for key in state_dict if key.startswith(TEACHER_PREFIX)
+        ]
+        for key in teacher_keys:
+            state_dict.pop(key)
+
+    def on_load_checkpoint(self, checkpoint: dict) -> None:
+        """Add the weights of the loaded teacher for strict loading.
+
+        Args:
+            checkpoint (dict): checkpoint
+        """
+        if self._teacher is not None:
+            checkpoint['state_dict'].update({
+                '{prefix}{key}'.format(prefix=TEACHER_PREFIX, key=key): weight
+                for key, weight in self._teacher.state_dict().items()
+            })
+
+    def set_thresholds(self, thresholds) -> None:
+        """Set per-class thresholds of the test metrics.
+
+        Args:
+            thresholds (_type_): threshold of every class
+        """
+        self.thresholds.copy_(torch.as_tensor(thresholds))
+
+    def on_after_batch_transfer(self, batch, dataloader_idx: int):
+        """Augment uint8 batches on the module device, set the memory format.
+
+        Args:
+            batch (_type_): images, labels and optional teacher logits
+            dataloader_idx (int): idx dataloader
+
+        Returns:
+            _type_: images, labels and optional teacher logits
+        """
+        images, *targets = batch
+        if self._batch_augmentations is not None:
+            images = self._batch_augmentations(
+                images, augment=self.trainer.training,
+            )
+        if self._config.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        return (images, *targets)
+
     def configure_optimizers(self):
         """Configure optimizers.
 
@@ -85,9 +234,18 @@ class PosterModule(pl.LightningModule):  # noqa: WPS214
         Returns:
             _type_:  train loss
         """
-        images, gt_labels = batch
+        images, gt_labels, *teacher_logits = batch
         pr_logits = self(images)
-        return self._calculate_loss(pr_logits, gt_labels, 'train_')
+        if teacher_logits:
+            teacher_logits = teacher_logits[0]
+        elif self._teacher is not None:
+            with torch.no_grad():
+                teacher_logits = self._teacher(images)
+        else:
+            teacher_logits = None
+        return self._calculate_loss(
+            pr_logits, gt_labels, 'train_', teacher_logits,
+        )
 
     def validation_step(self, batch, batch_idx):
         """We count the loss and metrics for validation.
@@ -101,6 +259,7 @@ class PosterModule(pl.LightningModule):  # noqa: WPS214
         self._calculate_loss(pr_logits, gt_labels, 'val_')
         pr_labels = torch.sigmoid(pr_logits)
         self._valid_metrics(pr_labels, gt_labels)
+        self._valid_curves.update(pr_labels, gt_labels)
 
     def test_step(self, batch, batch_idx):
         """We count the loss and metrics for test.
@@ -111,35 +270,183 @@ class PosterModule(pl.LightningModule):  # noqa: WPS214
         """
         images, gt_labels = batch
         pr_logits = self(images)
-        pr_labels = torch.sigmoid(pr_logits)
-        self._test_metrics(pr_labels, gt_labels)
+        pr_probs = torch.sigmoid(pr_logits)
+        self._test_metrics((pr_probs >= self.thresholds).float(), gt_labels)
+        self._test_curves.update(pr_probs, gt_labels, self.thresholds)
+
+    def predict_step(self, batch, batch_idx, dataloader_idx=0):
+        """Predict probabilities, used to collect validation outputs.
+
+        Args:
+            batch (_type_): size batch
+            batch_idx (_type_): idx batch
+            dataloader_idx (_type_): idx dataloader
+
+        Returns:
+            _type_: probabilities and labels
+        """
+        images, gt_labels = batch
+        return {'probs': torch.sigmoid(self(images)), 'labels': gt_labels}
 
     def on_validation_epoch_start(self) -> None:
         """On validation epoch start."""
         self._valid_metrics.reset()
+        self._valid_curves.reset()
 
     def on_validation_epoch_end(self) -> None:
         """On validation epoch end."""
+        # compute() gathers the states of all processes, no sync_dist needed.
         self.log_dict(self._valid_metrics.compute(), on_epoch=True)
+        self._log_curves('val', self._valid_curves)
+
+    def on_test_epoch_start(self) -> None:
+        """On test epoch start."""
+        self._test_metrics.reset()
+        self._test_curves.reset()
 
     def on_test_epoch_end(self) -> None:
         """On test epoch end."""
         self.log_dict(self._test_metrics.compute(), on_epoch=True)
+        self._log_curves('test', self._test_curves)
+
+    def _log_curves(self, stage: str, curves: HistogramCurves) -> None:
+        values = {
+            key: curve_value.cpu().numpy()
+            for key, curve_value in curves.compute().items()
+        }
+        self.log('{stage}_map'.format(stage=stage), float(values['map']))
+        self.log('{stage}_f2'.format(stage=stage), float(values['fbeta']))
+        for class_idx, ap in enumerate(values['ap']):
+            if not np.isnan(ap):
+                self.log(
+                    '{stage}_ap_{idx:02d}'.format(stage=stage, idx=class_idx),
+                    float(ap),
+                )
+        self.pr_curves[stage] = {
+            key: values[key]
+            for key in ('ap', 'precision', 'recall', 'thresholds')
+        }
+
+    def _setup_teacher(self) -> None:
+        distillation = self._config.distillation
+        needs_teacher = (
+            distillation is not None and distillation.logits_path is None
+        )
+        if not needs_teacher or self._teacher is not None:
+            return
+        # distillation is imported here: it loads the teacher with src.predict.
+        from src.distillation import load_teacher  # noqa: WPS433
+
+        self._teacher = load_teacher(
+            distillation.teacher_checkpoint, self._config.num_classes,
+        )
+        if self._config.channels_last:
+            self._teacher = self._teacher.to(memory_format=torch.channels_last)
 
     def _calculate_loss(
         self,
         pr_logits: torch.Tensor,
         gt_labels: torch.Tensor,
         prefix: str,
+        teacher_logits: Optional[torch.Tensor] = None,
     ) -> torch.Tensor:
-        total_loss = 0
-        for cur_loss in self._losses:
-            loss = cur_loss.loss(pr_logits, gt_labels)
-            total_loss += cur_loss.weight * loss
-            pref_cur_loss = '{prefix}{cur_loss}_loss'.format(
-                prefix=prefix,
-                cur_loss=cur_loss.name,
+        losses, total_loss = self._losses(pr_logits, gt_labels, teacher_logits)
+        # values are logged as detached tensors: no device sync per step.
+        values = torch.cat([losses, total_loss.unsqueeze(0)]).detach()
+        if prefix != 'train_':
+            # Lightning averages them on the device over the epoch and
+            # across processes at its end.
+            self._log_losses(
+                prefix, values, sync_dist=True, with_distillation=False,
+            )
+            return total_loss
+
+        self._train_loss_sums += values
+        self._n_train_losses += 1
+        if (self.global_step + 1) % self.trainer.log_every_n_steps == 0:
+            self._log_losses(
+                prefix, self._train_loss_sums / self._n_train_losses,
             )
-            self.log(pref_cur_loss, loss.item())
-        self.log('{prefix}total_loss'.format(prefix=prefix), total_loss.item())
+            self._train_loss_sums.zero_()
+            self._n_train_losses = 0
         return total_loss
+
+    def _log_losses(
+        self,
+        prefix: str,
+        values: torch.Tensor,
+        sync_dist: bool = False,
+        with_distillation: bool = True,
+    ):
+        for name, value, is_distillation in zip(
+            self._losses.names + ['total'],
+            values,
+            self._losses.is_distillation + [False],
+        ):
+            # without teacher logits the distillation losses are 0.
+            if is_distillation and not with_distillation:
+                continue
+            self.log(
+                '{prefix}{name}_loss'.format(prefix=prefix, name=name),
+                value,
+                sync_dist=sync_dist,
+            )
+
+
+class HeadModule(PosterModule):
+    """PosterModule that trains only the classifier on stored features.
+
+    The batches are pooled backbone features from FeatureDM. The whole
+    network stays in the module with a frozen backbone, so the checkpoint
+    is a usual PosterModule checkpoint with the trained classifier.
+    """
+
+    def __init__(self, config: Config):
+        """Initialize an instance of the class.
+
+        Args:
+            config (Config): config with head_only
+        """
+        backbone_checkpoint = config.head_only.backbone_checkpoint
+        if backbone_checkpoint is not None:
+            # the weights come from the checkpoint, pretrained ones are not
+            # needed.
+            config = config.copy(deep=True)
+            config.model_kwargs['pretrained'] = False
+        super().__init__(config)
+        if backbone_checkpoint is not None:
+            self._model.load_state_dict(
+                read_model_weights(backbone_checkpoint),
+            )
+        self._model.requires_grad_(False)
+        self._model.get_classifier().requires_grad_(True)
+
+    def forward(self, features: torch.Tensor) -> torch.Tensor:
+        """Apply the classifier.
+
+        Args:
+            features (torch.Tensor): pooled features
+
+        Returns:
+            torch.Tensor: pred
+        """
+        return self._model.get_classifier()(features)
+
+    def setup(self, stage: str) -> None:
+        """Nothing to compile or distill for the classifier.
+
+        Args:
+            stage (str): fit, validate, test or predict
+        """
+
+    def on_after_batch_transfer(self, batch, dataloader_idx: int):
+        """Features are used as is.
+
+        Args:
+            batch (_type_): features and labels
+            dataloader_idx (int): idx dataloader
+
+        Returns:
+            _type_: features and labels
+        """
+        return batch
@@ -0,0 +1,127 @@
+"""Probing of the DataLoader settings for the host."""
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+from torch.utils.data import DataLoader, Dataset, Subset
+
+AUTO = 'auto'
+PREFETCH_FACTORS = (2, 4, 8)
+MIN_GAIN = 1.1
+
+
+def get_n_cpus() -> int:
+    """Number of CPUs available to the process.
+
+    Returns:
+        int: number of CPUs
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_worker_candidates(n_cpus: int) -> List[int]:
+    """Worker counts to probe: 0 and powers of two up to n_cpus.
+
+    Args:
+        n_cpus (int): number of CPUs
+
+    Returns:
+        List[int]: worker counts
+    """
+    candidates = [0]
+    n_workers = 1
+    while n_workers < n_cpus:
+        candidates.append(n_workers)
+        n_workers *= 2
+    candidates.append(n_cpus)
+    return candidates
+
+
+def measure_throughput(
+    dataset: Dataset,
+    batch_size: int,
+    n_workers: int,
+    prefetch_factor: Optional[int] = None,
+    n_batches: int = 8,
+) -> float:
+    """Samples/sec of the DataLoader after its first batch.
+
+    Args:
+        dataset (Dataset): dataset
+        batch_size (int): batch size
+        n_workers (int): number of workers
+        prefetch_factor (Optional[int]): batches prefetched by every worker
+        n_batches (int): measured batches. Defaults to 8.
+
+    Returns:
+        float: samples/sec
+    """
+    # one batch per worker more, so that their start is not measured.
+    n_images = min(len(dataset), batch_size * (n_batches + max(n_workers, 1)))
+    dataloader = DataLoader(
+        Subset(dataset, range(n_images)),
+        batch_size=batch_size,
+        num_workers=n_workers,
+        prefetch_factor=prefetch_factor if n_workers > 0 else None,
+    )
+    batches = iter(dataloader)
+    for _ in range(max(n_workers, 1)):
+        next(batches, None)
+    n_samples = 0
+    start_time = time.perf_counter()
+    for batch in batches:
+        n_samples += len(batch[0])
+    elapsed_time = time.perf_counter() - start_time
+    return n_samples / elapsed_time if n_samples else 0
+
+
+def tune_dataloader(
+    dataset: Dataset,
+    batch_size: int,
+    n_batches: int = 8,
+    n_cpus: Optional[int] = None,
+) -> Tuple[int, Optional[int]]:
+    """Pick the number of workers and the prefetch factor.
+
+    Worker counts are probed in increasing order until adding workers
+    speeds up loading by less than MIN_GAIN, then the prefetch factors
+    are probed for the chosen count.
+
+    Args:
+        dataset (Dataset): train dataset
+        batch_size (int): batch size
+        n_batches (int): measured batches per probe. Defaults to 8.
+        n_cpus (Optional[int]): CPUs for the workers. Defaults to all.
+
+    Returns:
+        Tuple[int, Optional[int]]: number of workers and prefetch factor
+    """
+    if n_cpus is None:
+        n_cpus = get_n_cpus()
+    best_workers, best_throughput = 0, 0
+    for n_workers in get_worker_candidates(n_cpus):
+        throughput = measure_throughput(
+            dataset, batch_size, n_workers, n_batches=n_batches,
+        )
+        logging.info(
+            'DataLoader probe: {n} workers, {value:.1f} samples/sec'.format(
+                n=n_workers, value=throughput,
+            ),
+        )
+        if throughput < best_throughput * MIN_GAIN:
+            break
+        best_workers, best_throughput = n_workers, throughput
+    if best_workers == 0:
+        return best_workers, None
+
+    best_prefetch, best_throughput = PREFETCH_FACTORS[0], 0
+    for prefetch_factor in PREFETCH_FACTORS:
+        throughput = measure_throughput(
+            dataset, batch_size, best_workers, prefetch_factor, n_batches,
+        )
+        if throughput > best_throughput:
+            best_prefetch, best_throughput = prefetch_factor, throughput
+    return best_workers, best_prefetch
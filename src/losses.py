@@ -1,7 +1,9 @@
 """losses."""
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional, Tuple
 
+import torch
+import torch.nn.functional as func
 from torch import nn
 
 from src.config import LossConfig
@@ -16,6 +18,182 @@ class Loss:  # noqa: WPS306
     loss: nn.Module
 
 
+class FocalLoss(nn.Module):
+    """Sigmoid focal loss for multilabel classification."""
+
+    def __init__(self, gamma: float = 2.0, alpha: Optional[float] = 0.25):
+        """Initialize an instance of the class.
+
+        Args:
+            gamma (float): focusing parameter. Defaults to 2.0.
+            alpha (Optional[float]): weight of the positives, None to disable.
+            Defaults to 0.25.
+        """
+        super().__init__()
+        self.gamma = gamma
+        self.alpha = alpha
+
+    def forward(
+        self,
+        logits: torch.Tensor,
+        targets: torch.Tensor,
+    ) -> torch.Tensor:
+        """Compute the loss.
+
+        Args:
+            logits (torch.Tensor): logits
+            targets (torch.Tensor): one-hot labels
+
+        Returns:
+            torch.Tensor: mean loss
+        """
+        log_probs = func.logsigmoid(logits)
+        return self.from_log_probs(log_probs, log_probs - logits, targets)
+
+    def from_log_probs(
+        self,
+        log_probs: torch.Tensor,
+        log_not_probs: torch.Tensor,
+        targets: torch.Tensor,
+        cross_entropy: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Compute the loss from log-sigmoids shared with other losses.
+
+        Args:
+            log_probs (torch.Tensor): logsigmoid(logits)
+            log_not_probs (torch.Tensor): logsigmoid(-logits)
+            targets (torch.Tensor): one-hot labels
+            cross_entropy (Optional[torch.Tensor]): elementwise BCE if it is
+            already computed
+
+        Returns:
+            torch.Tensor: mean loss
+        """
+        if cross_entropy is None:
+            cross_entropy = _cross_entropy(log_probs, log_not_probs, targets)
+        # for binary targets exp(-BCE) is the probability of the true class.
+        loss = cross_entropy * (1 - torch.exp(-cross_entropy)) ** self.gamma
+        if self.alpha is not None:
+            alpha = self.alpha * targets + (1 - self.alpha) * (1 - targets)
+            loss = loss * alpha
+        return loss.mean()
+
+
+class DistillationLoss(nn.Module):
+    """BCE between the student and the soft multilabel targets of a teacher.
+
+    Both logits are divided by the temperature; the loss is scaled by its
+    square so that its gradients keep the scale of the hard-label loss.
+    """
+
+    def __init__(self, temperature: float = 1.0):
+        """Initialize an instance of the class.
+
+        Args:
+            temperature (float): softening of the probabilities. Defaults to 1.
+        """
+        super().__init__()
+        self.temperature = temperature
+
+    def forward(
+        self,
+        logits: torch.Tensor,
+        teacher_logits: torch.Tensor,
+    ) -> torch.Tensor:
+        """Compute the loss.
+
+        Args:
+            logits (torch.Tensor): student logits
+            teacher_logits (torch.Tensor): teacher logits
+
+        Returns:
+            torch.Tensor: mean loss
+        """
+        soft_targets = torch.sigmoid(teacher_logits / self.temperature)
+        loss = func.binary_cross_entropy_with_logits(
+            logits / self.temperature, soft_targets,
+        )
+        return loss * self.temperature ** 2
+
+
+class FusedLosses(nn.Module):
+    """All configured losses in one pass.
+
+    BCEWithLogitsLoss and FocalLoss with mean reduction share one
+    logsigmoid and one elementwise BCE, other losses are called as is.
+    DistillationLoss gets the teacher logits instead of the labels.
+    """
+
+    def __init__(self, losses: List[Loss]):
+        """Initialize an instance of the class.
+
+        Args:
+            losses (List[Loss]): configured losses
+        """
+        super().__init__()
+        self.names = [cur_loss.name for cur_loss in losses]
+        self.losses = nn.ModuleList([cur_loss.loss for cur_loss in losses])
+        self.register_buffer(
+            'weights',
+            torch.tensor([cur_loss.weight for cur_loss in losses]),
+            persistent=False,
+        )
+        self._is_fused = [_is_fusable(cur_loss.loss) for cur_loss in losses]
+        self.is_distillation = [
+            isinstance(cur_loss.loss, DistillationLoss) for cur_loss in losses
+        ]
+
+    def forward(
+        self,
+        logits: torch.Tensor,
+        targets: torch.Tensor,
+        teacher_logits: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute all losses.
+
+        Args:
+            logits (torch.Tensor): logits
+            targets (torch.Tensor): one-hot labels
+            teacher_logits (Optional[torch.Tensor]): logits of the teacher,
+                distillation losses are 0 without them.
+
+        Returns:
+            Tuple[torch.Tensor, torch.Tensor]: value of every loss and the
+            weighted total
+        """
+        # with mixed precision the losses are still computed in float32.
+        logits = logits.float()
+        targets = targets.float()
+        cross_entropy = None
+        if any(self._is_fused):
+            log_probs = func.logsigmoid(logits)
+            log_not_probs = log_probs - logits
+            cross_entropy = _cross_entropy(log_probs, log_not_probs, targets)
+        values = []
+        for cur_loss, is_fused, is_distillation in zip(
+            self.losses, self._is_fused, self.is_distillation,
+        ):
+            if is_distillation:
+                values.append(
+                    logits.new_zeros(()) if teacher_logits is None
+                    else cur_loss(logits, teacher_logits.float()),
+                )
+            elif not is_fused:
+                values.append(cur_loss(logits, targets))
+            elif isinstance(cur_loss, FocalLoss):
+                values.append(cur_loss.from_log_probs(
+                    log_probs, log_not_probs, targets, cross_entropy,
+                ))
+            elif cur_loss.pos_weight is None:
+                values.append(cross_entropy.mean())
+            else:
+                values.append(_cross_entropy(
+                    log_probs, log_not_probs, targets, cur_loss.pos_weight,
+                ).mean())
+        values = torch.stack(values)
+        return values, (values * self.weights.to(values.dtype)).sum()
+
+
 def get_losses(losses_cfg: List[LossConfig]) -> List[Loss]:
     """For get losses.
 
@@ -33,3 +211,25 @@ def get_losses(losses_cfg: List[LossConfig]) -> List[Loss]:
         )
         for loss_cfg in losses_cfg
     ]
+
+
+def _is_fusable(loss: nn.Module) -> bool:
+    if isinstance(loss, FocalLoss):
+        return True
+    return (
+        isinstance(loss, nn.BCEWithLogitsLoss)
+        and loss.weight is None
+        and loss.reduction == 'mean'
+    )
+
+
+def _cross_entropy(
+    log_probs: torch.Tensor,
+    log_not_probs: torch.Tensor,
+    targets: torch.Tensor,
+    pos_weight: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    positives = targets * log_probs
+    if pos_weight is not None:
+        positives = positives * pos_weight
+    return -(positives + (1 - targets) * log_not_probs)
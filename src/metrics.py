@@ -1,5 +1,10 @@
 """a script for calculating metrics."""
-from torchmetrics import F1Score, MetricCollection, Precision, Recall
+from typing import Dict, Optional
+
+import torch
+from torchmetrics import F1Score, Metric, MetricCollection, Precision, Recall
+
+N_BINS = 1000
 
 
 def get_metrics(**kwargs) -> MetricCollection:
@@ -20,3 +25,140 @@ def get_metrics(**kwargs) -> MetricCollection:
             'recall': Recall(**kwargs),
         },
     )
+
+
+def get_multilabel_metrics(
+    num_classes: int,
+    threshold: float = 0.5,
+) -> MetricCollection:
+    """Get macro multilabel metrics of the pipeline.
+
+    Args:
+        num_classes (int): number of classes
+        threshold (float): threshold of the probabilities. Defaults to 0.5.
+
+    Returns:
+        MetricCollection: get f1 score, precision and recall
+    """
+    return get_metrics(
+        num_classes=num_classes,
+        num_labels=num_classes,
+        task='multilabel',
+        average='macro',
+        threshold=threshold,
+    )
+
+
+class HistogramCurves(Metric):
+    """Per-class PR curves, average precision and sample F-beta.
+
+    Probabilities are counted in n_bins equal bins per class separately
+    for positive and negative labels, so the state has a constant size
+    and is summed over the processes. The curves are evaluated at the
+    lower edges of the bins, AP is the step integral of the curve.
+    The sample-averaged F-beta (the Kaggle metric with beta 2) is exact:
+    it is accumulated from the thresholded predictions of every batch.
+    """
+
+    full_state_update = False
+
+    def __init__(
+        self,
+        num_classes: int,
+        n_bins: int = N_BINS,
+        beta: float = 2.0,
+        threshold: float = 0.5,
+        **kwargs,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            num_classes (int): number of classes
+            n_bins (int): bins of the probabilities. Defaults to 1000.
+            beta (float): weight of recall of F-beta. Defaults to 2.
+            threshold (float): default threshold of F-beta. Defaults to 0.5.
+            **kwargs: arguments of Metric.  # noqa:RST210
+        """
+        super().__init__(**kwargs)
+        self.num_classes = num_classes
+        self.n_bins = n_bins
+        self.beta = beta
+        self.threshold = threshold
+        hist = torch.zeros(num_classes, n_bins, dtype=torch.long)
+        self.add_state('positives', default=hist, dist_reduce_fx='sum')
+        self.add_state('negatives', default=hist.clone(), dist_reduce_fx='sum')
+        self.add_state(
+            'fbeta_sum',
+            default=torch.tensor(0, dtype=torch.float64),
+            dist_reduce_fx='sum',
+        )
+        self.add_state(
+            'n_samples', default=torch.tensor(0), dist_reduce_fx='sum',
+        )
+
+    def update(
+        self,
+        probs: torch.Tensor,
+        labels: torch.Tensor,
+        thresholds: Optional[torch.Tensor] = None,
+    ):
+        """Count the probabilities of the batch.
+
+        Args:
+            probs (torch.Tensor): probabilities [batch_size, n_classes]
+            labels (torch.Tensor): one-hot labels [batch_size, n_classes]
+            thresholds (Optional[torch.Tensor]): per-class thresholds of
+                F-beta. Defaults to threshold.
+        """
+        positive = labels > 0
+        bins = (probs.detach() * self.n_bins).long().clamp_(0, self.n_bins - 1)
+        class_idx = torch.arange(self.num_classes, device=bins.device)
+        bins += class_idx * self.n_bins
+        n_hist = self.num_classes * self.n_bins
+        self.positives += torch.bincount(
+            bins[positive], minlength=n_hist,
+        ).view_as(self.positives)
+        self.negatives += torch.bincount(
+            bins[~positive], minlength=n_hist,
+        ).view_as(self.negatives)
+
+        if thresholds is None:
+            thresholds = self.threshold
+        predicted = probs >= thresholds
+        tp = (predicted & positive).sum(dim=1)
+        beta2 = self.beta ** 2
+        denominator = beta2 * positive.sum(dim=1) + predicted.sum(dim=1)
+        fbeta = (1 + beta2) * tp / denominator.clamp(min=1)
+        self.fbeta_sum += fbeta.sum()
+        self.n_samples += len(probs)
+
+    def compute(self) -> Dict[str, torch.Tensor]:
+        """Compute the metrics and the curves.
+
+        Returns:
+            Dict[str, torch.Tensor]: mean AP 'map', per-class 'ap' (nan for
+            classes without positives), 'fbeta', and the curves 'precision',
+            'recall' [n_classes, n_bins] at 'thresholds' [n_bins]
+        """
+        # thresholds go down from the last bin, so the counts are cumulative.
+        tp = self.positives.flip(1).cumsum(1).double()
+        n_pred = tp + self.negatives.flip(1).cumsum(1)
+        n_true = tp[:, -1:]
+        precision = torch.where(n_pred > 0, tp / n_pred.clamp(min=1), 1)
+        recall = tp / n_true.clamp(min=1)
+        recall_steps = torch.diff(
+            recall, dim=1, prepend=torch.zeros_like(recall[:, :1]),
+        )
+        ap = (recall_steps * precision).sum(dim=1)
+        ap[n_true[:, 0] == 0] = float('nan')
+        thresholds = torch.arange(
+            self.n_bins - 1, -1, -1, device=tp.device, dtype=torch.float64,
+        ) / self.n_bins
+        return {
+            'map': ap.nanmean(),
+            'ap': ap,
+            'fbeta': self.fbeta_sum / self.n_samples.clamp(min=1),
+            'precision': precision,
+            'recall': recall,
+            'thresholds': thresholds,
+        }
@@ -0,0 +1,159 @@
+"""Lightweight predictor running the exported model with ONNX Runtime.
+
+Only numpy, cv2 and onnxruntime are imported, so it starts without
+PyTorch, Lightning, timm or the training config.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+META_FILENAME = 'meta.json'
+# threshold of the exports without tuned thresholds, as in src.thresholds.
+DEFAULT_THRESHOLD = 0.5
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', type=str, help='exported model.onnx')
+    parser.add_argument('images', nargs='+', help='jpg images')
+    parser.add_argument('--intra_op_threads', type=int, default=None)
+    parser.add_argument('--batch_size', type=int, default=64)
+    return parser.parse_args()
+
+
+class OnnxPredictor:
+    """Predict probabilities of the classes with ONNX Runtime on CPU."""
+
+    def __init__(
+        self,
+        model_path: str,
+        intra_op_threads: Optional[int] = None,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            model_path (str): path to model.onnx, meta.json is read from
+                the same folder
+            intra_op_threads (Optional[int]): threads of one operator.
+                Defaults to the number of physical cores.
+        """
+        meta_path = os.path.join(os.path.dirname(model_path), META_FILENAME)
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        self.class_names: List[str] = meta['class_names']
+        self._width = meta['width']
+        self._height = meta['height']
+        default_thresholds = [DEFAULT_THRESHOLD] * len(self.class_names)
+        self.thresholds = np.array(
+            meta.get('thresholds', default_thresholds), dtype=np.float32,
+        )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = (
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if intra_op_threads is not None:
+            options.intra_op_num_threads = intra_op_threads
+        self._session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider'],
+        )
+
+    def preprocess(self, image: np.ndarray) -> np.ndarray:
+        """Resize an RGB image to the input size of the model.
+
+        Args:
+            image (np.ndarray): uint8 RGB image
+
+        Returns:
+            np.ndarray: resized image
+        """
+        return cv2.resize(
+            image, (self._width, self._height), interpolation=cv2.INTER_LINEAR,
+        )
+
+    def predict_batch(self, images: np.ndarray) -> np.ndarray:
+        """Predict probabilities for a resized batch.
+
+        Args:
+            images (np.ndarray): uint8 RGB batch [B, H, W, 3]
+
+        Returns:
+            np.ndarray: probabilities [B, n_classes]
+        """
+        return self._session.run(['probs'], {'images': images})[0]
+
+    def get_tags(self, probs: np.ndarray) -> List[str]:
+        """Classes above their thresholds.
+
+        Args:
+            probs (np.ndarray): probabilities of an image [n_classes]
+
+        Returns:
+            List[str]: tags
+        """
+        return [
+            name
+            for name, is_tag in zip(self.class_names, probs >= self.thresholds)
+            if is_tag
+        ]
+
+    def predict_files(
+        self,
+        paths: List[str],
+        batch_size: int = 64,
+    ) -> List[Dict[str, Any]]:
+        """Predict probabilities and tags for image files.
+
+        Args:
+            paths (List[str]): paths to jpg images
+            batch_size (int): batch size. Defaults to 64.
+
+        Returns:
+            List[Dict[str, Any]]: probabilities by class name and tags, like
+            the response of the server
+        """
+        predictions = []
+        for start in range(0, len(paths), batch_size):
+            images = np.stack([
+                self.preprocess(
+                    cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB),
+                )
+                for path in paths[start:start + batch_size]
+            ])
+            predictions.extend(
+                {
+                    'probabilities': dict(
+                        zip(self.class_names, probs.tolist()),
+                    ),
+                    'tags': self.get_tags(probs),
+                }
+                for probs in self.predict_batch(images)
+            )
+        return predictions
+
+
+if __name__ == '__main__':
+    args = arg_parse()
+    logging.basicConfig(level=logging.INFO)
+    start_time = time.perf_counter()
+    predictor = OnnxPredictor(
+        args.model, intra_op_threads=args.intra_op_threads,
+    )
+    logging.info('Predictor is loaded in {sec:.2f} sec'.format(
+        sec=time.perf_counter() - start_time,
+    ))
+    predictions = predictor.predict_files(args.images, args.batch_size)
+    for path, prediction in zip(args.images, predictions):
+        print(json.dumps({'image': path, **prediction}))  # noqa: WPS421
@@ -0,0 +1,334 @@
+"""The scripts in this file are needed to run inference of the model."""
+import argparse
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from src.annotations import load_split
+from src.augmentations import get_transforms
+from src.checkpointing import SAFETENSORS_SUFFIX, create_model_from_safetensors
+from src.datamodule import get_split_path, read_class_names
+from src.dataset import PosterDataset
+from src.lightning_module import PosterModule
+from src.thresholds import load_thresholds
+
+IMAGE_EXTENSION = '.jpg'
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='model checkpoint')
+    parser.add_argument(
+        'input',
+        type=str,
+        help='folder with images, csv with image_name or df_*.npz',
+    )
+    parser.add_argument('output', type=str, help='.csv or .parquet file')
+    parser.add_argument(
+        '--image_folder',
+        type=str,
+        default=None,
+        help='folder with images for csv input',
+    )
+    parser.add_argument(
+        '--classes',
+        type=str,
+        default=None,
+        help='df_*.npz or df_*.csv to read class names from',
+    )
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--n_workers', type=int, default=4)
+    parser.add_argument('--chunk_size', type=int, default=8192)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--bf16', action='store_true')
+    parser.add_argument('--channels_last', action='store_true')
+    return parser.parse_args()
+
+
+def load_module(
+    checkpoint_path: str,
+    map_location: str = 'cpu',
+) -> PosterModule:
+    """Load the module from a checkpoint without downloading weights.
+
+    A .safetensors file is memory-mapped and the network is created
+    without initializing its weights.
+
+    Args:
+        checkpoint_path (str): path to checkpoint or .safetensors file
+        map_location (str): device to load the weights. Defaults to 'cpu'.
+
+    Returns:
+        PosterModule: module in eval mode
+    """
+    start_time = time.perf_counter()
+    if checkpoint_path.endswith(SAFETENSORS_SUFFIX):
+        model, config = create_model_from_safetensors(checkpoint_path)
+        module = PosterModule(config, model=model).to(map_location)
+    else:
+        checkpoint = torch.load(checkpoint_path, map_location=map_location)
+        config = checkpoint['hyper_parameters']['config']
+        # the weights come from the checkpoint, pretrained ones are not needed.
+        config.model_kwargs['pretrained'] = False
+        module = PosterModule(config)
+        module.load_state_dict(checkpoint['state_dict'])
+    logging.info('Model {path} loaded in {ms:.0f} ms'.format(
+        path=checkpoint_path, ms=(time.perf_counter() - start_time) * 1000,
+    ))
+    return module.eval()
+
+
+def get_class_names(
+    module: PosterModule,
+    path_to_df: Optional[str] = None,
+) -> List[str]:
+    """Get class names of the model outputs.
+
+    Args:
+        module (PosterModule): module
+        path_to_df (Optional[str]): df_*.npz or df_*.csv with class names.
+            Defaults to the train split in the data_path of the module config.
+
+    Returns:
+        List[str]: class names
+    """
+    config = module.hparams.config
+    if path_to_df is None:
+        path_to_df = get_split_path(config.data_config.data_path, 'train')
+    if os.path.exists(path_to_df):
+        return read_class_names(path_to_df)
+    logging.warning('{path} is not found, classes are numbered.'.format(
+        path=path_to_df,
+    ))
+    return [
+        'class_{idx}'.format(idx=idx) for idx in range(config.num_classes)
+    ]
+
+
+def get_tags(
+    probs: np.ndarray,
+    thresholds: np.ndarray,
+    class_names: List[str],
+) -> List[str]:
+    """Convert probabilities into space-separated tags.
+
+    Args:
+        probs (np.ndarray): probabilities [n_images, n_classes]
+        thresholds (np.ndarray): threshold of every class
+        class_names (List[str]): class names
+
+    Returns:
+        List[str]: tags of every image
+    """
+    names = np.array(class_names)
+    return [' '.join(names[mask]) for mask in probs >= thresholds]
+
+
+def read_inputs(
+    input_path: str,
+    image_folder: Optional[str] = None,
+) -> Tuple[pd.DataFrame, str]:
+    """Read image names from a folder or a csv.
+
+    Args:
+        input_path (str): folder with images or csv with image_name column
+        image_folder (Optional[str]): folder with images for csv input
+
+    Returns:
+        Tuple[pd.DataFrame, str]: dataframe with image_name and image folder
+    """
+    if os.path.isdir(input_path):
+        image_names = sorted(
+            name[:-len(IMAGE_EXTENSION)]
+            for name in os.listdir(input_path)
+            if name.endswith(IMAGE_EXTENSION)
+        )
+        return pd.DataFrame({'image_name': image_names}), input_path
+
+    if input_path.endswith('.npz'):
+        df = pd.DataFrame({'image_name': load_split(input_path)[0]})
+    else:
+        df = pd.read_csv(input_path, usecols=['image_name'])
+    if image_folder is None:
+        image_folder = os.path.join(os.path.dirname(input_path), 'train-jpg')
+    return df, image_folder
+
+
+class PredictionWriter:
+    """Write predictions to csv or parquet in chunks."""
+
+    def __init__(self, path: str):
+        """Initialize an instance of the class.
+
+        Args:
+            path (str): .csv or .parquet file
+        """
+        self._path = path
+        self._is_parquet = path.endswith('.parquet')
+        self._parquet_writer = None
+        self._n_chunks = 0
+
+    def write(self, chunk: pd.DataFrame):
+        """Append a chunk of predictions.
+
+        Args:
+            chunk (pd.DataFrame): predictions
+        """
+        if self._is_parquet:
+            self._write_parquet(chunk)
+        else:
+            chunk.to_csv(
+                self._path,
+                mode='w' if self._n_chunks == 0 else 'a',
+                header=self._n_chunks == 0,
+                index=False,
+            )
+        self._n_chunks += 1
+
+    def close(self):
+        """Close the file."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+    def _write_parquet(self, chunk: pd.DataFrame):
+        import pyarrow as pa  # noqa: WPS433
+        import pyarrow.parquet as pq  # noqa: WPS433, WPS301
+
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self._path, table.schema)
+        self._parquet_writer.write_table(table)
+
+
+def predict(  # noqa: WPS210, WPS211
+    module: PosterModule,
+    df: pd.DataFrame,
+    image_folder: str,
+    writer: PredictionWriter,
+    class_names: List[str],
+    batch_size: int = 256,
+    n_workers: int = 4,
+    chunk_size: int = 8192,
+    device: str = 'cpu',
+    bf16: bool = False,
+    channels_last: bool = False,
+    thresholds: Optional[np.ndarray] = None,
+) -> float:
+    """Predict probabilities of the classes for all images.
+
+    Args:
+        module (PosterModule): module
+        df (pd.DataFrame): dataframe with image_name column
+        image_folder (str): path to image folder
+        writer (PredictionWriter): writer of the predictions
+        class_names (List[str]): class names
+        batch_size (int): batch size. Defaults to 256.
+        n_workers (int): number of decoding workers. Defaults to 4.
+        chunk_size (int): rows written at once. Defaults to 8192.
+        device (str): device. Defaults to 'cpu'.
+        bf16 (bool): run in bfloat16 autocast. Defaults to False.
+        channels_last (bool): use channels_last format. Defaults to False.
+        thresholds (Optional[np.ndarray]): per-class thresholds, if set the
+            predicted tags are written too. Defaults to None.
+
+    Returns:
+        float: images per second
+    """
+    data_config = module.hparams.config.data_config
+    dataset = PosterDataset(
+        df[['image_name']],
+        image_folder=image_folder,
+        transforms=get_transforms(
+            width=data_config.width,
+            height=data_config.height,
+            augmentations=False,
+        ),
+    )
+    dataloader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        num_workers=n_workers,
+        shuffle=False,
+        pin_memory=device.startswith('cuda'),
+    )
+    memory_format = torch.contiguous_format
+    if channels_last:
+        memory_format = torch.channels_last
+    module = module.to(device, memory_format=memory_format)
+    device_type = torch.device(device).type
+
+    chunks: List[np.ndarray] = []
+    n_rows = 0
+    start_time = time.perf_counter()
+    with torch.inference_mode(), torch.autocast(
+        device_type=device_type, dtype=torch.bfloat16, enabled=bf16,
+    ):
+        for images, _ in dataloader:
+            images = images.to(device, memory_format=memory_format)
+            chunks.append(torch.sigmoid(module(images)).float().cpu().numpy())
+            n_rows += len(images)
+            if len(chunks) * batch_size >= chunk_size:
+                _write_chunk(
+                    writer, df, chunks, class_names, n_rows, thresholds,
+                )
+                chunks = []
+    if chunks:
+        _write_chunk(writer, df, chunks, class_names, n_rows, thresholds)
+    writer.close()
+
+    elapsed_time = time.perf_counter() - start_time
+    return n_rows / elapsed_time
+
+
+def _write_chunk(
+    writer: PredictionWriter,
+    df: pd.DataFrame,
+    chunks: List[np.ndarray],
+    class_names: List[str],
+    n_rows: int,
+    thresholds: Optional[np.ndarray] = None,
+):
+    chunk = np.concatenate(chunks)
+    probs = pd.DataFrame(chunk, columns=class_names)
+    image_names = df['image_name'].to_numpy()[n_rows - len(probs):n_rows]
+    probs.insert(0, 'image_name', image_names)
+    if thresholds is not None:
+        probs['tags'] = get_tags(chunk, thresholds, class_names)
+    writer.write(probs)
+
+
+if __name__ == '__main__':
+    args = arg_parse()
+    logging.basicConfig(level=logging.INFO)
+    module = load_module(args.checkpoint)
+    df, image_folder = read_inputs(args.input, args.image_folder)
+    images_per_sec = predict(
+        module,
+        df,
+        image_folder=image_folder,
+        writer=PredictionWriter(args.output),
+        class_names=get_class_names(module, args.classes),
+        batch_size=args.batch_size,
+        n_workers=args.n_workers,
+        chunk_size=args.chunk_size,
+        device=args.device,
+        bf16=args.bf16,
+        channels_last=args.channels_last,
+        thresholds=load_thresholds(
+            args.checkpoint, module.hparams.config.num_classes,
+        ),
+    )
+    logging.info('Predicted {n} images: {speed:.1f} images/sec'.format(
+        n=len(df), speed=images_per_sec,
+    ))
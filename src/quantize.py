@@ -0,0 +1,219 @@
+"""The scripts in this file are needed to quantize the model to int8."""
+import argparse
+import copy
+import io
+import json
+import logging
+import os
+import time
+from typing import Dict
+
+import numpy as np
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.utils.data import DataLoader
+
+from src.datamodule import get_split_dataloader
+from src.metrics import get_multilabel_metrics
+from src.predict import load_module
+from src.thresholds import load_thresholds
+
+STATIC_MODE = 'static'
+DYNAMIC_MODE = 'dynamic'
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='model checkpoint')
+    parser.add_argument('output', type=str, help='int8 TorchScript model')
+    parser.add_argument(
+        '--mode',
+        type=str,
+        default=STATIC_MODE,
+        choices=[STATIC_MODE, DYNAMIC_MODE],
+    )
+    parser.add_argument('--backend', type=str, default='x86')
+    parser.add_argument(
+        '--n_calibration', type=int, default=512, help='images from df_valid',
+    )
+    parser.add_argument('--eval_split', type=str, default='test')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--n_workers', type=int, default=4)
+    parser.add_argument('--data_path', type=str, default=None)
+    return parser.parse_args()
+
+
+def quantize_static(
+    model: nn.Module,
+    calibration_loader: DataLoader,
+    backend: str = 'x86',
+) -> nn.Module:
+    """Post-training static int8 quantization with FX graph mode.
+
+    Args:
+        model (nn.Module): fp32 model
+        calibration_loader (DataLoader): images to calibrate the observers
+        backend (str): quantized engine, x86, fbgemm or qnnpack.
+
+    Returns:
+        nn.Module: int8 model
+    """
+    torch.backends.quantized.engine = backend
+    example_inputs = (next(iter(calibration_loader))[0],)
+    prepared = prepare_fx(
+        copy.deepcopy(model).eval(),
+        get_default_qconfig_mapping(backend),
+        example_inputs,
+    )
+    with torch.inference_mode():
+        for images, _ in calibration_loader:
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def quantize_dynamic_linear(model: nn.Module) -> nn.Module:
+    """Post-training dynamic int8 quantization of the linear layers.
+
+    Args:
+        model (nn.Module): fp32 model
+
+    Returns:
+        nn.Module: model with int8 linear layers
+    """
+    return quantize_dynamic(
+        copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8,
+    )
+
+
+def get_model_size(model: nn.Module) -> float:
+    """Size of the serialized weights.
+
+    Args:
+        model (nn.Module): model
+
+    Returns:
+        float: size in MB
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 2 ** 20
+
+
+def evaluate(
+    model: nn.Module,
+    dataloader: DataLoader,
+    thresholds: np.ndarray,
+) -> Dict[str, float]:
+    """Compute the metrics of the pipeline and the latency.
+
+    Args:
+        model (nn.Module): model returning logits
+        dataloader (DataLoader): dataloader
+        thresholds (np.ndarray): per-class thresholds
+
+    Returns:
+        Dict[str, float]: f1, precision, recall, latency and size
+    """
+    metrics = get_multilabel_metrics(len(thresholds))
+    thresholds = torch.from_numpy(thresholds)
+    forward_time = 0
+    n_images = 0
+    with torch.inference_mode():
+        for images, gt_labels in dataloader:
+            start_time = time.perf_counter()
+            pr_logits = model(images)
+            forward_time += time.perf_counter() - start_time
+            n_images += len(images)
+            pr_labels = (torch.sigmoid(pr_logits) >= thresholds).float()
+            metrics.update(pr_labels, gt_labels.long())
+    report = {name: value.item() for name, value in metrics.compute().items()}
+    report['latency_ms'] = forward_time / n_images * 1000
+    report['size_mb'] = get_model_size(model)
+    return report
+
+
+def format_report(reports: Dict[str, Dict[str, float]]) -> str:
+    """Format the reports as a markdown table.
+
+    Args:
+        reports (Dict[str, Dict[str, float]]): report of every model
+
+    Returns:
+        str: markdown table
+    """
+    columns = ['f1', 'precision', 'recall', 'latency_ms', 'size_mb']
+    lines = [
+        '| model | {columns} |'.format(columns=' | '.join(columns)),
+        '| --- |{separators}'.format(separators=' --- |' * len(columns)),
+    ]
+    for name, report in reports.items():
+        lines.append('| {name} | {values} |'.format(
+            name=name,
+            values=' | '.join(
+                '{value:.3f}'.format(value=report[column])
+                for column in columns
+            ),
+        ))
+    return '\n'.join(lines)
+
+
+def quantize(args):  # noqa: WPS210
+    """Quantize the checkpoint and compare it with fp32.
+
+    Args:
+        args (_type_): parsed arguments
+    """
+    module = load_module(args.checkpoint)
+    config = module.hparams.config
+    data_config = config.data_config
+    if args.data_path is not None:
+        data_config = data_config.copy(update={'data_path': args.data_path})
+    model = module.model
+
+    if args.mode == STATIC_MODE:
+        calibration_loader = get_split_dataloader(
+            data_config,
+            'valid',
+            batch_size=args.batch_size,
+            n_workers=args.n_workers,
+            n_images=args.n_calibration,
+        )
+        quantized = quantize_static(model, calibration_loader, args.backend)
+    else:
+        quantized = quantize_dynamic_linear(model)
+
+    eval_loader = get_split_dataloader(
+        data_config,
+        args.eval_split,
+        batch_size=args.batch_size,
+        n_workers=args.n_workers,
+    )
+    thresholds = load_thresholds(args.checkpoint, config.num_classes)
+    reports = {
+        'fp32': evaluate(model, eval_loader, thresholds),
+        'int8': evaluate(quantized, eval_loader, thresholds),
+    }
+    table = format_report(reports)
+    logging.info('Quantization report on {split}:\n{table}'.format(
+        split=args.eval_split, table=table,
+    ))
+
+    example = next(iter(eval_loader))[0]
+    with torch.inference_mode():
+        traced = torch.jit.freeze(torch.jit.trace(quantized, example))
+    torch.jit.save(traced, args.output)
+    report_path = '{path}.json'.format(path=os.path.splitext(args.output)[0])
+    with open(report_path, 'w') as report_file:
+        json.dump(reports, report_file, indent=2)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    quantize(arg_parse())
@@ -0,0 +1,39 @@
+"""Samplers for distributed training."""
+from typing import Iterator
+
+from torch.utils.data import DistributedSampler
+
+
+class UnpaddedDistributedSampler(DistributedSampler):
+    """Distributed sampler for evaluation without repeated samples.
+
+    DistributedSampler pads the dataset so that all ranks get the same
+    number of samples, which counts some images twice in the metrics.
+    Here every image goes to exactly one rank, ranks may differ by one
+    sample.
+    """
+
+    def __init__(self, dataset, num_replicas: int = None, rank: int = None):
+        """Initialize an instance of the class.
+
+        Args:
+            dataset (_type_): dataset
+            num_replicas (int): number of processes. Defaults to the world
+                size.
+            rank (int): rank of the process. Defaults to the current rank.
+        """
+        super().__init__(
+            dataset, num_replicas=num_replicas, rank=rank, shuffle=False,
+        )
+        self.num_samples = len(
+            range(self.rank, len(self.dataset), self.num_replicas),
+        )
+        self.total_size = len(self.dataset)
+
+    def __iter__(self) -> Iterator[int]:
+        """Indexes of the rank.
+
+        Returns:
+            Iterator[int]: indexes
+        """
+        return iter(range(self.rank, len(self.dataset), self.num_replicas))
@@ -0,0 +1,305 @@
+"""HTTP inference server with dynamic micro-batching."""
+import argparse
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List
+
+import cv2
+import numpy as np
+import torch
+from aiohttp import web
+
+from src.augmentations import get_transforms
+from src.predict import get_class_names, load_module
+from src.thresholds import load_thresholds
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='model checkpoint')
+    parser.add_argument('--host', type=str, default='0.0.0.0')  # noqa: S104
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument(
+        '--classes',
+        type=str,
+        default=None,
+        help='df_*.npz or df_*.csv to read class names from',
+    )
+    parser.add_argument('--max_batch_size', type=int, default=32)
+    parser.add_argument('--max_wait_ms', type=float, default=10)
+    parser.add_argument('--n_threads', type=int, default=None)
+    return parser.parse_args()
+
+
+@dataclass
+class Request:  # noqa: WPS306
+    """Image waiting in the queue."""
+    image: torch.Tensor
+    future: asyncio.Future
+    enqueue_time: float
+
+
+@dataclass
+class Prediction:  # noqa: WPS306
+    """Probabilities of an image and its batching stats."""
+    probs: np.ndarray
+    queue_time: float
+    batch_size: int
+
+
+class MicroBatcher:
+    """Coalesce single requests into batches for the model.
+
+    A batch is sent to the model when it has max_batch_size images or when
+    the first image has waited max_wait_ms.
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            model (torch.nn.Module): model returning logits
+            max_batch_size (int): max images in a batch. Defaults to 32.
+            max_wait_ms (float): max wait of the first image. Defaults to 10.
+        """
+        self._model = model
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        # the model runs in its own thread so the event loop keeps
+        # accepting requests while a batch is computed.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+    def start(self):
+        """Start the batching loop."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop."""
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=True)
+
+    async def predict(self, image: torch.Tensor) -> Prediction:
+        """Put an image into the queue and wait for its probabilities.
+
+        Args:
+            image (torch.Tensor): preprocessed image [3, H, W]
+
+        Returns:
+            Prediction: probabilities and batching stats
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(Request(image, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:  # noqa: WPS457
+            requests = await self._collect_batch()
+            start_time = time.perf_counter()
+            try:
+                probs = await loop.run_in_executor(
+                    self._executor,
+                    self._forward,
+                    torch.stack([request.image for request in requests]),
+                )
+            except Exception as error:  # noqa: B902
+                for failed in requests:
+                    if not failed.future.done():
+                        failed.future.set_exception(error)
+                continue
+            for request, request_probs in zip(requests, probs):
+                if not request.future.done():
+                    request.future.set_result(Prediction(
+                        probs=request_probs,
+                        queue_time=start_time - request.enqueue_time,
+                        batch_size=len(requests),
+                    ))
+
+    async def _collect_batch(self) -> List[Request]:
+        requests = [await self._queue.get()]
+        deadline = requests[0].enqueue_time + self._max_wait
+        while len(requests) < self._max_batch_size:
+            # requests queued while the model was busy are taken at once,
+            # even if the first one has already waited past the deadline.
+            if not self._queue.empty():
+                requests.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                requests.append(
+                    await asyncio.wait_for(self._queue.get(), timeout),
+                )
+            except asyncio.TimeoutError:
+                break
+        return requests
+
+    def _forward(self, images: torch.Tensor) -> np.ndarray:
+        with torch.inference_mode():
+            return torch.sigmoid(self._model(images)).numpy()
+
+
+class InferenceServer:
+    """aiohttp application around PosterModule.forward."""
+
+    def __init__(
+        self,
+        checkpoint_path: str,
+        classes_path: str = None,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            checkpoint_path (str): model checkpoint
+            classes_path (str): df_*.npz or df_*.csv to read class names from
+            max_batch_size (int): max images in a batch. Defaults to 32.
+            max_wait_ms (float): max wait of the first image. Defaults to 10.
+        """
+        module = load_module(checkpoint_path)
+        data_config = module.hparams.config.data_config
+        self._class_names = get_class_names(module, classes_path)
+        self._thresholds = load_thresholds(
+            checkpoint_path, module.hparams.config.num_classes,
+        )
+        self._transforms = get_transforms(
+            width=data_config.width,
+            height=data_config.height,
+            augmentations=False,
+        )
+        self._batcher = MicroBatcher(
+            module,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
+
+    def create_app(self) -> web.Application:
+        """Create the application.
+
+        Returns:
+            web.Application: application with /predict and /health routes
+        """
+        app = web.Application(client_max_size=32 * 1024 ** 2)
+        app.add_routes([
+            web.post('/predict', self.predict),
+            web.get('/health', self.health),
+        ])
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def predict(self, request: web.Request) -> web.Response:
+        """Predict probabilities of the classes for an uploaded image.
+
+        The image is sent as the request body or as a multipart file.
+
+        Args:
+            request (web.Request): request
+
+        Returns:
+            web.Response: class probabilities, tags and latency headers
+        """
+        start_time = time.perf_counter()
+        image_bytes = await _read_image_bytes(request)
+        if not image_bytes:
+            raise web.HTTPBadRequest(reason='Image is empty.')
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(None, self._preprocess, image_bytes)
+        if image is None:
+            raise web.HTTPBadRequest(reason='Image cannot be decoded.')
+
+        prediction = await self._batcher.predict(image)
+        latency = time.perf_counter() - start_time
+        return web.json_response(
+            {
+                'probabilities': dict(
+                    zip(self._class_names, prediction.probs.tolist()),
+                ),
+                'tags': [
+                    name
+                    for name, is_tag in zip(
+                        self._class_names,
+                        prediction.probs >= self._thresholds,
+                    )
+                    if is_tag
+                ],
+            },
+            headers={
+                'X-Latency-Ms': '{value:.2f}'.format(value=latency * 1000),
+                'X-Queue-Ms': '{value:.2f}'.format(
+                    value=prediction.queue_time * 1000,
+                ),
+                'X-Batch-Size': str(prediction.batch_size),
+            },
+        )
+
+    async def health(self, request: web.Request) -> web.Response:
+        """Health check.
+
+        Args:
+            request (web.Request): request
+
+        Returns:
+            web.Response: ok
+        """
+        return web.json_response({'status': 'ok'})
+
+    def _preprocess(self, image_bytes: bytes):
+        try:
+            image = cv2.imdecode(
+                np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR,
+            )
+        except cv2.error:
+            return None
+        if image is None:
+            return None
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return self._transforms(image=image)['image']
+
+    async def _on_startup(self, app: web.Application):
+        self._batcher.start()
+
+    async def _on_cleanup(self, app: web.Application):
+        await self._batcher.stop()
+
+
+async def _read_image_bytes(request: web.Request) -> bytes:
+    if request.content_type.startswith('multipart/'):
+        reader = await request.multipart()
+        part = await reader.next()
+        if part is None:
+            raise web.HTTPBadRequest(reason='No file in the request.')
+        return await part.read()
+    return await request.read()
+
+
+if __name__ == '__main__':
+    args = arg_parse()
+    logging.basicConfig(level=logging.INFO)
+    if args.n_threads is not None:
+        torch.set_num_threads(args.n_threads)
+    server = InferenceServer(
+        args.checkpoint,
+        classes_path=args.classes,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    web.run_app(server.create_app(), host=args.host, port=args.port)
@@ -0,0 +1,150 @@
+"""Decoded-image cache in shared memory for the DataLoader workers."""
+import multiprocessing
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+HAND = 0
+HITS = 1
+MISSES = 2
+
+
+class SharedImageCache:
+    """Bounded cache of resized images shared by all workers.
+
+    The tensors are allocated in shared memory before the workers start,
+    so every worker sees the images decoded by the others. When the cache
+    is full a slot is freed with the clock algorithm (second chance LRU).
+    """
+
+    def __init__(self, n_images: int, n_slots: int, width: int, height: int):
+        """Initialize an instance of the class.
+
+        Args:
+            n_images (int): number of images in the dataset
+            n_slots (int): number of images in the cache
+            width (int): width image
+            height (int): height image
+        """
+        self.width = width
+        self.height = height
+        self._images = torch.zeros(
+            (n_slots, height, width, 3), dtype=torch.uint8,
+        ).share_memory_()
+        self._slots = torch.full(
+            (n_images,), -1, dtype=torch.int64,
+        ).share_memory_()
+        self._owners = torch.full(
+            (n_slots,), -1, dtype=torch.int64,
+        ).share_memory_()
+        self._referenced = torch.zeros(
+            n_slots, dtype=torch.bool,
+        ).share_memory_()
+        self._state = torch.zeros(3, dtype=torch.int64).share_memory_()
+        self._lock = multiprocessing.Lock()
+
+    def get(self, idx: int) -> Optional[np.ndarray]:
+        """Return a copy of the cached image.
+
+        Args:
+            idx (int): index of the image in the dataset
+
+        Returns:
+            Optional[np.ndarray]: RGB image or None if it is not cached
+        """
+        state = self._state.numpy()
+        with self._lock:
+            slot = self._slots.numpy()[idx]
+            if slot < 0:
+                state[MISSES] += 1
+                return None
+            state[HITS] += 1
+            self._referenced.numpy()[slot] = True
+            return self._images.numpy()[slot].copy()
+
+    def put(self, idx: int, image: np.ndarray):
+        """Store a resized image, evicting another one if needed.
+
+        Args:
+            idx (int): index of the image in the dataset
+            image (np.ndarray): RGB image [height, width, 3]
+        """
+        slots = self._slots.numpy()
+        with self._lock:
+            if slots[idx] >= 0:
+                return
+            slot = self._evict()
+            self._images.numpy()[slot] = image
+            slots[idx] = slot
+            self._owners.numpy()[slot] = idx
+            self._referenced.numpy()[slot] = True
+
+    def get_stats(self) -> Tuple[int, int]:
+        """Hits and misses since the last reset.
+
+        Returns:
+            Tuple[int, int]: hits and misses
+        """
+        with self._lock:
+            return int(self._state[HITS]), int(self._state[MISSES])
+
+    def hit_rate(self) -> float:
+        """Share of the reads served from the cache since the last reset.
+
+        Returns:
+            float: hit rate
+        """
+        hits, misses = self.get_stats()
+        return hits / max(hits + misses, 1)
+
+    def reset_stats(self):
+        """Reset hits and misses."""
+        with self._lock:
+            self._state[HITS:] = 0
+
+    def clear(self):
+        """Drop the cached images and reset hits and misses."""
+        with self._lock:
+            self._slots.fill_(-1)
+            self._owners.fill_(-1)
+            self._referenced.fill_(False)
+            self._state.zero_()
+
+    def _evict(self) -> int:
+        referenced = self._referenced.numpy()
+        state = self._state.numpy()
+        hand = state[HAND]
+        while referenced[hand]:
+            referenced[hand] = False
+            hand = (hand + 1) % len(referenced)
+        owner = self._owners.numpy()[hand]
+        if owner >= 0:
+            self._slots.numpy()[owner] = -1
+        state[HAND] = (hand + 1) % len(referenced)
+        return hand
+
+
+def create_shared_cache(
+    n_images: int,
+    size_mb: float,
+    width: int,
+    height: int,
+) -> Optional[SharedImageCache]:
+    """Create the cache that fits into size_mb.
+
+    Args:
+        n_images (int): number of images in the dataset
+        size_mb (float): size of the cache in MB
+        width (int): width image
+        height (int): height image
+
+    Returns:
+        Optional[SharedImageCache]: cache or None if size_mb is 0
+    """
+    if size_mb <= 0:
+        return None
+    # the dataset relies on the cache to resize, so it has at least a slot.
+    n_slots = min(n_images, int(size_mb * 2 ** 20) // (width * height * 3))
+    n_slots = max(n_slots, 1)
+    return SharedImageCache(n_images, n_slots, width=width, height=height)
@@ -0,0 +1,129 @@
+"""Content-addressed cache of the train/valid/test splits."""
+import hashlib
+import json
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+META_NAME = 'splits.json'
+HASH_BLOCK_SIZE = 2 ** 20
+
+
+def get_file_hash(path: str) -> str:
+    """Hash the content of a file.
+
+    Args:
+        path (str): path to file
+
+    Returns:
+        str: sha256 hex digest
+    """
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_split_key(
+    annotation_hash: str,
+    train_fraction: float,
+    seed: int,
+) -> str:
+    """Key of the splits made from the annotation with the parameters.
+
+    Args:
+        annotation_hash (str): hash of train_classes.csv
+        train_fraction (float): training dataset size
+        seed (int): seed of the split
+
+    Returns:
+        str: sha256 hex digest
+    """
+    params = json.dumps(
+        {
+            'annotation_hash': annotation_hash,
+            'train_fraction': train_fraction,
+            'seed': seed,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(params.encode()).hexdigest()
+
+
+def read_meta(data_path: str) -> Optional[dict]:
+    """Read the parameters of the saved splits.
+
+    Args:
+        data_path (str): path to data
+
+    Returns:
+        Optional[dict]: key, annotation hash, train fraction and seed or None
+    """
+    meta_path = os.path.join(data_path, META_NAME)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as meta_file:
+        return json.load(meta_file)
+
+
+def write_meta(
+    data_path: str,
+    annotation_hash: str,
+    train_fraction: float,
+    seed: int,
+):
+    """Write the parameters of the saved splits.
+
+    Args:
+        data_path (str): path to data
+        annotation_hash (str): hash of train_classes.csv
+        train_fraction (float): training dataset size
+        seed (int): seed of the split
+    """
+    meta = {
+        'key': get_split_key(annotation_hash, train_fraction, seed),
+        'annotation_hash': annotation_hash,
+        'train_fraction': train_fraction,
+        'seed': seed,
+    }
+    with open(os.path.join(data_path, META_NAME), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+
+def remove_meta(data_path: str):
+    """Mark the saved splits as incomplete before they are rewritten.
+
+    Args:
+        data_path (str): path to data
+    """
+    meta_path = os.path.join(data_path, META_NAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+
+def get_previous_folds(
+    image_names: np.ndarray,
+    previous_names: Iterable[np.ndarray],
+) -> np.ndarray:
+    """Find the split of every image in the previously saved splits.
+
+    Args:
+        image_names (np.ndarray): current image names
+        previous_names (Iterable[np.ndarray]): image names of every saved split
+
+    Returns:
+        np.ndarray: fold of every image, -1 for new images
+    """
+    previous_names = list(previous_names)
+    previous_folds = pd.Series(
+        np.repeat(
+            np.arange(len(previous_names)),
+            [len(names) for names in previous_names],
+        ),
+        index=np.concatenate(previous_names),
+    )
+    previous_folds = previous_folds[~previous_folds.index.duplicated()]
+    return previous_folds.reindex(image_names, fill_value=-1).to_numpy()
@@ -0,0 +1,466 @@
+"""Parallel hyperparameter sweep over the Config fields with trial pruning."""
+import argparse
+import copy
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+from omegaconf import OmegaConf
+
+from src.config import Config, ParamSpace, PruningConfig, SweepConfig
+from src.constants import EXPERIMENTS_PATH
+from src.sweep_store import (COMPLETE, FAILED, FINISHED, PRUNED, TrialRecord,
+                             create_store, get_trial_id)
+
+GRID = 'grid'
+RANDOM = 'random'
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+)
+# seed of every trial, like in train.py.
+TRIAL_SEED = 42
+# fields that change the splits or the teacher logits in the shared data
+# folder, the trials must not overwrite them for each other.
+SHARED_DATA_FIELDS = (
+    'data_config.data_path',
+    'data_config.train_size',
+    'data_config.split_seed',
+    'data_config.incremental_split',
+    'distillation',
+)
+# the teacher logits are computed at the config resolution.
+RESOLUTION_FIELDS = ('data_config.width', 'data_config.height')
+# fields of the data prepared before the trials.
+DATA_FIELDS = ('data_config', 'distillation', 'head_only', 'model_kwargs')
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', type=str, help='base config file')
+    parser.add_argument('sweep_file', type=str, help='sweep config file')
+    return parser.parse_args()
+
+
+def sample_value(space: ParamSpace, rand: random.Random) -> Any:
+    """Sample a value of a parameter.
+
+    Args:
+        space (ParamSpace): values of the parameter
+        rand (random.Random): random generator
+
+    Returns:
+        Any: value
+    """
+    if space.values is not None:
+        return rand.choice(space.values)
+    low, high = space.low, space.high
+    if space.log:
+        sampled = math.exp(rand.uniform(math.log(low), math.log(high)))
+    else:
+        sampled = rand.uniform(low, high)
+    return round(sampled) if space.is_int else sampled
+
+
+def check_search_space(sweep_config: SweepConfig, base_cfg: Dict[str, Any]):
+    """Reject the fields that the trials cannot change concurrently.
+
+    Args:
+        sweep_config (SweepConfig): sweep config
+        base_cfg (Dict[str, Any]): base config dict
+
+    Raises:
+        ValueError: the search space changes the shared data
+    """
+    forbidden = list(SHARED_DATA_FIELDS)
+    distillation = base_cfg.get('distillation') or {}
+    if distillation.get('logits_path') is not None:
+        forbidden.extend(RESOLUTION_FIELDS)
+    for path in sweep_config.search_space:
+        if any(
+            path == field or path.startswith('{field}.'.format(field=field))
+            for field in forbidden
+        ):
+            raise ValueError(
+                '{path} changes the data shared by the trials, '.format(
+                    path=path,
+                ) + 'run a sweep for every value instead',
+            )
+
+
+def get_trial_params(sweep_config: SweepConfig) -> List[Dict[str, Any]]:
+    """Parameters of every trial of the sweep.
+
+    The random trials come from a seeded generator, so a resumed sweep
+    or a sweep with more n_trials starts with the same trials.
+
+    Args:
+        sweep_config (SweepConfig): sweep config
+
+    Raises:
+        ValueError: unknown method or a grid parameter without values
+
+    Returns:
+        List[Dict[str, Any]]: values of the swept fields, without duplicates
+    """
+    names = sorted(sweep_config.search_space)
+    spaces = [sweep_config.search_space[name] for name in names]
+    if sweep_config.method == GRID:
+        if any(space.values is None for space in spaces):
+            raise ValueError('Grid sweep needs values of every parameter')
+        all_values = [space.values for space in spaces]
+        all_params = [
+            dict(zip(names, grid_values))
+            for grid_values in itertools.product(*all_values)
+        ]
+    elif sweep_config.method == RANDOM:
+        rand = random.Random(sweep_config.seed)
+        all_params = [
+            {
+                name: sample_value(space, rand)
+                for name, space in zip(names, spaces)
+            }
+            for _ in range(sweep_config.n_trials)
+        ]
+    else:
+        raise ValueError(
+            'Unknown sweep method {name}, expected {grid} or {random}'.format(
+                name=sweep_config.method, grid=GRID, random=RANDOM,
+            ),
+        )
+    unique_params = {
+        get_trial_id(params): params for params in reversed(all_params)
+    }
+    return list(reversed(unique_params.values()))
+
+
+def set_value(cfg: Dict[str, Any], path: str, param_value: Any):
+    """Set a field of the config dict by its dotted path.
+
+    A list item is addressed by its index or by its name, e.g.
+    'losses.bce.weight'.
+
+    Args:
+        cfg (Dict[str, Any]): config dict
+        path (str): dotted path
+        param_value (Any): value
+
+    Raises:
+        KeyError: the path is not in the config
+    """
+    *parent_keys, last_key = path.split('.')
+    node: Any = cfg
+    for key in parent_keys:
+        if isinstance(node, list):
+            names = [
+                item.get('name') if isinstance(item, dict) else None
+                for item in node
+            ]
+            if key.isdigit() and int(key) < len(node):
+                node = node[int(key)]
+            elif key in names:
+                node = node[names.index(key)]
+            else:
+                raise KeyError('{key} of {path} is not in the config'.format(
+                    key=key, path=path,
+                ))
+        elif isinstance(node, dict) and key in node:
+            node = node[key]
+        else:
+            raise KeyError('{key} of {path} is not in the config'.format(
+                key=key, path=path,
+            ))
+    if not isinstance(node, dict):
+        raise KeyError('{path} is not in the config'.format(path=path))
+    node[last_key] = param_value
+
+
+def get_trial_config(
+    base_cfg: Dict[str, Any],
+    params: Dict[str, Any],
+    sweep_name: str,
+    number: int,
+) -> Dict[str, Any]:
+    """Config dict of a trial.
+
+    Args:
+        base_cfg (Dict[str, Any]): base config dict
+        params (Dict[str, Any]): values of the swept fields
+        sweep_name (str): name of the sweep
+        number (int): number of the trial
+
+    Returns:
+        Dict[str, Any]: config dict, it is validated by Config
+    """
+    cfg = copy.deepcopy(base_cfg)
+    for path, param_value in params.items():
+        set_value(cfg, path, param_value)
+    cfg['experiment_name'] = os.path.join(
+        sweep_name, 'trial_{number:03d}'.format(number=number),
+    )
+    Config(**cfg)
+    return cfg
+
+
+def get_data_configs(cfgs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Config of every distinct data of the trials.
+
+    Args:
+        cfgs (List[Dict[str, Any]]): config dicts of the trials
+
+    Returns:
+        List[Dict[str, Any]]: copies of the configs that prepare the data
+    """
+    data_cfgs: Dict[str, Dict[str, Any]] = {}
+    for cfg in cfgs:
+        key = json.dumps(
+            {field: cfg.get(field) for field in DATA_FIELDS},
+            sort_keys=True,
+            default=str,
+        )
+        data_cfgs.setdefault(key, copy.deepcopy(cfg))
+    return list(data_cfgs.values())
+
+
+def get_cpu_slots(
+    n_workers: int,
+    threads_per_trial: int,
+) -> List[Optional[List[int]]]:
+    """Disjoint CPUs of every worker.
+
+    Args:
+        n_workers (int): number of worker processes
+        threads_per_trial (int): threads of a trial
+
+    Returns:
+        List[Optional[List[int]]]: CPUs of every worker or None if the
+        workers are not pinned, e.g. there are fewer CPUs than threads
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        return [None] * n_workers
+    cpus = sorted(os.sched_getaffinity(0))
+    if n_workers * threads_per_trial > len(cpus):
+        return [None] * n_workers
+    return [
+        cpus[worker * threads_per_trial:(worker + 1) * threads_per_trial]
+        for worker in range(n_workers)
+    ]
+
+
+def init_worker(cpu_slots: 'multiprocessing.Queue', n_threads: int):
+    """Give the worker process its thread budget.
+
+    The worker is pinned to its CPUs, so the 'auto' number of DataLoader
+    workers is computed from them too.
+
+    Args:
+        cpu_slots (multiprocessing.Queue): CPUs of the workers
+        n_threads (int): threads of a trial
+    """
+    logging.basicConfig(level=logging.INFO)
+    cpus = cpu_slots.get()
+    if cpus is not None:
+        os.sched_setaffinity(0, cpus)
+    for env_var in THREAD_ENV_VARS:
+        os.environ[env_var] = str(n_threads)
+    import torch  # noqa: WPS433 only the workers need torch
+
+    torch.set_num_threads(n_threads)
+
+
+def prepare_trial_data(cfg: Dict[str, Any]):
+    """Prepare the splits, caches and stores of a trial in a worker process.
+
+    Args:
+        cfg (Dict[str, Any]): config dict of the trial
+    """
+    from src.train import create_modules  # noqa: WPS433
+
+    _, datamodule = create_modules(Config(**cfg))
+    datamodule.prepare_data()
+
+
+def run_trial(
+    cfg: Dict[str, Any],
+    trial: TrialRecord,
+    store_path: str,
+    pruning: Optional[PruningConfig],
+) -> Tuple[str, Optional[float]]:
+    """Train the model of a trial in a worker process.
+
+    Args:
+        cfg (Dict[str, Any]): config dict of the trial
+        trial (TrialRecord): trial
+        store_path (str): path to the store of the sweep
+        pruning (Optional[PruningConfig]): pruning config, None to train
+            every trial to the end
+
+    Returns:
+        Tuple[str, Optional[float]]: status and best monitored metric
+    """
+    # the sweep process does not train, it does not import them.
+    import pytorch_lightning as pl  # noqa: WPS433
+
+    from src.callbacks import TrialPruning  # noqa: WPS433
+    from src.sweep_store import MedianPruner  # noqa: WPS433
+    from src.train import train  # noqa: WPS433
+
+    config = Config(**cfg)
+    store = create_store(store_path)
+    trial.started = time.time()
+    store.start_trial(trial)
+    pruner = None
+    if pruning is not None:
+        pruner = MedianPruner(store, config.monitor_mode, **pruning.dict())
+    pruning_callback = TrialPruning(
+        store, trial.trial_id, config.monitor_metric, pruner,
+    )
+    pl.seed_everything(TRIAL_SEED, workers=True)
+    try:
+        best_value = train(config, extra_callbacks=[pruning_callback])
+    except Exception as error:  # noqa: WPS424
+        # a failed trial must not stop the sweep.
+        logging.exception('Trial {number} failed'.format(number=trial.number))
+        store.finish_trial(trial.trial_id, FAILED, error=repr(error))
+        return FAILED, None
+    status = PRUNED if pruning_callback.is_pruned else COMPLETE
+    store.finish_trial(trial.trial_id, status, best_value)
+    return status, best_value
+
+
+def run_sweep(  # noqa: WPS210
+    base_cfg: Dict[str, Any],
+    sweep_config: SweepConfig,
+) -> Dict[str, TrialRecord]:
+    """Run the trials that are not finished in the store.
+
+    Args:
+        base_cfg (Dict[str, Any]): base config dict
+        sweep_config (SweepConfig): sweep config
+
+    Returns:
+        Dict[str, TrialRecord]: all trials of the store
+    """
+    check_search_space(sweep_config, base_cfg)
+    sweep_path = os.path.join(EXPERIMENTS_PATH, sweep_config.name)
+    store_path = os.path.join(sweep_path, sweep_config.store)
+    store = create_store(store_path)
+    finished = {
+        trial_id
+        for trial_id, trial in store.load_trials().items()
+        if trial.status in FINISHED
+    }
+    trials = []
+    for number, params in enumerate(get_trial_params(sweep_config)):
+        trial_id = get_trial_id(params)
+        if trial_id not in finished:
+            cfg = get_trial_config(base_cfg, params, sweep_config.name, number)
+            trials.append((cfg, TrialRecord(
+                trial_id=trial_id, number=number, params=params,
+            )))
+    logging.info(
+        'Sweep {name}: {n} trials to run, {n_finished} finished, '.format(
+            name=sweep_config.name, n=len(trials), n_finished=len(finished),
+        ) + 'store {path}'.format(path=store_path),
+    )
+
+    n_workers = max(1, min(sweep_config.n_workers, len(trials)))
+    n_threads = sweep_config.threads_per_trial or max(
+        1, (os.cpu_count() or 1) // n_workers,
+    )
+    context = multiprocessing.get_context('spawn')
+    cpu_slots = context.Queue()
+    for cpus in get_cpu_slots(n_workers, n_threads):
+        cpu_slots.put(cpus)
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=context,
+        initializer=init_worker,
+        initargs=(cpu_slots, n_threads),
+    ) as executor:
+        # the trials share the data folder: it is prepared here one data
+        # config at a time, and the trials skip prepare_data.
+        for data_cfg in get_data_configs([cfg for cfg, _ in trials]):
+            executor.submit(prepare_trial_data, data_cfg).result()
+        for cfg, _ in trials:
+            cfg['data_config']['prepare_data'] = False
+        futures = {
+            executor.submit(
+                run_trial, cfg, trial, store_path, sweep_config.pruning,
+            ): trial
+            for cfg, trial in trials
+        }
+        for future in as_completed(futures):
+            status, best_value = future.result()
+            logging.info('Trial {number} {status}: {monitor} {value}'.format(
+                number=futures[future].number,
+                status=status,
+                monitor=base_cfg['monitor_metric'],
+                value=best_value,
+            ))
+    return store.load_trials()
+
+
+def format_summary(trials: Dict[str, TrialRecord], mode: str) -> str:
+    """Markdown table of the trials from the best one.
+
+    Args:
+        trials (Dict[str, TrialRecord]): trials
+        mode (str): 'max' or 'min'
+
+    Returns:
+        str: table
+    """
+    sign = -1 if mode == 'max' else 1
+    lines = [
+        '| trial | status | value | epochs | minutes | params |',
+        '| --- | --- | --- | --- | --- | --- |',
+    ]
+    for trial in sorted(
+        trials.values(),
+        key=lambda record: (record.value is None, sign * (record.value or 0)),
+    ):
+        minutes = 0
+        if trial.finished and trial.started:
+            minutes = (trial.finished - trial.started) / 60
+        row = '| {number} | {status} | {value} | {epochs} | {minutes:.1f} |'
+        trial_value = '-'
+        if trial.value is not None:
+            trial_value = '{0:.4f}'.format(trial.value)
+        lines.append(row.format(
+            number=trial.number,
+            status=trial.status,
+            value=trial_value,
+            epochs=len(trial.intermediate),
+            minutes=minutes,
+        ) + ' {params} |'.format(params=', '.join(
+            '{name}={value}'.format(name=name, value=param_value)
+            for name, param_value in sorted(trial.params.items())
+        )))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    args = arg_parse()
+    logging.basicConfig(level=logging.INFO)
+    base_cfg = OmegaConf.to_container(
+        OmegaConf.load(args.config_file), resolve=True,
+    )
+    sweep_config = SweepConfig.from_yaml(args.sweep_file)
+    all_trials = run_sweep(base_cfg, sweep_config)
+    print(format_summary(  # noqa: WPS421
+        all_trials, base_cfg['monitor_mode'],
+    ))
@@ -0,0 +1,429 @@
+"""Store of the sweep trials shared by the trial processes and the pruner."""
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import time
+from contextlib import closing
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional
+
+RUNNING = 'running'
+COMPLETE = 'complete'
+PRUNED = 'pruned'
+FAILED = 'failed'
+# trials that are not run again when the sweep is resumed.
+FINISHED = (COMPLETE, PRUNED)
+SQLITE_TIMEOUT = 60
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    trial_id TEXT PRIMARY KEY,
+    number INTEGER,
+    params TEXT,
+    status TEXT,
+    value REAL,
+    error TEXT,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS intermediate (
+    trial_id TEXT,
+    epoch INTEGER,
+    value REAL,
+    PRIMARY KEY (trial_id, epoch)
+);
+"""
+
+
+def get_trial_id(params: Dict[str, Any]) -> str:
+    """Identify a trial by its parameters.
+
+    Args:
+        params (Dict[str, Any]): values of the swept fields
+
+    Returns:
+        str: sha256 hex digest prefix
+    """
+    params_json = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(params_json.encode()).hexdigest()[:16]
+
+
+@dataclass
+class TrialRecord:  # noqa: WPS306
+    """Parameters, status and metric values of a trial."""
+    trial_id: str
+    number: int
+    params: Dict[str, Any]
+    status: str = RUNNING
+    value: Optional[float] = None
+    error: Optional[str] = None
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    # monitored metric of every validated epoch.
+    intermediate: Dict[int, float] = field(default_factory=dict)
+
+
+class SweepStore:
+    """Trials of a sweep.
+
+    Every method opens the file again, so the store can be used from
+    several processes at once.
+    """
+
+    def start_trial(self, trial: TrialRecord):
+        """Record a running trial, the values of its previous run are dropped.
+
+        Args:
+            trial (TrialRecord): trial
+        """
+
+    def report(self, trial_id: str, epoch: int, value: float):
+        """Record the monitored metric of an epoch.
+
+        Args:
+            trial_id (str): trial id
+            epoch (int): epoch
+            value (float): metric
+        """
+
+    def finish_trial(
+        self,
+        trial_id: str,
+        status: str,
+        value: Optional[float] = None,
+        error: Optional[str] = None,
+    ):
+        """Record the result of a trial.
+
+        Args:
+            trial_id (str): trial id
+            status (str): complete, pruned or failed
+            value (Optional[float]): best monitored metric
+            error (Optional[str]): error of a failed trial
+        """
+
+    def load_trials(self) -> Dict[str, TrialRecord]:
+        """Read all trials.
+
+        Returns:
+            Dict[str, TrialRecord]: trials by id
+        """
+        return {}
+
+
+class SqliteStore(SweepStore):
+    """Trials and intermediate values in SQLite tables."""
+
+    def __init__(self, path: str):
+        """Initialize an instance of the class.
+
+        Args:
+            path (str): path to the database
+        """
+        self.path = path
+        with closing(self._connect()) as connection:
+            connection.executescript(SQLITE_SCHEMA)
+
+    def start_trial(self, trial: TrialRecord):
+        """Record a running trial, the values of its previous run are dropped.
+
+        Args:
+            trial (TrialRecord): trial
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO trials '
+                + 'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    trial.trial_id,
+                    trial.number,
+                    json.dumps(trial.params),
+                    trial.status,
+                    trial.value,
+                    trial.error,
+                    trial.started,
+                    trial.finished,
+                ),
+            )
+            connection.execute(
+                'DELETE FROM intermediate WHERE trial_id = ?',
+                (trial.trial_id,),
+            )
+
+    def report(self, trial_id: str, epoch: int, value: float):
+        """Record the monitored metric of an epoch.
+
+        Args:
+            trial_id (str): trial id
+            epoch (int): epoch
+            value (float): metric
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO intermediate VALUES (?, ?, ?)',
+                (trial_id, epoch, value),
+            )
+
+    def finish_trial(
+        self,
+        trial_id: str,
+        status: str,
+        value: Optional[float] = None,
+        error: Optional[str] = None,
+    ):
+        """Record the result of a trial.
+
+        Args:
+            trial_id (str): trial id
+            status (str): complete, pruned or failed
+            value (Optional[float]): best monitored metric
+            error (Optional[str]): error of a failed trial
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'UPDATE trials SET status = ?, value = ?, error = ?, '
+                + 'finished = ? WHERE trial_id = ?',
+                (status, value, error, time.time(), trial_id),
+            )
+
+    def load_trials(self) -> Dict[str, TrialRecord]:
+        """Read all trials.
+
+        Returns:
+            Dict[str, TrialRecord]: trials by id
+        """
+        with closing(self._connect()) as connection:
+            trial_rows = connection.execute(
+                'SELECT * FROM trials',
+            ).fetchall()
+            intermediate_rows = connection.execute(
+                'SELECT * FROM intermediate',
+            ).fetchall()
+        trials = {}
+        for trial_id, number, params, *row in trial_rows:
+            status, value, error, started, finished = row
+            trials[trial_id] = TrialRecord(
+                trial_id=trial_id,
+                number=number,
+                params=json.loads(params),
+                status=status,
+                value=value,
+                error=error,
+                started=started,
+                finished=finished,
+            )
+        for trial_id, epoch, value in intermediate_rows:  # noqa: WPS440
+            if trial_id in trials:
+                trials[trial_id].intermediate[epoch] = value
+        return trials
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+
+
+class JsonlStore(SweepStore):
+    """Append-only log of the trial events, one JSON line per event.
+
+    A line is written with a single append, so the processes do not
+    interleave their events.
+    """
+
+    def __init__(self, path: str):
+        """Initialize an instance of the class.
+
+        Args:
+            path (str): path to the log
+        """
+        self.path = path
+
+    def start_trial(self, trial: TrialRecord):
+        """Record a running trial, the values of its previous run are dropped.
+
+        Args:
+            trial (TrialRecord): trial
+        """
+        record = asdict(trial)
+        record.pop('intermediate')
+        self._append({'event': 'start', **record})
+
+    def report(self, trial_id: str, epoch: int, value: float):
+        """Record the monitored metric of an epoch.
+
+        Args:
+            trial_id (str): trial id
+            epoch (int): epoch
+            value (float): metric
+        """
+        self._append({
+            'event': 'report',
+            'trial_id': trial_id,
+            'epoch': epoch,
+            'value': value,
+        })
+
+    def finish_trial(
+        self,
+        trial_id: str,
+        status: str,
+        value: Optional[float] = None,
+        error: Optional[str] = None,
+    ):
+        """Record the result of a trial.
+
+        Args:
+            trial_id (str): trial id
+            status (str): complete, pruned or failed
+            value (Optional[float]): best monitored metric
+            error (Optional[str]): error of a failed trial
+        """
+        self._append({
+            'event': 'finish',
+            'trial_id': trial_id,
+            'status': status,
+            'value': value,
+            'error': error,
+            'finished': time.time(),
+        })
+
+    def load_trials(self) -> Dict[str, TrialRecord]:
+        """Replay the events.
+
+        Returns:
+            Dict[str, TrialRecord]: trials by id
+        """
+        trials: Dict[str, TrialRecord] = {}
+        if not os.path.exists(self.path):
+            return trials
+        with open(self.path) as events_file:
+            for line in events_file:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                kind = event.pop('event')
+                trial_id = event.pop('trial_id')
+                if kind == 'start':
+                    trials[trial_id] = TrialRecord(trial_id=trial_id, **event)
+                elif trial_id not in trials:
+                    continue
+                elif kind == 'report':
+                    intermediate = trials[trial_id].intermediate
+                    intermediate[event['epoch']] = event['value']
+                elif kind == 'finish':
+                    for key, event_value in event.items():
+                        setattr(trials[trial_id], key, event_value)
+        return trials
+
+    def _append(self, event: Dict[str, Any]):
+        with open(self.path, 'a') as events_file:
+            events_file.write(json.dumps(event) + '\n')
+
+
+def create_store(path: str) -> SweepStore:
+    """Create the store by the file extension.
+
+    Args:
+        path (str): .db, .sqlite or .jsonl file
+
+    Raises:
+        ValueError: unknown extension
+
+    Returns:
+        SweepStore: store
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    extension = os.path.splitext(path)[1]
+    if extension in {'.db', '.sqlite'}:
+        return SqliteStore(path)
+    if extension == '.jsonl':
+        return JsonlStore(path)
+    raise ValueError(
+        'Unknown sweep store {path}, expected .db, .sqlite or .jsonl'.format(
+            path=path,
+        ),
+    )
+
+
+def get_best_value(
+    intermediate: Dict[int, float],
+    epoch: int,
+    mode: str,
+) -> Optional[float]:
+    """Best metric of a trial up to an epoch.
+
+    Args:
+        intermediate (Dict[int, float]): metric of every epoch
+        epoch (int): last epoch
+        mode (str): 'max' or 'min'
+
+    Returns:
+        Optional[float]: best metric or None if the trial has not reached
+        the epoch
+    """
+    if epoch not in intermediate:
+        return None
+    values = [
+        epoch_value
+        for value_epoch, epoch_value in intermediate.items()
+        if value_epoch <= epoch
+    ]
+    return max(values) if mode == 'max' else min(values)
+
+
+class MedianPruner:
+    """Prune a trial that is worse than the median of the other trials.
+
+    The best metric of the trial up to an epoch is compared to the median
+    of the best metrics of the other trials that have reached the epoch.
+    """
+
+    def __init__(
+        self,
+        store: SweepStore,
+        mode: str,
+        n_startup_trials: int = 3,
+        n_warmup_epochs: int = 1,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            store (SweepStore): store of the sweep
+            mode (str): 'max' or 'min'
+            n_startup_trials (int): trials that must reach an epoch before
+                the others are compared to them. Defaults to 3.
+            n_warmup_epochs (int): epochs of every trial that are never
+                pruned. Defaults to 1.
+        """
+        self.store = store
+        self.mode = mode
+        self.n_startup_trials = n_startup_trials
+        self.n_warmup_epochs = n_warmup_epochs
+
+    def should_prune(self, trial_id: str, epoch: int) -> bool:
+        """Check the trial after its reported epoch.
+
+        Args:
+            trial_id (str): trial id
+            epoch (int): epoch
+
+        Returns:
+            bool: True if the trial must be stopped
+        """
+        if epoch < self.n_warmup_epochs:
+            return False
+        trials = self.store.load_trials()
+        trial_value = get_best_value(
+            trials[trial_id].intermediate, epoch, self.mode,
+        )
+        other_values = [
+            get_best_value(trial.intermediate, epoch, self.mode)
+            for other_id, trial in trials.items()
+            if other_id != trial_id and trial.status != FAILED
+        ]
+        other_values = [value for value in other_values if value is not None]
+        if trial_value is None or len(other_values) < self.n_startup_trials:
+            return False
+        median = statistics.median(other_values)
+        if self.mode == 'max':
+            return trial_value < median
+        return trial_value > median
@@ -0,0 +1,221 @@
+"""Per-class threshold search for the multilabel predictions."""
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.5
+THRESHOLDS_SUFFIX = '_thresholds.json'
+
+
+def arg_parse():
+    """Arg parse.
+
+    Returns:
+        _type_: _description_
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('checkpoint', type=str, help='model checkpoint')
+    parser.add_argument(
+        '--beta', type=float, default=1.0, help='1 for F1, 2 for F2',
+    )
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--n_workers', type=int, default=4)
+    parser.add_argument('--data_path', type=str, default=None)
+    return parser.parse_args()
+
+
+def search_thresholds(
+    probs: np.ndarray,
+    labels: np.ndarray,
+    beta: float = 1.0,
+    n_candidates: int = 99,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the threshold of every class maximizing F-beta.
+
+    All classes and candidate thresholds are evaluated at once: every
+    probability is put into the bin of the candidates below it, and the
+    reverse cumulative sum of the bins gives the number of predicted
+    positives and true positives for every candidate.
+
+    Args:
+        probs (np.ndarray): probabilities [n_images, n_classes]
+        labels (np.ndarray): one-hot labels [n_images, n_classes]
+        beta (float): weight of recall, 1 for F1, 2 for F2. Defaults to 1.
+        n_candidates (int): candidates evenly spaced in (0, 1). Defaults to 99.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: thresholds and F-beta of every class
+    """
+    n_classes = probs.shape[1]
+    candidates = np.linspace(0, 1, n_candidates + 2)[1:-1]
+    # prob >= candidates[k] for every k < bins.
+    bins = np.searchsorted(candidates, probs, side='right')
+    flat_bins = (bins + np.arange(n_classes) * (n_candidates + 1)).ravel()
+    n_bins = n_classes * (n_candidates + 1)
+    positives = labels.ravel() > 0
+
+    pred_counts = np.bincount(flat_bins, minlength=n_bins)
+    tp_counts = np.bincount(flat_bins[positives], minlength=n_bins)
+    pred_counts = pred_counts.reshape(n_classes, n_candidates + 1)
+    tp_counts = tp_counts.reshape(n_classes, n_candidates + 1)
+
+    # counts of prob >= candidates[k] for k = 0..n_candidates - 1.
+    n_pred = np.cumsum(pred_counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    tp = np.cumsum(tp_counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    n_true = labels.sum(axis=0)[:, None]
+
+    beta2 = beta ** 2
+    denominator = beta2 * n_true + n_pred
+    scores = np.divide(
+        (1 + beta2) * tp,
+        denominator,
+        out=np.zeros(tp.shape, dtype=np.float64),
+        where=denominator > 0,
+    )
+    best = scores.argmax(axis=1)
+    thresholds = candidates[best]
+    best_scores = scores[np.arange(n_classes), best]
+    # argmax of all zero scores is the lowest candidate, keep the default.
+    no_signal = (n_true[:, 0] == 0) | (best_scores == 0)
+    thresholds[no_signal] = DEFAULT_THRESHOLD
+    return thresholds, best_scores
+
+
+def get_thresholds_path(checkpoint_path: str) -> str:
+    """Path of the thresholds saved next to the checkpoint.
+
+    Args:
+        checkpoint_path (str): model checkpoint
+
+    Returns:
+        str: path to json file
+    """
+    return os.path.splitext(checkpoint_path)[0] + THRESHOLDS_SUFFIX
+
+
+def save_thresholds(
+    checkpoint_path: str,
+    thresholds: np.ndarray,
+    scores: np.ndarray,
+    beta: float,
+):
+    """Save the thresholds next to the checkpoint.
+
+    Args:
+        checkpoint_path (str): model checkpoint
+        thresholds (np.ndarray): threshold of every class
+        scores (np.ndarray): validation F-beta of every class
+        beta (float): beta of F-beta
+    """
+    with open(get_thresholds_path(checkpoint_path), 'w') as thresholds_file:
+        json.dump(
+            {
+                'beta': beta,
+                'thresholds': thresholds.tolist(),
+                'scores': scores.tolist(),
+            },
+            thresholds_file,
+            indent=2,
+        )
+
+
+def load_thresholds(checkpoint_path: str, num_classes: int) -> np.ndarray:
+    """Load the thresholds saved next to the checkpoint.
+
+    Args:
+        checkpoint_path (str): model checkpoint
+        num_classes (int): number of classes
+
+    Returns:
+        np.ndarray: thresholds, DEFAULT_THRESHOLD if they are not saved
+    """
+    path = get_thresholds_path(checkpoint_path)
+    if not os.path.exists(path):
+        return np.full(num_classes, DEFAULT_THRESHOLD, dtype=np.float32)
+    with open(path) as thresholds_file:
+        thresholds = json.load(thresholds_file)['thresholds']
+    return np.array(thresholds, dtype=np.float32)
+
+
+def tune_thresholds(
+    checkpoint_path: str,
+    probs: np.ndarray,
+    labels: np.ndarray,
+    beta: float = 1.0,
+    save: bool = True,
+) -> np.ndarray:
+    """Search the thresholds on validation outputs and save them.
+
+    Args:
+        checkpoint_path (str): model checkpoint
+        probs (np.ndarray): validation probabilities [n_images, n_classes]
+        labels (np.ndarray): validation labels [n_images, n_classes]
+        beta (float): weight of recall, 1 for F1, 2 for F2. Defaults to 1.
+        save (bool): save next to the checkpoint, only rank zero does it in
+        distributed training. Defaults to True.
+
+    Returns:
+        np.ndarray: thresholds
+    """
+    start_time = time.perf_counter()
+    thresholds, scores = search_thresholds(probs, labels, beta=beta)
+    logging.info(
+        'Thresholds found in {ms:.1f} ms, mean F{beta:g}: {score:.3f}'.format(
+            ms=(time.perf_counter() - start_time) * 1000,
+            beta=beta,
+            score=scores.mean(),
+        ),
+    )
+    if save:
+        save_thresholds(checkpoint_path, thresholds, scores, beta)
+    return thresholds
+
+
+def collect_outputs(
+    module,
+    dataloader,
+) -> Dict[str, np.ndarray]:
+    """Collect validation probabilities and labels once.
+
+    Args:
+        module (_type_): PosterModule
+        dataloader (_type_): validation dataloader
+
+    Returns:
+        Dict[str, np.ndarray]: probs and labels
+    """
+    import torch  # noqa: WPS433
+
+    probs, labels = [], []
+    with torch.inference_mode():
+        for images, gt_labels in dataloader:
+            probs.append(torch.sigmoid(module(images)).numpy())
+            labels.append(gt_labels.numpy())
+    return {'probs': np.concatenate(probs), 'labels': np.concatenate(labels)}
+
+
+if __name__ == '__main__':
+    from src.datamodule import get_split_dataloader  # noqa: WPS433
+    from src.predict import load_module  # noqa: WPS433
+
+    args = arg_parse()
+    logging.basicConfig(level=logging.INFO)
+    module = load_module(args.checkpoint)
+    data_config = module.hparams.config.data_config
+    if args.data_path is not None:
+        data_config = data_config.copy(update={'data_path': args.data_path})
+    outputs = collect_outputs(
+        module,
+        get_split_dataloader(
+            data_config,
+            'valid',
+            batch_size=args.batch_size,
+            n_workers=args.n_workers,
+        ),
+    )
+    tune_thresholds(args.checkpoint, beta=args.beta, **outputs)
@@ -0,0 +1,387 @@
+"""Experiment tracking backends and the buffered Lightning logger."""
+import csv
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+from pytorch_lightning.loggers import Logger
+from pytorch_lightning.utilities import rank_zero_only
+
+CLEARML = 'clearml'
+LOCAL = 'local'
+OFF = 'off'
+TRACKING_BACKENDS = (CLEARML, LOCAL, OFF)
+METRICS_JSONL = 'metrics.jsonl'
+METRICS_CSV = 'metrics.csv'
+HPARAMS_JSON = 'hparams.json'
+
+# metrics, global step and the time they were logged.
+METRICS_TYPE = Tuple[Dict[str, float], Optional[int], float]
+RECORD_TYPE = Tuple[str, Dict[str, Any], Optional[int], float]
+
+
+class TrackingBackend:
+    """Writer of hyperparameters and metrics.
+
+    All methods are called from the flushing thread of BufferedLogger.
+    """
+
+    def open(self):
+        """Prepare the backend, may block on network or disk."""
+
+    def log_hparams(self, params: Dict[str, Any]):
+        """Write hyperparameters.
+
+        Args:
+            params (Dict[str, Any]): hyperparameters
+        """
+
+    def log_metrics(self, metrics: List[METRICS_TYPE]):
+        """Write a batch of metrics.
+
+        Args:
+            metrics (List[METRICS_TYPE]): metrics, steps and times
+                in the logging order
+        """
+
+    def close(self):
+        """Release the resources."""
+
+
+class LocalBackend(TrackingBackend):
+    """Offline backend: metrics go to JSONL and long-format CSV files."""
+
+    def __init__(self, save_dir: str):
+        """Initialize an instance of the class.
+
+        Args:
+            save_dir (str): directory of the files
+        """
+        self.save_dir = save_dir
+        self._jsonl_file = None
+        self._csv_file = None
+        self._csv_writer = None
+
+    def open(self):
+        """Open the metric files in append mode."""
+        os.makedirs(self.save_dir, exist_ok=True)
+        self._jsonl_file = open(  # noqa: WPS515 closed in close()
+            os.path.join(self.save_dir, METRICS_JSONL), 'a',
+        )
+        csv_path = os.path.join(self.save_dir, METRICS_CSV)
+        is_new = not os.path.exists(csv_path)
+        self._csv_file = open(csv_path, 'a', newline='')  # noqa: WPS515
+        self._csv_writer = csv.writer(self._csv_file)
+        if is_new:
+            self._csv_writer.writerow(['time', 'step', 'name', 'value'])
+
+    def log_hparams(self, params: Dict[str, Any]):
+        """Write hyperparameters to hparams.json.
+
+        Args:
+            params (Dict[str, Any]): hyperparameters
+        """
+        hparams_path = os.path.join(self.save_dir, HPARAMS_JSON)
+        with open(hparams_path, 'w') as hparams_file:
+            json.dump(params, hparams_file, indent=2, default=str)
+
+    def log_metrics(self, metrics: List[METRICS_TYPE]):
+        """Append a batch of metrics to the files.
+
+        Args:
+            metrics (List[METRICS_TYPE]): metrics, steps and times
+        """
+        for step_metrics, step, timestamp in metrics:
+            self._jsonl_file.write(json.dumps(
+                {'time': timestamp, 'step': step, **step_metrics},
+            ))
+            self._jsonl_file.write('\n')
+            self._csv_writer.writerows(
+                (timestamp, step, name, value_metric)
+                for name, value_metric in step_metrics.items()
+            )
+        self._jsonl_file.flush()
+        self._csv_file.flush()
+
+    def close(self):
+        """Close the files."""
+        for metric_file in (self._jsonl_file, self._csv_file):
+            if metric_file is not None:
+                metric_file.close()
+
+
+class ClearMLBackend(TrackingBackend):
+    """ClearML task with explicitly reported scalars.
+
+    The frameworks are not auto-connected, so ClearML does not hook into
+    torch and Lightning calls during training.
+    """
+
+    def __init__(self, project_name: str, task_name: str):
+        """Initialize an instance of the class.
+
+        Args:
+            project_name (str): ClearML project
+            task_name (str): ClearML task
+        """
+        self.project_name = project_name
+        self.task_name = task_name
+        self._task = None
+
+    def open(self):
+        """Create the task."""
+        from clearml import Task  # noqa: WPS433 clearml is slow to import
+
+        self._task = Task.init(
+            project_name=self.project_name,
+            task_name=self.task_name,
+            auto_connect_frameworks=False,
+        )
+
+    def log_hparams(self, params: Dict[str, Any]):
+        """Connect hyperparameters to the task.
+
+        Args:
+            params (Dict[str, Any]): hyperparameters
+        """
+        self._task.connect(params)
+
+    def log_metrics(self, metrics: List[METRICS_TYPE]):
+        """Report scalars, the part of the name before '_' is the title.
+
+        Args:
+            metrics (List[METRICS_TYPE]): metrics, steps and times
+        """
+        task_logger = self._task.get_logger()
+        for step_metrics, step, _ in metrics:
+            for name, value_metric in step_metrics.items():
+                task_logger.report_scalar(
+                    title=name.split('_')[0],
+                    series=name,
+                    value=value_metric,
+                    iteration=step or 0,
+                )
+
+    def close(self):
+        """Flush the task, ClearML closes it at exit."""
+        if self._task is not None:
+            self._task.flush(wait_for_uploads=True)
+
+
+class BufferedLogger(Logger):
+    """Lightning logger that writes through a background thread.
+
+    log_metrics only puts the values into a queue; the thread opens the
+    backend and writes the buffered records every flush_interval seconds,
+    so neither the task creation nor the writing stalls the training loop.
+    """
+
+    def __init__(
+        self,
+        backend: TrackingBackend,
+        name: str = '',
+        save_dir: Optional[str] = None,
+        flush_interval: float = 5,
+    ):
+        """Initialize an instance of the class.
+
+        Args:
+            backend (TrackingBackend): backend
+            name (str): experiment name
+            save_dir (Optional[str]): directory of the local files
+            flush_interval (float): seconds between writes. Defaults to 5.
+        """
+        super().__init__()
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._name = name
+        self._save_dir = save_dir
+        self._queue: 'queue.Queue[RECORD_TYPE]' = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._is_disabled = False
+        self._is_open = False
+
+    @property
+    def name(self) -> str:
+        """Experiment name.
+
+        Returns:
+            str: name
+        """
+        return self._name
+
+    @property
+    def version(self) -> Union[int, str]:
+        """Version of the experiment.
+
+        Returns:
+            Union[int, str]: version
+        """
+        return 0
+
+    @property
+    def save_dir(self) -> Optional[str]:
+        """Directory of the local files.
+
+        Returns:
+            Optional[str]: directory
+        """
+        return self._save_dir
+
+    @property
+    def experiment(self) -> TrackingBackend:
+        """Backend, it is opened by the thread on the first record.
+
+        Returns:
+            TrackingBackend: backend
+        """
+        return self.backend
+
+    @rank_zero_only
+    def log_hyperparams(self, params: Dict[str, Any]):  # noqa: WPS111
+        """Buffer hyperparameters, configs are converted to dicts.
+
+        Args:
+            params (Dict[str, Any]): hyperparameters
+        """
+        self._put(('hparams', {
+            key: param.dict() if isinstance(param, BaseModel) else param
+            for key, param in params.items()
+        }, None, time.time()))
+
+    @rank_zero_only
+    def log_metrics(
+        self,
+        metrics: Dict[str, float],
+        step: Optional[int] = None,
+    ):
+        """Buffer metrics, Lightning has already converted them to floats.
+
+        Args:
+            metrics (Dict[str, float]): metrics
+            step (Optional[int]): global step
+        """
+        self._put(('metrics', dict(metrics), step, time.time()))
+
+    @rank_zero_only
+    def finalize(self, status: str):
+        """Write the buffer and stop the thread.
+
+        Lightning calls it after every fit, test and predict, so the
+        backend stays open and the next records restart the thread.
+
+        Args:
+            status (str): status of the run
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    @rank_zero_only
+    def close(self):
+        """Write the buffer and close the backend."""
+        self.finalize('success')
+        if self._is_open:
+            self.backend.close()
+            self._is_open = False
+
+    def _put(self, record: RECORD_TYPE):
+        if self._is_disabled:
+            return
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put(record)
+
+    def _run(self):
+        if not self._is_open:
+            try:
+                self.backend.open()
+            except Exception:  # noqa: WPS424 tracking must not stop training
+                logging.exception(
+                    'Tracking backend is not available, metrics are dropped',
+                )
+                self._is_disabled = True
+                self._drain()
+                return
+            self._is_open = True
+        while not self._stop_event.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _drain(self) -> List[RECORD_TYPE]:
+        records = []
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                return records
+
+    def _flush(self):
+        records = self._drain()
+        try:
+            for kind, params, _, _ in records:  # noqa: WPS440
+                if kind == 'hparams':
+                    self.backend.log_hparams(params)
+            metrics = [
+                (step_metrics, step, timestamp)
+                for record_kind, step_metrics, step, timestamp in records
+                if record_kind == 'metrics'
+            ]
+            if metrics:
+                self.backend.log_metrics(metrics)
+        except Exception:  # noqa: WPS424
+            logging.exception('Failed to write {n} tracking records'.format(
+                n=len(records),
+            ))
+
+
+def create_logger(
+    tracking: str,
+    project_name: str,
+    experiment_name: str,
+    save_dir: str,
+    flush_interval: float = 5,
+) -> Union[BufferedLogger, bool]:
+    """Create the logger of the trainer.
+
+    Args:
+        tracking (str): 'clearml', 'local' or 'off'
+        project_name (str): project name
+        experiment_name (str): experiment name
+        save_dir (str): directory of the local files
+        flush_interval (float): seconds between writes. Defaults to 5.
+
+    Raises:
+        ValueError: unknown backend
+
+    Returns:
+        Union[BufferedLogger, bool]: logger or False to disable logging
+    """
+    if tracking == OFF:
+        return False
+    if tracking == CLEARML:
+        backend = ClearMLBackend(project_name, experiment_name)
+    elif tracking == LOCAL:
+        backend = LocalBackend(save_dir)
+    else:
+        raise ValueError(
+            'Unknown tracking backend {name}, expected one of {names}'.format(
+                name=tracking, names=TRACKING_BACKENDS,
+            ),
+        )
+    return BufferedLogger(
+        backend,
+        name=experiment_name,
+        save_dir=save_dir,
+        flush_interval=flush_interval,
+    )
@@ -2,16 +2,24 @@
 import argparse
 import logging
 import os
+from typing import List, Optional, Tuple
 
 import pytorch_lightning as pl
-from clearml import Task
+import torch
+import torch.distributed as dist
 from pytorch_lightning.callbacks import (EarlyStopping, LearningRateMonitor,
                                          ModelCheckpoint)
+from pytorch_lightning.strategies import DDPStrategy
 
+from src.callbacks import (PRCurveWriter, ResolutionPhaseMonitor,
+                           SharedCacheMonitor, ThroughputMonitor)
+from src.checkpointing import BackgroundCheckpointIO, export_safetensors
 from src.config import Config
 from src.constants import EXPERIMENTS_PATH
-from src.datamodule import PosterDM
-from src.lightning_module import PosterModule
+from src.datamodule import FeatureDM, PosterDM
+from src.lightning_module import HeadModule, PosterModule
+from src.thresholds import tune_thresholds
+from src.tracking import create_logger
 
 
 def arg_parse():
@@ -25,21 +33,86 @@ def arg_parse():
     return parser.parse_args()
 
 
-def train(config: Config):  # noqa:WPS210 all variables are needed
-    """In this function, the model is trained.
+def get_devices(config: Config):
+    """Devices of the trainer.
 
     Args:
         config (Config): config
+
+    Returns:
+        _type_: devices from the config, else the device index for GPU and
+        one process for CPU
     """
-    datamodule = PosterDM(config.data_config)
-    model = PosterModule(config)
+    if config.devices is not None:
+        return config.devices
+    if config.accelerator == 'cpu':
+        return 1
+    return [config.device]
 
-    task = Task.init(
-        project_name=config.project_name,
-        task_name=config.experiment_name,
-        auto_connect_frameworks=True,
-    )
-    task.connect(config.dict())
+
+def get_strategy(config: Config):
+    """Strategy of the trainer.
+
+    Args:
+        config (Config): config
+
+    Returns:
+        _type_: DDPStrategy with the process group backend from the config
+        (e.g. gloo for CPU processes) or the strategy name
+    """
+    if config.strategy == 'ddp' and config.process_group_backend is not None:
+        return DDPStrategy(process_group_backend=config.process_group_backend)
+    return config.strategy
+
+
+def gather_outputs(outputs: list) -> list:
+    """Gather prediction outputs of all processes.
+
+    Args:
+        outputs (list): outputs of the current process
+
+    Returns:
+        list: outputs of all processes
+    """
+    if not dist.is_available() or not dist.is_initialized():
+        return outputs
+    gathered = [None] * dist.get_world_size()
+    dist.all_gather_object(gathered, outputs)
+    return [output for rank_outputs in gathered for output in rank_outputs]
+
+
+def create_modules(config: Config) -> Tuple[PosterModule, PosterDM]:
+    """Create the module and the datamodule of the config.
+
+    Args:
+        config (Config): config
+
+    Returns:
+        Tuple[PosterModule, PosterDM]: module and datamodule, on stored
+        features in the head-only mode
+    """
+    if config.head_only is not None:
+        model = HeadModule(config)
+        return model, FeatureDM(config.data_config, model.model)
+    datamodule = PosterDM(config.data_config, distillation=config.distillation)
+    return PosterModule(config), datamodule
+
+
+def train(  # noqa:WPS210 all variables are needed
+    config: Config,
+    extra_callbacks: Optional[List[pl.Callback]] = None,
+) -> Optional[float]:
+    """In this function, the model is trained.
+
+    Args:
+        config (Config): config
+        extra_callbacks (Optional[List[pl.Callback]]): callbacks added to
+            the pipeline ones, e.g. the pruning of a sweep trial
+
+    Returns:
+        Optional[float]: best value of the monitored metric
+    """
+    model, datamodule = create_modules(config)
 
     experiment_save_path = os.path.join(
         EXPERIMENTS_PATH,
@@ -52,31 +125,83 @@ def train(config: Config):  # noqa:WPS210 all variables are needed
         monitor=config.monitor_metric,
         mode=config.monitor_mode,
         save_top_k=1,
+        save_weights_only=config.checkpoint_weights_only,
         filename='epoch_{{epoch:02d}}-{{{monitor_metric}:.3f}}'.format(
             monitor_metric=config.monitor_metric,
         ),
     )
+    logger = create_logger(
+        config.tracking,
+        project_name=config.project_name,
+        experiment_name=config.experiment_name,
+        save_dir=experiment_save_path,
+        flush_interval=config.tracking_flush_interval,
+    )
+    callbacks = [
+        checkpoint_callback,
+        EarlyStopping(
+            monitor=config.monitor_metric,
+            patience=4,
+            mode=config.monitor_mode,
+        ),
+        SharedCacheMonitor(),
+        ThroughputMonitor(),
+        PRCurveWriter(experiment_save_path),
+        ResolutionPhaseMonitor(
+            experiment_save_path,
+            monitor=config.monitor_metric,
+            mode=config.monitor_mode,
+            target=config.monitor_target,
+        ),
+    ]
+    callbacks.extend(extra_callbacks or [])
+    plugins = None
+    if config.async_checkpointing:
+        plugins = [BackgroundCheckpointIO()]
+    if logger:
+        callbacks.append(LearningRateMonitor(logging_interval='epoch'))
     trainer = pl.Trainer(
         max_epochs=config.n_epochs,
         accelerator=config.accelerator,
-        devices=[config.device],
+        devices=get_devices(config),
+        num_nodes=config.num_nodes,
+        strategy=get_strategy(config),
         log_every_n_steps=config.log_every_n_steps,
-        callbacks=[
-            checkpoint_callback,
-            EarlyStopping(
-                monitor=config.monitor_metric,
-                patience=4,
-                mode=config.monitor_mode,
-            ),
-            LearningRateMonitor(logging_interval='epoch'),
-        ],
+        precision=config.precision,
+        # the datamodule rebuilds the train dataloader when the resolution
+        # changes.
+        reload_dataloaders_every_n_epochs=int(
+            bool(config.data_config.resolution_schedule),
+        ),
+        logger=logger,
+        callbacks=callbacks,
+        plugins=plugins,
     )
 
     trainer.fit(model=model, datamodule=datamodule)
+    if config.export_safetensors and trainer.is_global_zero:
+        export_safetensors(checkpoint_callback.best_model_path)
+    if config.tune_thresholds:
+        outputs = gather_outputs(trainer.predict(
+            model,
+            dataloaders=datamodule.val_dataloader(),
+            ckpt_path=checkpoint_callback.best_model_path,
+        ))
+        model.set_thresholds(tune_thresholds(
+            checkpoint_callback.best_model_path,
+            probs=torch.cat([output['probs'] for output in outputs]).numpy(),
+            labels=torch.cat([output['labels'] for output in outputs]).numpy(),
+            beta=config.threshold_beta,
+            save=trainer.is_global_zero,
+        ))
     trainer.test(
         ckpt_path=checkpoint_callback.best_model_path,
         datamodule=datamodule,
     )
+    if logger:
+        logger.close()
+    best_score = checkpoint_callback.best_model_score
+    return None if best_score is None else float(best_score)
 
 
 if __name__ == '__main__':
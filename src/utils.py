@@ -1,8 +1,10 @@
 """Utils file."""
 import importlib
+from functools import lru_cache
 from typing import Any
 
 
+@lru_cache(maxsize=None)
 def load_object(obj_path: str, def_obj_path: str = '') -> Any:
     """Load object.
 
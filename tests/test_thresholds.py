@@ -0,0 +1,37 @@
+"""Tests of the per-class threshold search."""
+import numpy as np
+
+from src.thresholds import DEFAULT_THRESHOLD, search_thresholds
+
+
+def test_search_thresholds_without_positives():
+    """Classes without positives or true positives keep the default."""
+    probs = np.array(
+        [
+            [0.9, 0.8, 0.1],
+            [0.2, 0.7, 0.9],
+            [0.8, 0.6, 0.2],
+            [0.1, 0.3, 0.3],
+        ],
+        dtype=np.float32,
+    )
+    labels = np.array(
+        [
+            [1, 0, 0],
+            [0, 0, 0],
+            [1, 0, 0],
+            [0, 0, 1],
+        ],
+        dtype=np.float32,
+    )
+    # the only positive of the last class is found by no candidate.
+    probs[3, 2] = 0
+
+    thresholds, scores = search_thresholds(probs, labels)
+
+    assert 0.2 < thresholds[0] <= 0.8
+    assert scores[0] == 1
+    assert thresholds[1] == DEFAULT_THRESHOLD
+    assert thresholds[2] == DEFAULT_THRESHOLD
+    assert scores[1] == 0
+    assert scores[2] == 0